@@ -4,25 +4,21 @@ LINE Bot適配器
 import json
 import hashlib
 import hmac
+import time
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError, LineBotApiError
-from linebot.models import (
-    MessageEvent, TextMessage, TextSendMessage, 
-    QuickReply, QuickReplyButton, MessageAction,
-    TemplateSendMessage, CarouselTemplate, CarouselColumn,
-    PostbackAction, URIAction
-)
-
 from app.adapters.base_adapter import BaseAdapter
-from app.core.exceptions import AIServiceException
+from app.adapters.line_client import AsyncLineClient
+from app.core.exceptions import AIServiceException, LineApiError
 
 
 class LineAdapter(BaseAdapter):
     """LINE Bot適配器"""
     
+    # 每次reply或push最多可送出的訊息數
+    MAX_MESSAGES_PER_REQUEST = 5
+    
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
         
@@ -33,54 +29,186 @@ class LineAdapter(BaseAdapter):
         if not self.channel_access_token or not self.channel_secret:
             raise ValueError("LINE Bot需要channel_access_token和channel_secret")
         
-        # 初始化LINE Bot API
-        self.line_bot_api = LineBotApi(self.channel_access_token)
-        self.handler = WebhookHandler(self.channel_secret)
+        # reply token有效期限（秒），超過則直接改用push
+        self.reply_token_ttl_seconds = config.get("reply_token_ttl_seconds", 50)
+        
+        # 初始化LINE Messaging API非同步客戶端
+        self.line_client = AsyncLineClient(
+            self.channel_access_token,
+            timeout_seconds=config.get("api_timeout_seconds", 10.0),
+            max_connections=config.get("max_connections", 50),
+            max_retries=config.get("max_retries", 3),
+            retry_deadline_seconds=config.get("retry_deadline_seconds", 30.0),
+            http2=config.get("http2", False),
+            rate_limiter=config.get("rate_limiter"),
+            push_requests_per_second=config.get("push_requests_per_second", 2000.0)
+        )
+        
+        # 投遞統計
+        self.delivery_stats = {
+            "reply_count": 0,
+            "push_count": 0,
+            "reply_failed_count": 0,
+            "token_expired_count": 0,
+            "reply_latency_ms_total": 0,
+            "push_latency_ms_total": 0
+        }
     
     async def send_message(self, user_id: str, message: str, **kwargs) -> bool:
         """發送訊息給用戶"""
         try:
-            return await self.send_text_message(user_id, message)
+            return await self.send_text_message(user_id, message, **kwargs)
         except Exception as e:
             print(f"發送訊息失敗: {e}")
             return False
     
-    async def send_text_message(self, user_id: str, text: str) -> bool:
-        """發送文字訊息"""
+    async def send_text_message(
+        self,
+        user_id: str,
+        text: str,
+        reply_token: Optional[str] = None,
+        event_timestamp: Optional[int] = None
+    ) -> bool:
+        """發送文字訊息，reply token仍有效時優先使用reply，否則改用push"""
+        return await self._deliver(
+            user_id, [{"type": "text", "text": text}], reply_token, event_timestamp
+        )
+    
+    async def send_text_messages(
+        self,
+        user_id: str,
+        texts: List[str],
+        reply_token: Optional[str] = None,
+        event_timestamp: Optional[int] = None
+    ) -> bool:
+        """發送多則文字訊息，每次最多5則；第一批可使用reply token，其餘使用push"""
+        success = True
+        for start in range(0, len(texts), self.MAX_MESSAGES_PER_REQUEST):
+            messages = [
+                {"type": "text", "text": text}
+                for text in texts[start:start + self.MAX_MESSAGES_PER_REQUEST]
+            ]
+            if start == 0:
+                success = await self._deliver(user_id, messages, reply_token, event_timestamp) and success
+            else:
+                success = await self._push(user_id, messages) and success
+        return success
+    
+    def create_stream_sender(
+        self,
+        user_id: str,
+        reply_token: Optional[str] = None,
+        event_timestamp: Optional[int] = None,
+        push_interval_seconds: float = 2.0
+    ) -> "LineStreamSender":
+        """建立串流回覆的發送器"""
+        return LineStreamSender(self, user_id, reply_token, event_timestamp, push_interval_seconds)
+    
+    async def _deliver(
+        self,
+        user_id: str,
+        messages: List[Dict[str, Any]],
+        reply_token: Optional[str] = None,
+        event_timestamp: Optional[int] = None
+    ) -> bool:
+        """投遞訊息：reply token有效時使用reply，否則使用push"""
+        if reply_token:
+            if self.is_reply_token_valid(event_timestamp):
+                if await self._reply(reply_token, messages, event_timestamp):
+                    return True
+                self.delivery_stats["reply_failed_count"] += 1
+            else:
+                # AI生成時間過長，token已逾期
+                self.delivery_stats["token_expired_count"] += 1
+        
+        return await self._push(user_id, messages)
+    
+    def is_reply_token_valid(self, event_timestamp: Optional[int]) -> bool:
+        """檢查reply token是否仍在有效期限內（event_timestamp為LINE事件的毫秒時間戳）"""
+        if event_timestamp is None:
+            return True
+        age_seconds = time.time() - event_timestamp / 1000
+        return age_seconds < self.reply_token_ttl_seconds
+    
+    async def _reply(
+        self,
+        reply_token: str,
+        messages: List[Dict[str, Any]],
+        event_timestamp: Optional[int] = None
+    ) -> bool:
+        """使用reply API回覆訊息（重試不超過reply token剩餘的有效時間）"""
+        start_time = time.monotonic()
+        deadline_seconds = None
+        if event_timestamp is not None:
+            deadline_seconds = self.reply_token_ttl_seconds - (time.time() - event_timestamp / 1000)
+        try:
+            await self.line_client.reply_message(reply_token, messages, deadline_seconds=deadline_seconds)
+            self.delivery_stats["reply_count"] += 1
+            self.delivery_stats["reply_latency_ms_total"] += int((time.monotonic() - start_time) * 1000)
+            return True
+        except LineApiError as e:
+            print(f"LINE reply失敗，改用push: {e}")
+            return False
+        except Exception as e:
+            print(f"LINE reply失敗，改用push: {e}")
+            return False
+    
+    async def _push(self, user_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """使用push API發送訊息"""
+        start_time = time.monotonic()
         try:
-            message = TextSendMessage(text=text)
-            self.line_bot_api.push_message(user_id, message)
+            await self.line_client.push_message(user_id, messages)
+            self.delivery_stats["push_count"] += 1
+            self.delivery_stats["push_latency_ms_total"] += int((time.monotonic() - start_time) * 1000)
             return True
-        except LineBotApiError as e:
+        except LineApiError as e:
             print(f"LINE Bot API錯誤: {e}")
             return False
         except Exception as e:
             print(f"發送文字訊息失敗: {e}")
             return False
     
+    def get_delivery_stats(self) -> Dict[str, Any]:
+        """獲取reply與push的投遞統計"""
+        stats = self.delivery_stats
+        total = stats["reply_count"] + stats["push_count"]
+        return {
+            **stats,
+            "reply_ratio": stats["reply_count"] / total if total else 0,
+            "average_reply_latency_ms": (
+                stats["reply_latency_ms_total"] / stats["reply_count"] if stats["reply_count"] else 0
+            ),
+            "average_push_latency_ms": (
+                stats["push_latency_ms_total"] / stats["push_count"] if stats["push_count"] else 0
+            )
+        }
+    
     async def send_quick_reply(self, user_id: str, text: str, options: List[Dict[str, str]]) -> bool:
         """發送快速回覆選項"""
         try:
             # 創建快速回覆按鈕
             quick_reply_buttons = []
             for option in options:
-                button = QuickReplyButton(
-                    action=MessageAction(
-                        label=option.get("label", option.get("text", "")),
-                        text=option.get("text", option.get("label", ""))
-                    )
-                )
+                button = {
+                    "type": "action",
+                    "action": {
+                        "type": "message",
+                        "label": option.get("label", option.get("text", "")),
+                        "text": option.get("text", option.get("label", ""))
+                    }
+                }
                 quick_reply_buttons.append(button)
             
-            # 創建快速回覆
-            quick_reply = QuickReply(items=quick_reply_buttons)
-            
             # 發送訊息
-            message = TextSendMessage(text=text, quick_reply=quick_reply)
-            self.line_bot_api.push_message(user_id, message)
+            message = {
+                "type": "text",
+                "text": text,
+                "quickReply": {"items": quick_reply_buttons}
+            }
+            await self.line_client.push_message(user_id, [message])
             return True
             
-        except LineBotApiError as e:
+        except LineApiError as e:
             print(f"LINE Bot API錯誤: {e}")
             return False
         except Exception as e:
@@ -108,26 +236,28 @@ class LineAdapter(BaseAdapter):
         try:
             columns = []
             for item in template.get("columns", []):
-                column = CarouselColumn(
-                    thumbnail_image_url=item.get("thumbnail_image_url"),
-                    title=item.get("title", ""),
-                    text=item.get("text", ""),
-                    actions=[
-                        PostbackAction(
-                            label=action.get("label", ""),
-                            data=action.get("data", "")
-                        ) for action in item.get("actions", [])
+                column = {
+                    "title": item.get("title", ""),
+                    "text": item.get("text", ""),
+                    "actions": [
+                        {
+                            "type": "postback",
+                            "label": action.get("label", ""),
+                            "data": action.get("data", "")
+                        } for action in item.get("actions", [])
                     ]
-                )
+                }
+                if item.get("thumbnail_image_url"):
+                    column["thumbnailImageUrl"] = item["thumbnail_image_url"]
                 columns.append(column)
             
-            carousel_template = CarouselTemplate(columns=columns)
-            message = TemplateSendMessage(
-                alt_text=template.get("alt_text", "輪播訊息"),
-                template=carousel_template
-            )
+            message = {
+                "type": "template",
+                "altText": template.get("alt_text", "輪播訊息"),
+                "template": {"type": "carousel", "columns": columns}
+            }
             
-            self.line_bot_api.push_message(user_id, message)
+            await self.line_client.push_message(user_id, [message])
             return True
             
         except Exception as e:
@@ -272,21 +402,21 @@ class LineAdapter(BaseAdapter):
     async def get_user_profile(self, user_id: str) -> Dict[str, str]:
         """獲取用戶資料"""
         try:
-            profile = self.line_bot_api.get_profile(user_id)
+            profile = await self.line_client.get_profile(user_id)
             return {
                 "user_id": user_id,
-                "display_name": profile.display_name,
-                "picture_url": profile.picture_url,
-                "status_message": profile.status_message
+                "display_name": profile.get("displayName"),
+                "picture_url": profile.get("pictureUrl"),
+                "status_message": profile.get("statusMessage")
             }
-        except LineBotApiError as e:
+        except LineApiError as e:
             print(f"獲取用戶資料失敗: {e}")
             return {"user_id": user_id}
         except Exception as e:
             print(f"獲取用戶資料失敗: {e}")
             return {"user_id": user_id}
     
-    async def send_category_menu(self, user_id: str) -> bool:
+    async def send_category_menu(self, user_id: str, **kwargs) -> bool:
         """發送問題分類選單"""
         try:
             menu_text = """🎯 我幫你把常見的工作場景整理成五種思考模式，你需要哪一個？
@@ -310,7 +440,7 @@ class LineAdapter(BaseAdapter):
 • 輸入數字 1–5 選擇場景
 • 輸入「重置」回到選單"""
             
-            return await self.send_text_message(user_id, menu_text)
+            return await self.send_text_message(user_id, menu_text, **kwargs)
             
         except Exception as e:
             print(f"發送分類選單失敗: {e}")
@@ -356,10 +486,10 @@ class LineAdapter(BaseAdapter):
             print(f"發送重置訊息失敗: {e}")
             return False
     
-    async def send_error_message(self, user_id: str, error_message: str = "抱歉，發生了錯誤，請稍後再試。") -> bool:
+    async def send_error_message(self, user_id: str, error_message: str = "抱歉，發生了錯誤，請稍後再試。", **kwargs) -> bool:
         """發送錯誤訊息"""
         try:
-            return await self.send_text_message(user_id, error_message)
+            return await self.send_text_message(user_id, error_message, **kwargs)
         except Exception as e:
             print(f"發送錯誤訊息失敗: {e}")
             return False
@@ -368,12 +498,14 @@ class LineAdapter(BaseAdapter):
         """健康檢查"""
         try:
             # 嘗試獲取LINE Bot資訊
-            bot_info = self.line_bot_api.get_bot_info()
+            bot_info = await self.line_client.get_bot_info()
             return {
                 "platform": "line",
                 "status": "healthy",
-                "bot_id": bot_info.user_id,
-                "bot_name": bot_info.display_name,
+                "bot_id": bot_info.get("userId"),
+                "bot_name": bot_info.get("displayName"),
+                "delivery": self.get_delivery_stats(),
+                "client": self.line_client.get_stats(),
                 "timestamp": datetime.utcnow().isoformat()
             }
         except Exception as e:
@@ -383,3 +515,87 @@ class LineAdapter(BaseAdapter):
                 "error": str(e),
                 "timestamp": datetime.utcnow().isoformat()
             }
+    
+    async def close(self):
+        """關閉LINE API連線池"""
+        await self.line_client.close()
+
+
+class LineStreamSender:
+    """串流回覆發送器
+
+    第一段一產生就以reply token送出；之後的段落累積起來以push批次送出，
+    湊滿5則或距離上次送出超過間隔時送出一次，串流結束時送出剩餘段落。
+    串流中途失敗時以fail()送出剩餘段落，並以push附上回應中斷的說明（reply token已用過）。
+    """
+
+    INTERRUPTED_NOTICE = "（回應中斷，以上內容不完整）"
+
+    def __init__(
+        self,
+        adapter: LineAdapter,
+        user_id: str,
+        reply_token: Optional[str] = None,
+        event_timestamp: Optional[int] = None,
+        push_interval_seconds: float = 2.0
+    ):
+        self.adapter = adapter
+        self.user_id = user_id
+        self.reply_token = reply_token
+        self.event_timestamp = event_timestamp
+        self.push_interval_seconds = push_interval_seconds
+
+        self._pending: List[str] = []
+        self._last_sent_at = 0.0
+        self.sent_count = 0
+        self.success = True
+
+    @property
+    def has_sent(self) -> bool:
+        """是否已送出任何段落"""
+        return self.sent_count > 0
+
+    async def send(self, chunk: str):
+        """送出或暫存一個段落"""
+        if not self.has_sent:
+            self.success = await self.adapter.send_text_message(
+                self.user_id, chunk, reply_token=self.reply_token, event_timestamp=self.event_timestamp
+            )
+            self.sent_count += 1
+            self._last_sent_at = time.monotonic()
+            return
+
+        self._pending.append(chunk)
+        if (
+            len(self._pending) >= self.adapter.MAX_MESSAGES_PER_REQUEST
+            or time.monotonic() - self._last_sent_at >= self.push_interval_seconds
+        ):
+            await self._flush()
+
+    async def close(self) -> bool:
+        """送出剩餘段落，回傳是否全部送達"""
+        await self._flush()
+        return self.success
+
+    async def fail(self, error_message: str) -> bool:
+        """串流中途失敗時送出剩餘段落與中斷說明，回傳是否送達"""
+        texts, self._pending = self._pending, []
+        texts.append(f"{self.INTERRUPTED_NOTICE}\n{error_message}")
+        try:
+            # 已送出第一段，reply token已用過，一律push
+            success = await self.adapter.send_text_messages(self.user_id, texts)
+        except Exception as e:
+            print(f"發送串流中斷訊息失敗: {e}")
+            success = False
+        self.sent_count += len(texts)
+        self.success = success and self.success
+        return success
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        texts, self._pending = self._pending, []
+        # reply token已用於第一段，其餘一律push
+        self.success = await self.adapter.send_text_messages(self.user_id, texts) and self.success
+        self.sent_count += len(texts)
+        self._last_sent_at = time.monotonic()
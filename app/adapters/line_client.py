@@ -0,0 +1,176 @@
+"""
+LINE Messaging API非同步客戶端
+"""
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, Any, Optional, List
+
+import httpx
+
+from app.core.exceptions import LineApiError
+from app.core.rate_limiter import TokenBucketRateLimiter
+
+
+class AsyncLineClient:
+    """LINE Messaging API非同步客戶端
+
+    使用共用的httpx連線池（keep-alive，可選HTTP/2），
+    遇到429或5xx時以帶抖動的指數退避重試，並遵守Retry-After標頭；
+    所有重試須在retry_deadline_seconds內完成，需要等待更久時直接放棄。
+    reply在5xx或回應前斷線時不重試（LINE可能已處理，重送會因reply token已使用而失敗），
+    由呼叫端直接改用push。
+    提供rate_limiter時，push前先向跨worker共用的令牌桶預約額度。
+    """
+
+    API_BASE_URL = "https://api.line.me/v2/bot"
+    RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        channel_access_token: str,
+        timeout_seconds: float = 10.0,
+        max_connections: int = 50,
+        max_keepalive_connections: int = 20,
+        max_retries: int = 3,
+        backoff_base_seconds: float = 0.5,
+        backoff_max_seconds: float = 8.0,
+        retry_deadline_seconds: float = 30.0,
+        http2: bool = False,
+        rate_limiter: Optional[TokenBucketRateLimiter] = None,
+        push_requests_per_second: float = 2000.0
+    ):
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.retry_deadline_seconds = retry_deadline_seconds
+        self.rate_limiter = rate_limiter
+        self.push_requests_per_second = push_requests_per_second
+
+        self._client = httpx.AsyncClient(
+            base_url=self.API_BASE_URL,
+            headers={"Authorization": f"Bearer {channel_access_token}"},
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections
+            ),
+            timeout=httpx.Timeout(timeout_seconds, connect=5.0),
+            http2=http2
+        )
+
+        # 統計資訊
+        self.request_count = 0
+        self.retry_count = 0
+        self.error_count = 0
+
+    async def reply_message(
+        self,
+        reply_token: str,
+        messages: List[Dict[str, Any]],
+        deadline_seconds: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """使用reply token回覆訊息（最多5則；deadline_seconds為reply token剩餘的有效時間）"""
+        return await self._request(
+            "POST", "/message/reply",
+            json={"replyToken": reply_token, "messages": messages},
+            deadline_seconds=deadline_seconds,
+            idempotent=False
+        )
+
+    async def push_message(self, to: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """推送訊息給用戶（最多5則）"""
+        if self.rate_limiter:
+            await self.rate_limiter.acquire([("line:push", self.push_requests_per_second, 1)])
+        # 重試時使用相同的retry key，避免LINE重複推送
+        return await self._request(
+            "POST", "/message/push",
+            json={"to": to, "messages": messages},
+            headers={"X-Line-Retry-Key": str(uuid.uuid4())}
+        )
+
+    async def get_profile(self, user_id: str) -> Dict[str, Any]:
+        """獲取用戶資料"""
+        return await self._request("GET", f"/profile/{user_id}")
+
+    async def get_bot_info(self) -> Dict[str, Any]:
+        """獲取機器人資訊"""
+        return await self._request("GET", "/info")
+
+    async def close(self):
+        """關閉連線池"""
+        await self._client.aclose()
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        json: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        deadline_seconds: Optional[float] = None,
+        idempotent: bool = True
+    ) -> Dict[str, Any]:
+        """發送請求，必要時在期限內重試（idempotent=False時只重試確定未處理的錯誤：連線失敗與429）"""
+        if deadline_seconds is None:
+            deadline_seconds = self.retry_deadline_seconds
+        deadline = time.monotonic() + min(deadline_seconds, self.retry_deadline_seconds)
+        attempt = 0
+        while True:
+            self.request_count += 1
+            try:
+                response = await self._client.request(method, path, json=json, headers=headers)
+            except httpx.TransportError as e:
+                # 連線建立失敗時請求一定沒有送出，其他錯誤（例如讀取逾時）LINE可能已處理
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if retryable and attempt < self.max_retries and await self._sleep_before_retry(attempt, deadline):
+                    attempt += 1
+                    continue
+                self.error_count += 1
+                raise LineApiError(f"LINE API連線失敗: {e}")
+
+            retryable = response.status_code in self.RETRYABLE_STATUS_CODES and (
+                idempotent or response.status_code == 429
+            )
+            if (
+                retryable
+                and attempt < self.max_retries
+                and await self._sleep_before_retry(attempt, deadline, response.headers.get("Retry-After"))
+            ):
+                attempt += 1
+                continue
+
+            if response.status_code >= 400:
+                self.error_count += 1
+                raise LineApiError(
+                    f"LINE API錯誤 {response.status_code}: {response.text}",
+                    status_code=response.status_code
+                )
+
+            return response.json() if response.content else {}
+
+    async def _sleep_before_retry(self, attempt: int, deadline: float, retry_after: Optional[str] = None) -> bool:
+        """重試前等待：優先遵守Retry-After，否則使用full jitter指數退避；等待會超過期限時不重試，回傳False"""
+        delay = None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = None
+
+        if delay is None:
+            cap = min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** attempt))
+            delay = random.uniform(0, cap)
+
+        if time.monotonic() + delay >= deadline:
+            return False
+        self.retry_count += 1
+        await asyncio.sleep(delay)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取客戶端統計"""
+        return {
+            "requests": self.request_count,
+            "retries": self.retry_count,
+            "errors": self.error_count
+        }
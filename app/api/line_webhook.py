@@ -1,19 +1,24 @@
 """
 LINE Webhook API路由
 """
-from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi import APIRouter, Request, HTTPException, Depends, Query
 from fastapi.responses import JSONResponse
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+import asyncio
 import json
 
-from app.core.database import get_db
 from app.core.config import Settings
-from app.services import AIManager, LineService
+from app.core.exceptions import ValidationException
+from app.core.rate_limiter import get_rate_limiter
+from app.services import LineService
+from app.services.event_queue import WebhookEventQueue
 
 router = APIRouter(prefix="/webhook", tags=["LINE Bot"])
 
 # 全域變數（在實際應用中應該使用依賴注入）
 _line_service: LineService = None
+_event_queue: WebhookEventQueue = None
+_prewarm_task: asyncio.Task = None
 
 
 def get_line_service() -> LineService:
@@ -21,19 +26,81 @@ def get_line_service() -> LineService:
     global _line_service
     if _line_service is None:
         settings = Settings()
-        db_session = next(get_db())
-        ai_manager = AIManager(db_session, settings)
         
         line_config = {
             "channel_access_token": settings.line_channel_access_token,
-            "channel_secret": settings.line_channel_secret
+            "channel_secret": settings.line_channel_secret,
+            "reply_token_ttl_seconds": settings.line_reply_token_ttl_seconds,
+            "api_timeout_seconds": settings.line_api_timeout_seconds,
+            "max_connections": settings.line_max_connections,
+            "max_retries": settings.line_max_retries,
+            "retry_deadline_seconds": settings.line_retry_deadline_seconds,
+            "http2": settings.line_http2,
+            "rate_limiter": get_rate_limiter(settings) if settings.rate_limit_enabled else None,
+            "push_requests_per_second": settings.line_push_requests_per_second
         }
         
-        _line_service = LineService(db_session, line_config, ai_manager)
+        # 資料庫會話改由每個事件的工作單元取得，服務本身只保存共用的連線資源
+        _line_service = LineService(line_config, settings)
     
     return _line_service
 
 
+def get_event_queue() -> WebhookEventQueue:
+    """獲取webhook事件佇列實例"""
+    global _event_queue
+    if _event_queue is None:
+        settings = Settings()
+        _event_queue = WebhookEventQueue(
+            handler=lambda request_data: get_line_service().handle_webhook(request_data),
+            max_size=settings.webhook_queue_size,
+            worker_count=settings.webhook_worker_count,
+            enqueue_timeout_ms=settings.webhook_enqueue_timeout_ms
+        )
+    return _event_queue
+
+
+async def start_event_queue():
+    """啟動webhook事件佇列（應用程式啟動時呼叫）"""
+    if Settings().webhook_async_mode:
+        await get_event_queue().start()
+
+
+async def prewarm_response_cache():
+    """在背景預熱分類開場白快取（應用程式啟動時呼叫，不阻塞啟動）"""
+    global _prewarm_task
+    if Settings().response_cache_prewarm:
+        _prewarm_task = asyncio.create_task(get_line_service().prewarm_response_cache())
+
+
+async def start_maintenance_scheduler():
+    """啟動背景維護排程（應用程式啟動時呼叫）"""
+    get_line_service().maintenance.start()
+
+
+async def start_message_log_flusher():
+    """啟動訊息寫入緩衝的背景flusher（應用程式啟動時呼叫）"""
+    get_line_service().message_log.start()
+
+
+async def stop_event_queue():
+    """停止webhook事件佇列（應用程式關閉時呼叫）"""
+    if _event_queue is not None:
+        await _event_queue.stop()
+
+
+async def close_line_service():
+    """關閉LINE服務的連線池（應用程式關閉時呼叫）"""
+    if _prewarm_task is not None and not _prewarm_task.done():
+        _prewarm_task.cancel()
+    if _line_service is not None:
+        await _line_service.maintenance.stop()
+        await _line_service.summarizer.close()
+        # 最後寫入緩衝中剩餘的訊息
+        await _line_service.message_log.stop()
+        await _line_service.line_adapter.close()
+
+
 @router.post("/line")
 async def line_webhook(request: Request):
     """LINE Bot webhook端點"""
@@ -52,7 +119,19 @@ async def line_webhook(request: Request):
         # 解析請求資料
         request_data = json.loads(body.decode('utf-8'))
         
-        # 處理webhook
+        # 非同步模式：放入背景佇列後立即回應，避免LINE逾時重送
+        event_queue = get_event_queue()
+        if event_queue.is_running:
+            if not await event_queue.enqueue(request_data):
+                return JSONResponse(
+                    status_code=503,
+                    content={"error": "Webhook queue is full"}
+                )
+            return JSONResponse(content=line_service.line_adapter.create_success_response(
+                f"已接收 {len(request_data.get('events', []))} 個事件"
+            ))
+        
+        # 同步模式：直接處理webhook
         response = await line_service.handle_webhook(request_data)
         
         return JSONResponse(content=response)
@@ -73,6 +152,7 @@ async def line_health():
     try:
         line_service = get_line_service()
         health_info = await line_service.health_check()
+        health_info["event_queue"] = get_event_queue().get_stats()
         
         return JSONResponse(content=health_info)
         
@@ -84,6 +164,12 @@ async def line_health():
         )
 
 
+@router.get("/queue")
+async def queue_stats():
+    """webhook事件佇列統計"""
+    return JSONResponse(content=get_event_queue().get_stats())
+
+
 @router.post("/send-message")
 async def send_message(
     user_id: str,
@@ -126,6 +212,33 @@ async def get_user_stats(
         )
 
 
+@router.get("/user/{line_user_id}/history")
+async def get_conversation_history(
+    line_user_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+    line_service: LineService = Depends(get_line_service)
+):
+    """獲取用戶的對話歷史（以next_cursor取得更早的訊息）"""
+    try:
+        history = await line_service.get_conversation_history(
+            line_user_id, limit=limit, cursor=cursor, conversation_id=conversation_id
+        )
+        if "error" in history:
+            return JSONResponse(status_code=404, content=history)
+        return JSONResponse(content=history)
+        
+    except ValidationException as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        print(f"獲取對話歷史失敗: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Failed to get conversation history"}
+        )
+
+
 @router.post("/user/{line_user_id}/stats")
 async def send_user_stats(
     line_user_id: str,
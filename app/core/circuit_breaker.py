@@ -0,0 +1,336 @@
+"""
+斷路器與自適應並發限制
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from app.core.exceptions import CircuitOpenError, ConcurrencyLimitError
+
+
+class CircuitBreaker:
+    """斷路器
+
+    在時間窗內的失敗率超過門檻時斷開（open），期間的呼叫直接失敗；
+    經過冷卻時間後進入半開（half_open），只放行少量探測呼叫，
+    探測全部成功才恢復（closed），任一失敗則重新斷開。
+    只有is_failure判定為上游故障的錯誤才計入失敗（例如逾時、429、5xx）。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool = True,
+        failure_rate_threshold: float = 0.5,
+        minimum_calls: int = 10,
+        window_seconds: float = 30.0,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 2,
+        is_failure: Optional[Callable[[BaseException], bool]] = None
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure or (lambda error: True)
+
+        self.state = self.CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+        # 統計資訊
+        self.success_count = 0
+        self.failure_count = 0
+        self.rejected_count = 0
+        self.open_count = 0
+        self.last_opened_at: Optional[datetime] = None
+
+    def before_call(self):
+        """呼叫前檢查，斷開時拋出CircuitOpenError"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.open_seconds:
+                self.rejected_count += 1
+                raise CircuitOpenError(
+                    f"{self.name}斷路器已斷開",
+                    retry_after=self.open_seconds - (now - self._opened_at)
+                )
+            self._transition(self.HALF_OPEN, now)
+
+        if self.state == self.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_max_calls:
+                self.rejected_count += 1
+                raise CircuitOpenError(f"{self.name}斷路器探測中", retry_after=1.0)
+            self._probes_in_flight += 1
+
+    def record_success(self):
+        """記錄成功的呼叫"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self.success_count += 1
+        if self.state == self.HALF_OPEN:
+            self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_max_calls:
+                self._transition(self.CLOSED, now)
+            return
+        self._add_outcome(now, True)
+
+    def record_failure(self, error: BaseException):
+        """記錄失敗的呼叫（非上游故障的錯誤不影響斷路器狀態）"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if not self.is_failure(error):
+            if self.state == self.HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+            return
+
+        self.failure_count += 1
+        if self.state == self.HALF_OPEN:
+            self._transition(self.OPEN, now)
+            return
+        self._add_outcome(now, False)
+
+        failures = sum(1 for _, success in self._outcomes if not success)
+        if (
+            self.state == self.CLOSED
+            and len(self._outcomes) >= self.minimum_calls
+            and failures / len(self._outcomes) >= self.failure_rate_threshold
+        ):
+            self._transition(self.OPEN, now)
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """以斷路器保護一次呼叫"""
+        self.before_call()
+        try:
+            yield
+        except BaseException as e:
+            self.record_failure(e)
+            raise
+        else:
+            self.record_success()
+
+    def _add_outcome(self, now: float, success: bool):
+        """加入時間窗並移除過期的紀錄"""
+        self._outcomes.append((now, success))
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _transition(self, state: str, now: float):
+        """切換狀態"""
+        self.state = state
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == self.OPEN:
+            self._opened_at = now
+            self.open_count += 1
+            self.last_opened_at = datetime.utcnow()
+            print(f"{self.name}斷路器斷開，{self.open_seconds}秒後開始探測")
+        elif state == self.CLOSED:
+            self._outcomes.clear()
+            print(f"{self.name}斷路器恢復")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取斷路器狀態"""
+        now = time.monotonic()
+        failures = sum(1 for _, success in self._outcomes if not success)
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "window_calls": len(self._outcomes),
+            "window_failure_rate": failures / len(self._outcomes) if self._outcomes else 0,
+            "retry_after_seconds": (
+                max(self.open_seconds - (now - self._opened_at), 0) if self.state == self.OPEN else 0
+            ),
+            "successes": self.success_count,
+            "failures": self.failure_count,
+            "rejected": self.rejected_count,
+            "open_count": self.open_count,
+            "last_opened_at": self.last_opened_at.isoformat() if self.last_opened_at else None,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+
+class ConcurrencySlot:
+    """並發額度（key為呼叫類型，延遲與該類型的基準比較）"""
+
+    def __init__(self, key: str, started_at: float):
+        self.key = key
+        self.started_at = started_at
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD自適應並發限制器
+
+    成功且延遲正常時緩慢加大上限（每次約加1/limit，相當於每輪加1），
+    遇到過載訊號（429、逾時，或延遲超過該呼叫類型基準的latency_tolerance倍）時將上限乘以backoff_ratio。
+    各呼叫類型（例如開場白、摘要、對話輔導）以完整呼叫時間各自維護緩慢移動的延遲基準，
+    原本就較長的呼叫不會拖低其他呼叫共用的上限；樣本不足baseline_min_samples時不以延遲判斷過載。
+    上限減少後才開始的請求才會再觸發減少，避免同一批失敗讓上限連續崩落。
+    超過上限的呼叫排隊等待，等待逾時則拋出ConcurrencyLimitError。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool = True,
+        initial_limit: int = 20,
+        min_limit: int = 2,
+        max_limit: int = 100,
+        latency_tolerance: float = 2.0,
+        baseline_min_samples: int = 10,
+        baseline_alpha: float = 0.05,
+        backoff_ratio: float = 0.5,
+        queue_timeout_seconds: float = 5.0,
+        is_overload: Optional[Callable[[BaseException], bool]] = None
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.baseline_min_samples = baseline_min_samples
+        self.baseline_alpha = baseline_alpha
+        self.backoff_ratio = backoff_ratio
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.is_overload = is_overload or (lambda error: False)
+
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease_at = 0.0
+        # 呼叫類型 -> （延遲基準秒數, 樣本數）
+        self._baselines: Dict[str, Tuple[float, int]] = {}
+
+        # 統計資訊
+        self.increase_count = 0
+        self.decrease_count = 0
+        self.rejected_count = 0
+        self.queued_count = 0
+
+    @asynccontextmanager
+    async def acquire(self, key: str = "default") -> AsyncIterator[ConcurrencySlot]:
+        """取得並發額度，結束時依結果調整上限（key為呼叫類型）"""
+        if not self.enabled:
+            yield ConcurrencySlot(key, time.monotonic())
+            return
+
+        await self._acquire()
+        slot = ConcurrencySlot(key, time.monotonic())
+        try:
+            yield slot
+        except BaseException as e:
+            if self.is_overload(e):
+                self._decrease(slot)
+            raise
+        else:
+            if self._is_slow(key, time.monotonic() - slot.started_at):
+                self._decrease(slot)
+            else:
+                self._increase()
+        finally:
+            self._release()
+
+    def _is_slow(self, key: str, latency: float) -> bool:
+        """延遲是否明顯高於該呼叫類型的基準，並以本次延遲更新基準"""
+        baseline, samples = self._baselines.get(key, (latency, 0))
+        slow = samples >= self.baseline_min_samples and latency > baseline * self.latency_tolerance
+        # 前幾個樣本取平均，之後以指數移動平均緩慢追蹤
+        alpha = max(self.baseline_alpha, 1 / (samples + 1))
+        self._baselines[key] = (baseline + alpha * (latency - baseline), samples + 1)
+        return slow
+
+    async def _acquire(self):
+        """等待可用的額度（先到先得）"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+
+        self.queued_count += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout_seconds)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # 已分配到額度但等待端被取消，歸還額度
+                self._release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected_count += 1
+                raise ConcurrencyLimitError(
+                    f"{self.name}並發已達上限（{int(self.limit)}）",
+                    retry_after=self.queue_timeout_seconds
+                )
+            raise
+
+    def _release(self):
+        """歸還額度並喚醒等待中的呼叫"""
+        self.in_flight = max(self.in_flight - 1, 0)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(True)
+
+    def _increase(self):
+        """加法增加上限"""
+        if self.limit < self.max_limit:
+            self.limit = min(self.limit + 1 / self.limit, float(self.max_limit))
+            self.increase_count += 1
+            self._wake()
+
+    def _decrease(self, slot: ConcurrencySlot):
+        """乘法減少上限"""
+        if slot.started_at < self._last_decrease_at:
+            return
+        new_limit = max(self.limit * self.backoff_ratio, float(self.min_limit))
+        if new_limit < self.limit:
+            self.limit = new_limit
+            self.decrease_count += 1
+            print(f"{self.name}並發上限降為 {int(self.limit)}")
+        self._last_decrease_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取並發限制狀態"""
+        return {
+            "enabled": self.enabled,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "increases": self.increase_count,
+            "decreases": self.decrease_count,
+            "total_queued": self.queued_count,
+            "rejected": self.rejected_count,
+            "latency_baseline_ms": {
+                key: int(baseline * 1000) for key, (baseline, _) in self._baselines.items()
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        }
@@ -2,7 +2,7 @@
 應用程式配置管理
 """
 import os
-from typing import Optional
+from typing import Optional, Dict
 from pydantic_settings import BaseSettings
 
 
@@ -22,6 +22,13 @@ class Settings(BaseSettings):
     db_user: str = "chatbot_user"
     db_password: str = "chatbot_password"
     
+    # 資料庫連線池配置（每個worker行程各自擁有一組連線池，
+    # 總連線數約為 worker數 ×（db_pool_size + db_max_overflow））
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 3600
+    
     # Redis配置
     redis_host: str = "localhost"
     redis_port: int = 6379
@@ -32,15 +39,150 @@ class Settings(BaseSettings):
     openai_api_key: Optional[str] = None
     openai_model: str = "gpt-3.5-turbo"
     default_ai_model: str = "chatgpt"
+    openai_timeout_seconds: float = 30.0
+    openai_max_retries: int = 2
+    openai_max_connections: int = 200
+    openai_max_keepalive_connections: int = 50
+    openai_keepalive_expiry_seconds: float = 30.0
+    # 健康檢查以models.retrieve探測連線與金鑰（不消耗token），結果快取的秒數
+    openai_health_probe_interval_seconds: float = 60.0
+    openai_health_probe_timeout_seconds: float = 5.0
+    
+    # OpenAI斷路器：時間窗內失敗率過高時斷開並快速失敗，冷卻後以少量探測呼叫恢復
+    openai_circuit_breaker_enabled: bool = True
+    openai_circuit_failure_rate_threshold: float = 0.5
+    openai_circuit_minimum_calls: int = 10
+    openai_circuit_window_seconds: float = 30.0
+    openai_circuit_open_seconds: float = 30.0
+    openai_circuit_half_open_max_calls: int = 2
+    
+    # OpenAI自適應並發限制（AIMD：依429、逾時與延遲調整上限；
+    # 延遲超過該呼叫類型基準的latency_tolerance倍才視為過載）
+    openai_adaptive_concurrency_enabled: bool = True
+    openai_concurrency_initial_limit: int = 20
+    openai_concurrency_min_limit: int = 2
+    openai_concurrency_max_limit: int = 100
+    openai_concurrency_latency_tolerance: float = 2.0
+    openai_concurrency_baseline_min_samples: int = 10
+    openai_concurrency_backoff_ratio: float = 0.5
+    openai_concurrency_queue_timeout_seconds: float = 5.0
+    
+    # 對沖請求：回應超過最近延遲的百分位數時再送出一個相同請求，額外請求不超過budget_ratio
+    openai_hedging_enabled: bool = False
+    openai_hedge_percentile: float = 0.95
+    openai_hedge_budget_ratio: float = 0.05
+    openai_hedge_min_samples: int = 20
+    openai_hedge_min_delay_seconds: float = 1.0
+    
+    # 跨worker共用的令牌桶限流（Redis），額度不足時排隊等待
+    rate_limit_enabled: bool = True
+    rate_limit_burst_seconds: float = 10.0
+    rate_limit_max_wait_seconds: float = 30.0
+    rate_limit_local_fraction: float = 0.25  # Redis不可用時各worker分得的比例
+    openai_requests_per_minute: int = 3500
+    openai_tokens_per_minute: int = 90000
+    # 各模型的額度，例如 {"gpt-4": {"requests_per_minute": 500, "tokens_per_minute": 10000}}
+    openai_model_rate_limits: Dict[str, Dict[str, int]] = {}
+    rate_limit_completion_tokens_estimate: int = 500  # 未指定max_tokens時預估的回應token數
+    
+    # 模型路由：依呼叫類型選擇模型，主要模型p95延遲或錯誤率過高時改用備援模型
+    routing_enabled: bool = True
+    greeting_model: Optional[str] = "gpt-3.5-turbo"  # 未設定時使用openai_model
+    summary_model: Optional[str] = "gpt-3.5-turbo"
+    coaching_model: Optional[str] = None
+    fallback_model: Optional[str] = None
+    # 對話ai_model對應的模型名稱（default_ai_model依呼叫類型路由），例如 {"gpt4": "gpt-4"}
+    ai_model_aliases: Dict[str, str] = {}
+    routing_failover_p95_latency_ms: int = 15000
+    routing_failover_error_rate: float = 0.3
+    routing_failover_cooldown_seconds: float = 60.0
+    routing_health_window_size: int = 100
+    routing_health_min_samples: int = 10
+    # 各模型每1K token的價格（美元）
+    ai_model_pricing: Dict[str, Dict[str, float]] = {
+        "gpt-3.5-turbo": {"input": 0.0015, "output": 0.002},
+        "gpt-4": {"input": 0.03, "output": 0.06}
+    }
+    
+    # 串流回應：第一段盡快以reply token送出，其餘段落以push批次送出
+    openai_streaming_enabled: bool = True
+    stream_first_chunk_min_chars: int = 20
+    stream_chunk_min_chars: int = 200
+    stream_chunk_max_chars: int = 1000
+    stream_push_interval_seconds: float = 2.0
+    
+    # AI回應快取（只用於與用戶無關的固定輸入，例如分類開場白）
+    response_cache_enabled: bool = True
+    response_cache_ttl_seconds: int = 86400
+    response_cache_local_max_size: int = 256
+    response_cache_prewarm: bool = True
+    
+    # 首輪訊息相似度快取（各分類第一個提問與人工核准的提問幾乎相同時，直接回傳核准的回答）
+    # 核准回答的JSON檔格式：{"分類": [{"message": "提問", "response": "回答"}]}
+    semantic_cache_enabled: bool = False
+    semantic_cache_similarity_threshold: float = 0.95
+    semantic_cache_answers_path: Optional[str] = None
     
     # LINE配置
     line_channel_access_token: Optional[str] = None
     line_channel_secret: Optional[str] = None
+    line_reply_token_ttl_seconds: int = 50
+    line_api_timeout_seconds: float = 10.0
+    line_max_connections: int = 50
+    line_max_retries: int = 3
+    line_retry_deadline_seconds: float = 30.0  # 重試（包含Retry-After等待）的總期限
+    line_http2: bool = False
+    line_push_requests_per_second: float = 2000.0
     
     # 會話配置
     session_timeout_minutes: int = 30
     max_conversation_history: int = 50
+    conversation_state_cache_enabled: bool = True
+    
+    # 背景維護工作：分批過期不活躍對話、封存舊的過期對話
+    maintenance_enabled: bool = True
+    maintenance_interval_seconds: int = 300
+    maintenance_batch_size: int = 1000
+    maintenance_lock_timeout_ms: int = 2000
+    conversation_archive_after_days: int = 30
+    # 訊息按月分區：預先建立未來幾個月的分區；保留月數為0時不移除舊分區，
+    # 否則超過期限的分區依retention_action卸離（detach）或刪除（drop）
+    message_partition_months_ahead: int = 3
+    message_retention_months: int = 0
+    message_retention_action: str = "detach"
     
+    # 訊息寫入緩衝：訊息先寫入Redis stream，由背景每flush_interval_ms或累積batch_size筆批次寫入資料庫；
+    # Redis無法使用時改為同步寫入
+    message_write_behind_enabled: bool = False
+    message_write_behind_batch_size: int = 500
+    message_write_behind_flush_interval_ms: int = 200
+    message_write_behind_claim_idle_seconds: int = 60
+
+    # 滾動摘要：未摘要訊息超過門檻時，將較舊的訊息摺疊為摘要，只保留最近幾則原文
+    summary_enabled: bool = True
+    summary_trigger_messages: int = 12
+    summary_keep_recent_messages: int = 8
+
+    # 對話上下文token預算（系統提示＋歷史＋本輪訊息），可依模型覆寫
+    context_token_budget: int = 3000
+    context_token_budgets: Dict[str, int] = {
+        "gpt-3.5-turbo": 3000,
+        "gpt-4": 6000,
+        "gpt-4o-mini": 8000,
+        "gpt-4o": 8000
+    }
+    # token數只是近似值時（模型使用o200k_base等未附帶的編碼，或未安裝tiktoken）預算保留的比例
+    context_token_margin: float = 0.15
+
+    # Webhook事件佇列配置
+    webhook_async_mode: bool = True
+    webhook_queue_size: int = 1000
+    webhook_worker_count: int = 8
+    webhook_enqueue_timeout_ms: int = 50
+    webhook_dispatch_concurrency: int = 16
+    webhook_dedupe_ttl_seconds: int = 86400
+    webhook_dedupe_processing_ttl_seconds: int = 300
+
     # 服務配置
     web_host: str = "0.0.0.0"
     web_port: int = 8000
@@ -60,6 +202,15 @@ class Settings(BaseSettings):
         # 否則使用個別配置
         return f"postgresql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
     
+    @property
+    def async_database_url(self) -> str:
+        """PostgreSQL非同步（asyncpg）連接URL"""
+        database_url = self.database_url
+        for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+            if database_url.startswith(prefix):
+                return "postgresql+asyncpg://" + database_url[len(prefix):]
+        return database_url
+    
     @property
     def redis_url(self) -> str:
         """Redis連接URL"""
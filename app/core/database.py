@@ -2,12 +2,14 @@
 資料庫連接管理
 """
 import logging
-from typing import Generator
+from typing import Generator, AsyncGenerator, Dict, Any
 from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import QueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 import redis
+import redis.asyncio as aioredis
 from redis.exceptions import ConnectionError as RedisConnectionError
 
 from .config import settings
@@ -18,18 +20,30 @@ logger = logging.getLogger(__name__)
 # SQLAlchemy 基礎類別
 Base = declarative_base()
 
-# 資料庫引擎
+# 資料庫引擎（同步，供維運腳本與連線測試使用）
 engine = create_engine(
     settings.database_url,
     poolclass=QueuePool,
-    pool_size=20,
-    max_overflow=30,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
     pool_pre_ping=True,
-    pool_recycle=3600,
+    pool_recycle=settings.db_pool_recycle,
     echo=settings.debug,  # 開發時顯示SQL
     echo_pool=settings.debug,
 )
 
+# 非同步資料庫引擎（asyncpg，供應用程式熱路徑使用）
+async_engine = create_async_engine(
+    settings.async_database_url,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_pre_ping=True,
+    pool_recycle=settings.db_pool_recycle,
+    echo=settings.debug,
+)
+
 # 會話工廠
 SessionLocal = sessionmaker(
     autocommit=False,
@@ -37,6 +51,14 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+# 非同步會話工廠（提交後不使物件過期，避免在非同步環境觸發延遲載入）
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Redis連接
 try:
     redis_client = redis.from_url(
@@ -54,6 +76,17 @@ except Exception as e:
     logger.error(f"Redis連接失敗: {e}")
     redis_client = None
 
+# 非同步Redis連接（供事件迴圈中的熱路徑使用，Redis變慢時只影響等待中的請求，不會阻塞整個事件迴圈）
+# 啟動時Redis無法連線則同樣不使用
+async_redis_client = aioredis.from_url(
+    settings.redis_url,
+    decode_responses=True,
+    socket_connect_timeout=5,
+    socket_timeout=5,
+    retry_on_timeout=True,
+    health_check_interval=30
+) if redis_client is not None else None
+
 
 def get_db() -> Generator[Session, None, None]:
     """
@@ -71,6 +104,37 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    獲取非同步資料庫會話
+    用於FastAPI的依賴注入
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception as e:
+            logger.error(f"資料庫會話錯誤: {e}")
+            await db.rollback()
+            raise
+
+
+def get_pool_status() -> Dict[str, Any]:
+    """
+    獲取非同步資料庫連線池使用狀況
+    """
+    pool = async_engine.pool
+    capacity = settings.db_pool_size + settings.db_max_overflow
+    checked_out = pool.checkedout()
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": settings.db_max_overflow,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "utilization": checked_out / capacity if capacity else 0
+    }
+
+
 def test_database_connection() -> bool:
     """
     測試資料庫連接
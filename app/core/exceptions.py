@@ -78,3 +78,29 @@ class UserNotFoundError(UserException):
 class DatabaseError(DatabaseException):
     """資料庫錯誤異常"""
     pass
+
+
+class LineApiError(ChatbotException):
+    """LINE Messaging API錯誤異常"""
+    
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AIServiceUnavailableError(AIServiceException):
+    """AI服務暫時不可用異常（快速失敗，不應重試）"""
+    
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(AIServiceUnavailableError):
+    """斷路器斷開異常"""
+    pass
+
+
+class ConcurrencyLimitError(AIServiceUnavailableError):
+    """並發已達上限異常"""
+    pass
@@ -0,0 +1,152 @@
+"""
+對沖請求（降低尾端延遲）
+"""
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class RequestHedger:
+    """對沖請求器
+
+    請求超過最近延遲的指定百分位數仍未完成時，再送出一個相同的請求，
+    採用先成功的結果並取消另一個。對沖請求受預算限制：每個請求累積budget_ratio的額度，
+    每次對沖消耗1，因此額外請求最多約為budget_ratio（例如5%）。
+    """
+
+    # 最多可累積的對沖額度，避免長時間無對沖後突然大量對沖
+    MAX_BUDGET = 10.0
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool = False,
+        percentile: float = 0.95,
+        budget_ratio: float = 0.05,
+        min_samples: int = 20,
+        min_delay_seconds: float = 1.0,
+        window_size: int = 200
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.min_delay_seconds = min_delay_seconds
+        self.window_size = window_size
+
+        # 鍵（例如模型）-> 最近的延遲（秒）
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._budget = 0.0
+
+        # 統計資訊
+        self.request_count = 0
+        self.hedge_count = 0
+        self.hedge_win_count = 0
+        self.budget_exhausted_count = 0
+        self.saved_seconds_total = 0.0
+
+    async def run(self, key: str, factory: Callable[[bool], Awaitable[T]]) -> T:
+        """執行請求，必要時送出對沖請求；factory的參數表示是否為對沖請求"""
+        if not self.enabled:
+            return await factory(False)
+
+        self.request_count += 1
+        self._budget = min(self._budget + self.budget_ratio, self.MAX_BUDGET)
+        delay = self._hedge_delay(key)
+        start_time = time.monotonic()
+
+        primary = asyncio.ensure_future(factory(False))
+        if delay is None:
+            result = await primary
+            self._record(key, time.monotonic() - start_time)
+            return result
+
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+        except BaseException:
+            primary.cancel()
+            raise
+        if done or self._budget < 1:
+            if not done:
+                self.budget_exhausted_count += 1
+            result = await primary
+            self._record(key, time.monotonic() - start_time)
+            return result
+
+        self._budget -= 1
+        self.hedge_count += 1
+        hedge = asyncio.ensure_future(factory(True))
+        winner = await self._first_success(primary, hedge)
+        elapsed = time.monotonic() - start_time
+
+        if winner is hedge:
+            self.hedge_win_count += 1
+            # 主要請求被取消，節省的時間以最近的p99延遲估算
+            tail = self._percentile(key, 0.99)
+            if tail is not None and tail > elapsed:
+                self.saved_seconds_total += tail - elapsed
+        self._record(key, elapsed)
+        return winner.result()
+
+    async def _first_success(self, primary: asyncio.Future, hedge: asyncio.Future) -> asyncio.Future:
+        """等待先成功的請求並取消另一個；都失敗時拋出主要請求的錯誤"""
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        return task
+            # 兩個請求都失敗
+            if not hedge.cancelled():
+                hedge.exception()
+            return primary
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _hedge_delay(self, key: str) -> Optional[float]:
+        """對沖前等待的時間（樣本不足時不對沖）"""
+        latencies = self._latencies.get(key)
+        if not latencies or len(latencies) < self.min_samples:
+            return None
+        return max(self._percentile(key, self.percentile), self.min_delay_seconds)
+
+    def _percentile(self, key: str, percentile: float) -> Optional[float]:
+        latencies = self._latencies.get(key)
+        if not latencies:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(int(len(ordered) * percentile), len(ordered) - 1)]
+
+    def _record(self, key: str, latency: float):
+        latencies = self._latencies.get(key)
+        if latencies is None:
+            latencies = self._latencies[key] = deque(maxlen=self.window_size)
+        latencies.append(latency)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取對沖統計"""
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "budget_ratio": self.budget_ratio,
+            "requests": self.request_count,
+            "hedges": self.hedge_count,
+            "hedge_rate": self.hedge_count / self.request_count if self.request_count else 0,
+            "hedge_wins": self.hedge_win_count,
+            "hedge_win_rate": self.hedge_win_count / self.hedge_count if self.hedge_count else 0,
+            "budget_exhausted": self.budget_exhausted_count,
+            "estimated_latency_saved_ms_total": int(self.saved_seconds_total * 1000),
+            "hedge_delay_ms": {
+                key: int(self._hedge_delay(key) * 1000)
+                for key in self._latencies
+                if self._hedge_delay(key) is not None
+            },
+            "timestamp": datetime.utcnow().isoformat()
+        }
@@ -0,0 +1,185 @@
+"""
+分散式令牌桶限流
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+from app.core.config import Settings
+from app.core.database import async_redis_client
+
+
+# 一次為多個令牌桶預約額度（全部成功或全部不扣）
+# KEYS: 令牌桶鍵；ARGV: max_wait, 之後每個令牌桶依序為 rate, capacity, cost
+# 額度不足時仍先扣除（令牌數可為負值）並回傳需等待的秒數，後到的呼叫等待時間較長，形成排隊；
+# 需等待超過max_wait時不扣除，由呼叫端等待後重新預約
+_ACQUIRE_SCRIPT = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local max_wait = tonumber(ARGV[1])
+local wait = 0
+local buckets = {}
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local capacity = tonumber(ARGV[i * 3])
+    local cost = math.min(tonumber(ARGV[i * 3 + 1]), capacity)
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    if cost > tokens then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+    buckets[i] = {tokens, cost, rate, capacity}
+end
+local reserved = 0
+if wait <= max_wait then
+    reserved = 1
+end
+for i = 1, #KEYS do
+    local tokens = buckets[i][1]
+    if reserved == 1 then
+        tokens = tokens - buckets[i][2]
+    end
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[i], math.ceil((buckets[i][4] / buckets[i][3] + max_wait) * 1000) + 1000)
+end
+return {reserved, tostring(wait)}
+"""
+
+
+class TokenBucketRateLimiter:
+    """分散式令牌桶限流器
+
+    以Redis Lua腳本原子地預約額度，所有worker與容器共用同一組令牌桶；
+    額度不足時呼叫端以asyncio.sleep排隊等待，不會回傳錯誤。
+    Redis不可用時改用行程內的令牌桶，速率依local_fraction分攤（例如4個worker為0.25）。
+    """
+
+    KEY_PREFIX = "rate_limit:"
+
+    def __init__(
+        self,
+        redis_client: Optional[aioredis.Redis] = None,
+        burst_seconds: float = 10.0,
+        max_wait_seconds: float = 30.0,
+        local_fraction: float = 0.25,
+        redis_retry_seconds: int = 30
+    ):
+        self.redis_client = redis_client
+        self.burst_seconds = burst_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.local_fraction = local_fraction
+        self.redis_retry_seconds = redis_retry_seconds
+
+        self._script = redis_client.register_script(_ACQUIRE_SCRIPT) if redis_client is not None else None
+        self._redis_disabled_until = 0.0
+        # 行程內令牌桶：鍵 -> [令牌數, 上次更新時間]
+        self._local: Dict[str, List[float]] = {}
+
+        # 統計資訊
+        self.acquire_count = 0
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.redis_error_count = 0
+
+    async def acquire(self, buckets: List[Tuple[str, float, float]]) -> float:
+        """預約額度，buckets為（名稱, 每秒速率, 用量）；額度不足時等待，回傳等待秒數"""
+        buckets = [(name, rate, cost) for name, rate, cost in buckets if rate > 0 and cost > 0]
+        if not buckets:
+            return 0.0
+
+        self.acquire_count += 1
+        waited = 0.0
+        while True:
+            reserved, wait = await self._reserve(buckets)
+            if wait > 0:
+                delay = wait if reserved else self.max_wait_seconds
+                await asyncio.sleep(delay)
+                waited += delay
+            if reserved:
+                break
+
+        if waited:
+            self.wait_count += 1
+            self.wait_seconds_total += waited
+        return waited
+
+    async def _reserve(self, buckets: List[Tuple[str, float, float]]) -> Tuple[bool, float]:
+        """預約一次，回傳（是否已扣除, 需等待秒數）"""
+        now = time.monotonic()
+        if self._script is not None and now >= self._redis_disabled_until:
+            try:
+                args: List[Any] = [self.max_wait_seconds]
+                for _, rate, cost in buckets:
+                    args.extend([rate, self._capacity(rate), cost])
+                reserved, wait = await self._script(
+                    keys=[f"{self.KEY_PREFIX}{name}" for name, _, _ in buckets],
+                    args=args
+                )
+                return bool(int(reserved)), float(wait)
+            except Exception as e:
+                now = time.monotonic()
+                self.redis_error_count += 1
+                self._redis_disabled_until = now + self.redis_retry_seconds
+                print(f"限流Redis失敗，暫時改用行程內令牌桶: {e}")
+
+        return self._reserve_local(buckets, now)
+
+    def _reserve_local(self, buckets: List[Tuple[str, float, float]], now: float) -> Tuple[bool, float]:
+        """行程內的令牌桶（與Lua腳本相同的演算法）"""
+        wait = 0.0
+        states = []
+        for name, rate, cost in buckets:
+            rate *= self.local_fraction
+            capacity = self._capacity(rate)
+            cost = min(cost, capacity)
+            tokens, updated_at = self._local.get(name, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+            if cost > tokens:
+                wait = max(wait, (cost - tokens) / rate)
+            states.append((name, tokens, cost))
+
+        reserved = wait <= self.max_wait_seconds
+        for name, tokens, cost in states:
+            self._local[name] = [tokens - cost if reserved else tokens, now]
+        return reserved, wait
+
+    def _capacity(self, rate: float) -> float:
+        """令牌桶容量（可累積burst_seconds秒的額度）"""
+        return max(rate * self.burst_seconds, 1.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取限流統計"""
+        redis_available = self._script is not None and time.monotonic() >= self._redis_disabled_until
+        return {
+            "backend": "redis" if redis_available else "local",
+            "acquires": self.acquire_count,
+            "waits": self.wait_count,
+            "wait_seconds_total": round(self.wait_seconds_total, 3),
+            "average_wait_seconds": self.wait_seconds_total / self.wait_count if self.wait_count else 0,
+            "redis_errors": self.redis_error_count,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+
+_rate_limiter: Optional[TokenBucketRateLimiter] = None
+
+
+def get_rate_limiter(settings: Settings) -> TokenBucketRateLimiter:
+    """獲取行程共用的限流器"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = TokenBucketRateLimiter(
+            redis_client=async_redis_client,
+            burst_seconds=settings.rate_limit_burst_seconds,
+            max_wait_seconds=settings.rate_limit_max_wait_seconds,
+            local_fraction=settings.rate_limit_local_fraction
+        )
+    return _rate_limiter
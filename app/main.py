@@ -4,7 +4,16 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.api.line_webhook import router as line_router
+from app.api.line_webhook import (
+    router as line_router,
+    start_event_queue,
+    prewarm_response_cache,
+    start_maintenance_scheduler,
+    start_message_log_flusher,
+    stop_event_queue,
+    close_line_service
+)
+from app.services.ai_service import close_async_openai_client
 
 app = FastAPI(
     title="思考機器人",
@@ -24,6 +33,21 @@ app.add_middleware(
 # 註冊路由
 app.include_router(line_router)
 
+@app.on_event("startup")
+async def startup():
+    """應用程式啟動"""
+    await start_event_queue()
+    await prewarm_response_cache()
+    await start_maintenance_scheduler()
+    await start_message_log_flusher()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """應用程式關閉"""
+    await stop_event_queue()
+    await close_line_service()
+    await close_async_openai_client()
+
 @app.get("/")
 async def root():
     """根路徑 - 健康檢查"""
@@ -5,10 +5,12 @@ from .user import User
 from .conversation import Conversation
 from .message import Message
 from .prompt_category import PromptCategory
+from .user_conversation_stats import UserConversationStats
 
 __all__ = [
     "User",
     "Conversation", 
     "Message",
-    "PromptCategory"
+    "PromptCategory",
+    "UserConversationStats"
 ]
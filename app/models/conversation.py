@@ -2,8 +2,8 @@
 會話資料模型
 """
 from datetime import datetime
-from typing import List, Optional
-from sqlalchemy import Column, String, Integer, DateTime, func, ForeignKey
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import Column, String, Text, Integer, DateTime, func, ForeignKey, CheckConstraint, Index, select, text, tuple_
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import uuid
@@ -19,7 +19,7 @@ class Conversation(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # 外鍵關聯
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     selected_category_id = Column(UUID(as_uuid=True), ForeignKey("prompt_categories.id"), nullable=True)
     
     # 會話狀態
@@ -36,6 +36,12 @@ class Conversation(Base):
     message_count = Column(Integer, default=0, nullable=False)
     total_tokens = Column(Integer, default=0, nullable=False)
     
+    # 滾動摘要（較舊的訊息摺疊為摘要）
+    summary = Column(Text, nullable=True)
+    summarized_until = Column(DateTime(timezone=True), nullable=True)
+    summarized_until_id = Column(UUID(as_uuid=True), nullable=True)
+    summary_message_count = Column(Integer, default=0, nullable=False)
+    
     # 時間戳
     last_activity_at = Column(DateTime(timezone=True), default=func.now(), nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), default=func.now(), nullable=False)
@@ -46,6 +52,24 @@ class Conversation(Base):
     prompt_category = relationship("PromptCategory", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
     
+    # 約束條件與索引
+    __table_args__ = (
+        CheckConstraint(
+            "status IN ('active', 'expired', 'reset', 'archived')", name="conversations_status_check"
+        ),
+        Index("idx_conversations_user_status_activity", "user_id", "status", last_activity_at.desc()),
+        Index(
+            "idx_conversations_active_last_activity", "last_activity_at",
+            postgresql_where=text("status = 'active'")
+        ),
+        Index(
+            "idx_conversations_expired_last_activity", "last_activity_at",
+            postgresql_where=text("status = 'expired'")
+        ),
+    )
+    # INSERT/UPDATE時以RETURNING取回created_at、updated_at等預設值，提交後不需再查詢（狀態快取會序列化所有欄位）
+    __mapper_args__ = {"eager_defaults": True}
+    
     def __repr__(self):
         return f"<Conversation(id={self.id}, user_id={self.user_id}, state='{self.state}', category_key='{self.category_key}')>"
     
@@ -61,11 +85,22 @@ class Conversation(Base):
             "ai_model": self.ai_model,
             "message_count": self.message_count,
             "total_tokens": self.total_tokens,
+            "summary": self.summary,
+            "summarized_until": self.summarized_until.isoformat() if self.summarized_until else None,
+            "summarized_until_id": str(self.summarized_until_id) if self.summarized_until_id else None,
+            "summary_message_count": self.summary_message_count,
             "last_activity_at": self.last_activity_at.isoformat() if self.last_activity_at else None,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
     
+    @property
+    def summary_position(self) -> Optional[Tuple[datetime, uuid.UUID]]:
+        """摘要涵蓋到的最後一則訊息位置(created_at, id)，尚未摘要時為None"""
+        if self.summarized_until is None:
+            return None
+        return self.summarized_until, self.summarized_until_id
+    
     def update_activity(self):
         """更新最後活動時間"""
         self.last_activity_at = func.now()
@@ -104,3 +139,78 @@ class Conversation(Base):
         return db_session.query(cls).filter(
             cls.user_id == user_id
         ).order_by(cls.created_at.desc()).limit(limit).all()
+    
+    @classmethod
+    async def get_active_conversation_async(cls, db_session, user_id: str):
+        """獲取用戶的活躍會話（非同步）"""
+        result = await db_session.execute(
+            select(cls).where(
+                cls.user_id == user_id,
+                cls.status == "active"
+            ).order_by(cls.last_activity_at.desc()).limit(1)
+        )
+        return result.scalars().first()
+    
+    @classmethod
+    async def get_conversations_by_user_async(
+        cls,
+        db_session,
+        user_id: str,
+        limit: int = 10,
+        before: Optional[Tuple[datetime, uuid.UUID]] = None
+    ):
+        """獲取用戶的會話歷史（非同步，由新到舊；before為上一頁最後一個對話的(created_at, id)）"""
+        query = select(cls).where(cls.user_id == user_id)
+        if before is not None:
+            query = query.where(tuple_(cls.created_at, cls.id) < tuple_(*before))
+        result = await db_session.execute(
+            query.order_by(cls.created_at.desc(), cls.id.desc()).limit(limit)
+        )
+        return result.scalars().all()
+    
+    @classmethod
+    async def aggregate_statistics_async(cls, db_session, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """在資料庫端彙總對話統計（單一GROUP BY GROUPING SETS查詢，未指定用戶時統計全部）"""
+        query = select(
+            func.grouping(cls.category_key, cls.ai_model, cls.status).label("grouping_id"),
+            cls.category_key,
+            cls.ai_model,
+            cls.status,
+            func.count().label("conversations"),
+            func.coalesce(func.sum(cls.message_count), 0).label("messages"),
+            func.coalesce(func.sum(cls.total_tokens), 0).label("tokens")
+        ).group_by(
+            func.grouping_sets(tuple_(), cls.category_key, cls.ai_model, cls.status)
+        )
+        if user_id is not None:
+            query = query.where(cls.user_id == user_id)
+        result = await db_session.execute(query)
+        
+        stats = {
+            "total_conversations": 0,
+            "active_conversations": 0,
+            "expired_conversations": 0,
+            "reset_conversations": 0,
+            "archived_conversations": 0,
+            "total_messages": 0,
+            "total_tokens": 0,
+            "by_category": {},
+            "by_model": {},
+            "by_status": {}
+        }
+        # grouping_id的位元依序對應category_key、ai_model、status，1表示該欄位未參與分組
+        for row in result:
+            if row.grouping_id == 0b111:
+                stats["total_conversations"] = row.conversations
+                stats["total_messages"] = int(row.messages)
+                stats["total_tokens"] = int(row.tokens)
+            elif row.grouping_id == 0b011:
+                if row.category_key:
+                    stats["by_category"][row.category_key] = row.conversations
+            elif row.grouping_id == 0b101:
+                stats["by_model"][row.ai_model] = row.conversations
+            elif row.grouping_id == 0b110:
+                stats["by_status"][row.status] = row.conversations
+                if f"{row.status}_conversations" in stats:
+                    stats[f"{row.status}_conversations"] = row.conversations
+        return stats
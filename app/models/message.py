@@ -2,8 +2,10 @@
 訊息資料模型
 """
 from datetime import datetime
-from typing import Optional
-from sqlalchemy import Column, String, Text, Integer, DateTime, func, ForeignKey, CheckConstraint
+from typing import Optional, Tuple
+from sqlalchemy import (
+    Column, String, Text, Integer, DateTime, func, ForeignKey, CheckConstraint, Index, select, tuple_
+)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import uuid
@@ -15,11 +17,11 @@ class Message(Base):
     """訊息資料模型"""
     __tablename__ = "messages"
     
-    # 主鍵
+    # 主鍵（與created_at組成複合主鍵）
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # 外鍵關聯
-    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False, index=True)
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
     
     # 訊息內容
     message_type = Column(String(20), nullable=False, index=True)
@@ -27,17 +29,20 @@ class Message(Base):
     
     # AI相關資訊
     tokens_used = Column(Integer, nullable=True, index=True)
+    token_count = Column(Integer, nullable=True)  # 訊息內容本身的token數（寫入時計算，避免重複斷詞）
     processing_time_ms = Column(Integer, nullable=True)
     
-    # 時間戳
-    created_at = Column(DateTime(timezone=True), default=func.now(), nullable=False, index=True)
+    # 時間戳（分區鍵，為主鍵的一部分）
+    created_at = Column(DateTime(timezone=True), default=func.now(), primary_key=True, index=True)
     
     # 關聯關係
     conversation = relationship("Conversation", back_populates="messages")
     
-    # 約束條件
+    # 約束條件（依created_at按月分區）
     __table_args__ = (
         CheckConstraint("message_type IN ('user', 'assistant')", name="check_message_type"),
+        Index("idx_messages_conversation_created_desc", "conversation_id", created_at.desc(), id.desc()),
+        {"postgresql_partition_by": "RANGE (created_at)"},
     )
     
     def __repr__(self):
@@ -51,6 +56,7 @@ class Message(Base):
             "message_type": self.message_type,
             "content": self.content,
             "tokens_used": self.tokens_used,
+            "token_count": self.token_count,
             "processing_time_ms": self.processing_time_ms,
             "created_at": self.created_at.isoformat() if self.created_at else None
         }
@@ -79,7 +85,9 @@ class Message(Base):
     @classmethod
     def get_conversation_messages(cls, db_session, conversation_id: str, limit: Optional[int] = None):
         """獲取會話的所有訊息"""
-        query = db_session.query(cls).filter(cls.conversation_id == conversation_id).order_by(cls.created_at.asc())
+        query = db_session.query(cls).filter(cls.conversation_id == conversation_id).order_by(
+            cls.created_at.asc(), cls.id.asc()
+        )
         if limit:
             query = query.limit(limit)
         return query.all()
@@ -89,4 +97,71 @@ class Message(Base):
         """獲取會話的最近訊息"""
         return db_session.query(cls).filter(
             cls.conversation_id == conversation_id
-        ).order_by(cls.created_at.desc()).limit(limit).all()
+        ).order_by(cls.created_at.desc(), cls.id.desc()).limit(limit).all()
+    
+    @classmethod
+    async def get_conversation_messages_async(
+        cls,
+        db_session,
+        conversation_id: str,
+        limit: Optional[int] = None,
+        offset: int = 0
+    ):
+        """獲取會話的所有訊息（非同步；offset需略過前面的訊息，長對話請改用keyset分頁）"""
+        query = select(cls).where(cls.conversation_id == conversation_id).order_by(
+            cls.created_at.asc(), cls.id.asc()
+        )
+        if offset:
+            query = query.offset(offset)
+        if limit:
+            query = query.limit(limit)
+        result = await db_session.execute(query)
+        return result.scalars().all()
+    
+    @classmethod
+    async def get_recent_messages_async(
+        cls,
+        db_session,
+        conversation_id: str,
+        limit: int = 10,
+        after: Optional[Tuple[datetime, uuid.UUID]] = None
+    ):
+        """獲取會話的最近訊息（非同步；after為摘要涵蓋到的最後一則的(created_at, id)，只取其後的訊息）"""
+        query = select(cls).where(cls.conversation_id == conversation_id)
+        if after is not None:
+            query = query.where(tuple_(cls.created_at, cls.id) > tuple_(*after))
+        result = await db_session.execute(query.order_by(cls.created_at.desc(), cls.id.desc()).limit(limit))
+        return result.scalars().all()
+    
+    @classmethod
+    async def get_messages_page_async(
+        cls,
+        db_session,
+        conversation_id: str,
+        limit: int = 50,
+        before: Optional[Tuple[datetime, uuid.UUID]] = None
+    ):
+        """以keyset分頁獲取會話訊息（非同步，由新到舊；before為上一頁最後一則的(created_at, id)）"""
+        query = select(cls).where(cls.conversation_id == conversation_id)
+        if before is not None:
+            query = query.where(tuple_(cls.created_at, cls.id) < tuple_(*before))
+        result = await db_session.execute(query.order_by(cls.created_at.desc(), cls.id.desc()).limit(limit))
+        return result.scalars().all()
+    
+    @classmethod
+    async def get_messages_after_async(
+        cls,
+        db_session,
+        conversation_id: str,
+        after: Optional[Tuple[datetime, uuid.UUID]] = None,
+        limit: Optional[int] = None
+    ):
+        """獲取會話在指定位置(created_at, id)之後的訊息（非同步，依時間排序）"""
+        query = select(cls).where(cls.conversation_id == conversation_id)
+        if after is not None:
+            query = query.where(tuple_(cls.created_at, cls.id) > tuple_(*after))
+        query = query.order_by(cls.created_at.asc(), cls.id.asc())
+        if limit:
+            query = query.limit(limit)
+        result = await db_session.execute(query)
+        return result.scalars().all()
@@ -3,7 +3,7 @@
 """
 from datetime import datetime
 from typing import List, Optional
-from sqlalchemy import Column, String, Text, Boolean, DateTime, func
+from sqlalchemy import Column, String, Text, Boolean, DateTime, func, select
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import uuid
@@ -61,3 +61,17 @@ class PromptCategory(Base):
     def get_by_key(cls, db_session, category_key: str):
         """根據分類鍵值獲取分類"""
         return db_session.query(cls).filter(cls.category_key == category_key, cls.is_active == True).first()
+    
+    @classmethod
+    async def get_active_categories_async(cls, db_session):
+        """獲取所有啟用的分類（非同步）"""
+        result = await db_session.execute(select(cls).where(cls.is_active == True))
+        return result.scalars().all()
+    
+    @classmethod
+    async def get_by_key_async(cls, db_session, category_key: str):
+        """根據分類鍵值獲取分類（非同步）"""
+        result = await db_session.execute(
+            select(cls).where(cls.category_key == category_key, cls.is_active == True)
+        )
+        return result.scalars().first()
@@ -3,7 +3,7 @@
 """
 from datetime import datetime
 from typing import List, Optional
-from sqlalchemy import Column, String, DateTime, func
+from sqlalchemy import Column, String, DateTime, func, select
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import uuid
@@ -60,6 +60,18 @@ class User(Base):
         """根據ID獲取用戶"""
         return db_session.query(cls).filter(cls.id == user_id).first()
     
+    @classmethod
+    async def get_by_line_user_id_async(cls, db_session, line_user_id: str):
+        """根據LINE用戶ID獲取用戶（非同步）"""
+        result = await db_session.execute(select(cls).where(cls.line_user_id == line_user_id))
+        return result.scalars().first()
+    
+    @classmethod
+    async def get_by_id_async(cls, db_session, user_id: str):
+        """根據ID獲取用戶（非同步）"""
+        result = await db_session.execute(select(cls).where(cls.id == user_id))
+        return result.scalars().first()
+    
     @classmethod
     def get_all_users(cls, db_session, limit: int = 100, offset: int = 0):
         """獲取所有用戶"""
@@ -0,0 +1,59 @@
+"""
+用戶對話統計彙總模型
+"""
+from typing import Any, Dict
+from sqlalchemy import Column, Integer, BigInteger, DateTime, ForeignKey, func, select
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+
+from app.core.database import Base
+
+
+class UserConversationStats(Base):
+    """用戶對話統計彙總（由conversations表的觸發器增量維護，應用程式只讀取）"""
+    __tablename__ = "user_conversation_stats"
+
+    # 主鍵
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+
+    # 依狀態的對話數
+    total_conversations = Column(Integer, default=0, nullable=False)
+    active_conversations = Column(Integer, default=0, nullable=False)
+    expired_conversations = Column(Integer, default=0, nullable=False)
+    reset_conversations = Column(Integer, default=0, nullable=False)
+    archived_conversations = Column(Integer, default=0, nullable=False)
+
+    # 累計用量
+    total_messages = Column(BigInteger, default=0, nullable=False)
+    total_tokens = Column(BigInteger, default=0, nullable=False)
+
+    # 分類/模型 -> 對話數
+    by_category = Column(JSONB, default=dict, nullable=False)
+    by_model = Column(JSONB, default=dict, nullable=False)
+
+    # 時間戳
+    last_activity_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), default=func.now(), nullable=True)
+
+    def __repr__(self):
+        return f"<UserConversationStats(user_id={self.user_id}, total_conversations={self.total_conversations})>"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """轉換為統計格式"""
+        return {
+            "total_conversations": self.total_conversations,
+            "active_conversations": self.active_conversations,
+            "expired_conversations": self.expired_conversations,
+            "reset_conversations": self.reset_conversations,
+            "archived_conversations": self.archived_conversations,
+            "total_messages": self.total_messages,
+            "total_tokens": self.total_tokens,
+            "by_category": dict(self.by_category or {}),
+            "by_model": dict(self.by_model or {}),
+            "last_activity_at": self.last_activity_at.isoformat() if self.last_activity_at else None
+        }
+
+    @classmethod
+    async def get_by_user_id_async(cls, db_session, user_id: str):
+        """根據用戶ID獲取統計（非同步）"""
+        result = await db_session.execute(select(cls).where(cls.user_id == user_id))
+        return result.scalars().first()
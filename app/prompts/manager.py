@@ -2,7 +2,7 @@
 Prompt管理器
 """
 from typing import Optional, Dict, Any, List
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import PromptCategory
 from app.prompts.categories import (
@@ -19,7 +19,7 @@ from app.prompts.categories import (
 class PromptManager:
     """Prompt管理器"""
     
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: AsyncSession):
         self.db_session = db_session
     
     def get_category_menu(self) -> str:
@@ -53,20 +53,20 @@ class PromptManager:
             return category['prompt_template']
         return None
     
-    def get_category_from_db(self, category_key: str) -> Optional[PromptCategory]:
+    async def get_category_from_db(self, category_key: str) -> Optional[PromptCategory]:
         """從資料庫獲取問題分類"""
-        return PromptCategory.get_by_key(self.db_session, category_key)
+        return await PromptCategory.get_by_key_async(self.db_session, category_key)
     
-    def get_all_categories_from_db(self) -> List[PromptCategory]:
+    async def get_all_categories_from_db(self) -> List[PromptCategory]:
         """從資料庫獲取所有啟用的問題分類"""
-        return PromptCategory.get_active_categories(self.db_session)
+        return await PromptCategory.get_active_categories_async(self.db_session)
     
-    def sync_categories_to_db(self) -> bool:
+    async def sync_categories_to_db(self) -> bool:
         """將分類定義同步到資料庫"""
         try:
             for number, category_data in PROBLEM_CATEGORIES.items():
                 # 檢查分類是否已存在
-                existing_category = self.get_category_from_db(category_data['key'])
+                existing_category = await self.get_category_from_db(category_data['key'])
                 
                 if existing_category:
                     # 更新現有分類
@@ -87,11 +87,11 @@ class PromptManager:
                     )
                     self.db_session.add(new_category)
             
-            self.db_session.commit()
+            await self.db_session.commit()
             return True
             
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             print(f"同步分類到資料庫失敗: {e}")
             return False
     
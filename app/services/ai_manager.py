@@ -1,14 +1,18 @@
 """
 AI服務管理器
 """
-from typing import List, Dict, Any, Optional, Tuple
-from sqlalchemy.orm import Session
-from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone
 
 from app.core.config import Settings
-from app.core.exceptions import AIServiceException, DatabaseError
+from app.core.exceptions import AIServiceException, AIServiceUnavailableError, DatabaseError
 from app.services.ai_service import AIService
 from app.services.conversation_service import ConversationService
+from app.services.conversation_state_cache import ConversationStateCache
+from app.services.conversation_summarizer import ConversationSummarizer
+from app.services.message_log import MessageWriteBehindLog
+from app.services.semantic_cache import get_first_turn_cache
 from app.services.prompt_service import PromptService
 from app.models import Message, Conversation
 
@@ -16,102 +20,153 @@ from app.models import Message, Conversation
 class AIManager:
     """AI服務管理器"""
     
-    def __init__(self, db_session: Session, settings: Settings):
+    def __init__(
+        self,
+        db_session: AsyncSession,
+        settings: Settings,
+        ai_service: Optional[AIService] = None,
+        state_cache: Optional[ConversationStateCache] = None,
+        summarizer: Optional[ConversationSummarizer] = None,
+        message_log: Optional[MessageWriteBehindLog] = None
+    ):
         self.db_session = db_session
         self.settings = settings
-        self.ai_service = AIService(settings)
-        self.conversation_service = ConversationService(db_session)
+        self.ai_service = ai_service or AIService(settings)
+        self.summarizer = summarizer
+        self.first_turn_cache = get_first_turn_cache(settings)
+        self.conversation_service = ConversationService(
+            db_session, state_cache=state_cache, message_log=message_log
+        )
         self.prompt_service = PromptService(db_session)
+        # 本輪尚未寫入的用戶訊息（呼叫AI前寫入）
+        self._unsaved_turn: Optional[Tuple[Conversation, Message]] = None
     
-    def process_user_message(
+    async def process_user_message(
         self,
         user_id: str,
         user_message: str,
         conversation_id: Optional[str] = None,
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Tuple[str, str, Dict[str, Any]]:
-        """處理用戶訊息並生成回應"""
+        """處理用戶訊息並生成回應
+
+        對話只載入一次，狀態變更、訊息與計數都留在同一個交易中。
+        不需呼叫AI的輪次（選單、確認）只在最後提交一次；需要呼叫AI時，
+        先提交用戶訊息與目前的變更並歸還連線（AI逾時或行程中止都不會遺失用戶輸入），
+        AI回應與之後的變更再以第二個交易寫入。
+        提供on_chunk時，對話階段的回應以串流逐段送出（usage_info["streamed"]為True），
+        完整回應仍只寫入一次。
+        """
         try:
             # 獲取或創建對話
             if conversation_id:
-                conversation = self.conversation_service.get_conversation_by_id(conversation_id)
+                conversation = await self.conversation_service.get_conversation_by_id(conversation_id)
                 if not conversation:
                     raise AIServiceException(f"找不到對話 ID: {conversation_id}")
             else:
-                conversation = self.conversation_service.get_active_conversation(user_id)
+                conversation = await self.conversation_service.get_active_conversation(user_id)
                 if not conversation:
-                    # 創建新對話
-                    conversation = self.conversation_service.create_conversation(user_id)
-            
-            # 添加用戶訊息
-            user_msg = self.conversation_service.add_message(
-                conversation_id=conversation.id,
-                message_type="user",
-                content=user_message
-            )
+                    # 創建新對話（與本輪訊息一起提交）
+                    conversation = await self.conversation_service.create_conversation(
+                        user_id, commit=False
+                    )
             
-            # 獲取對話歷史
-            conversation_history = self.conversation_service.get_conversation_messages(
-                conversation.id, limit=20
-            )
+            # 用戶訊息先保留在記憶體，呼叫AI前或與回應一起寫入
+            user_msg = Message.create_user_message(conversation.id, user_message)
+            user_msg.created_at = datetime.now(timezone.utc)
+            self._unsaved_turn = (conversation, user_msg)
             
             # 生成AI回應
-            ai_response, usage_info = self._generate_ai_response(
-                conversation=conversation,
-                user_message=user_message,
-                conversation_history=conversation_history,
-                model=model
-            )
+            try:
+                ai_response, usage_info = await self._generate_ai_response(
+                    conversation=conversation,
+                    user_message=user_message,
+                    model=model,
+                    on_chunk=on_chunk
+                )
+            except Exception:
+                # AI失敗時仍保留用戶訊息（呼叫AI前已寫入時不需再寫）
+                await self._save_unsaved_turn()
+                raise
             
-            # 添加AI回應
-            ai_msg = self.conversation_service.add_message(
-                conversation_id=conversation.id,
-                message_type="assistant",
-                content=ai_response,
+            # 寫入AI回應（尚未寫入時與用戶訊息在同一個交易）
+            ai_msg = Message.create_assistant_message(
+                conversation.id,
+                ai_response,
                 tokens_used=usage_info.get("total_tokens"),
                 processing_time_ms=usage_info.get("processing_time_ms")
             )
+            ai_msg.created_at = datetime.now(timezone.utc)
+            unsaved_user_msg = self._take_unsaved_user_message()
+            await self.conversation_service.save_turn(conversation, unsaved_user_msg, ai_msg)
             
-            # 更新對話統計
-            self._update_conversation_stats(conversation, usage_info)
+            # 提交後視需要在背景更新滾動摘要
+            if self.summarizer:
+                self.summarizer.schedule(conversation)
             
             return ai_response, str(conversation.id), usage_info
             
+        except AIServiceUnavailableError:
+            raise
         except Exception as e:
             raise AIServiceException(f"處理用戶訊息失敗: {e}")
     
-    def _generate_ai_response(
+    async def _release_connection(self):
+        """呼叫AI前提交目前的交易並歸還連線（本輪的用戶訊息與狀態變更一併寫入）"""
+        if await self._save_unsaved_turn():
+            return
+        if self.db_session.in_transaction():
+            await self.db_session.commit()
+    
+    async def _save_unsaved_turn(self) -> bool:
+        """寫入本輪尚未寫入的用戶訊息並提交，回傳是否有寫入"""
+        if self._unsaved_turn is None:
+            return False
+        conversation = self._unsaved_turn[0]
+        await self.conversation_service.save_turn(conversation, self._take_unsaved_user_message())
+        return True
+    
+    def _take_unsaved_user_message(self) -> Optional[Message]:
+        """取出本輪尚未寫入的用戶訊息（取出後視為已寫入）"""
+        if self._unsaved_turn is None:
+            return None
+        user_msg = self._unsaved_turn[1]
+        self._unsaved_turn = None
+        return user_msg
+    
+    async def _generate_ai_response(
         self,
         conversation: Conversation,
         user_message: str,
-        conversation_history: List[Message],
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Tuple[str, Dict[str, Any]]:
-        """生成AI回應"""
+        """生成AI回應（狀態變更只修改對話物件，由呼叫端統一提交）"""
         try:
             # 檢查是否為重置關鍵詞
             if self.prompt_service.is_reset_keyword(user_message):
-                self.conversation_service.reset_conversation(conversation.id)
-                # 重新獲取對話以更新狀態
-                conversation = self.conversation_service.get_conversation_by_id(conversation.id)
+                await self.conversation_service.reset_conversation(conversation.id, commit=False)
                 return self.prompt_service.get_reset_message(), {}
             
             # 根據對話狀態處理
             if conversation.state == "initial":
-                return self._handle_initial_state(conversation, user_message, model)
+                return await self._handle_initial_state(conversation, user_message, model)
             elif conversation.state == "category_confirmation":
-                return self._handle_category_confirmation(conversation, user_message, model)
+                return await self._handle_category_confirmation(conversation, user_message, model)
             elif conversation.state == "conversation":
-                return self._handle_conversation_state(
-                    conversation, user_message, conversation_history, model
+                return await self._handle_conversation_state(
+                    conversation, user_message, model, on_chunk=on_chunk
                 )
             else:
-                return self._handle_unknown_state(conversation, user_message, model)
+                return await self._handle_unknown_state(conversation, user_message, model)
                 
+        except AIServiceUnavailableError:
+            raise
         except Exception as e:
             raise AIServiceException(f"生成AI回應失敗: {e}")
     
-    def _handle_initial_state(
+    async def _handle_initial_state(
         self,
         conversation: Conversation,
         user_message: str,
@@ -122,17 +177,16 @@ class AIManager:
         category = self.prompt_service.validate_category_selection(user_message)
         if category:
             # 更新對話狀態
-            self.conversation_service.update_conversation_state(
-                conversation.id, "category_confirmation"
+            await self.conversation_service.update_conversation_state(
+                conversation.id, "category_confirmation", commit=False
             )
             conversation.category_key = category["key"]
-            self.db_session.commit()
             
             return self.prompt_service.get_category_confirmation(category), {}
         else:
             return self.prompt_service.get_invalid_selection_message(), {}
     
-    def _handle_category_confirmation(
+    async def _handle_category_confirmation(
         self,
         conversation: Conversation,
         user_message: str,
@@ -142,69 +196,114 @@ class AIManager:
         confirm_result = self.prompt_service.is_confirm_keyword(user_message)
         
         if confirm_result == "yes":
-            # 確認分類，開始對話
-            self.conversation_service.update_conversation_state(
-                conversation.id, "conversation"
-            )
-            
-            # 生成初始回應
-            category = self.prompt_service.get_category_from_db(conversation.category_key)
+            # 生成初始回應，成功後才確認分類並開始對話
+            category = await self.prompt_service.get_category_from_db(conversation.category_key)
             if category:
-                return self.ai_service.generate_initial_response(
+                await self._release_connection()
+                response = await self.ai_service.generate_initial_response(
                     category_name=category.name,
                     category_description=category.description,
                     model=model
                 )
             else:
-                return "好的，讓我們開始對話吧！", {}
+                response = "好的，讓我們開始對話吧！", {}
+            
+            await self.conversation_service.update_conversation_state(
+                conversation.id, "conversation", commit=False
+            )
+            return response
                 
         elif confirm_result == "no":
             # 拒絕分類，回到初始狀態
-            self.conversation_service.update_conversation_state(
-                conversation.id, "initial"
+            await self.conversation_service.update_conversation_state(
+                conversation.id, "initial", commit=False
             )
             conversation.category_key = None
-            self.db_session.commit()
             
             return self.prompt_service.get_reset_message(), {}
         else:
             return self.prompt_service.get_invalid_confirmation_message(), {}
     
-    def _handle_conversation_state(
+    async def _handle_conversation_state(
         self,
         conversation: Conversation,
         user_message: str,
-        conversation_history: List[Message],
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Tuple[str, Dict[str, Any]]:
         """處理對話狀態"""
         # 檢查是否為重置關鍵詞
         if self.prompt_service.is_reset_keyword(user_message):
-            self.conversation_service.reset_conversation(conversation.id)
+            await self.conversation_service.reset_conversation(conversation.id, commit=False)
             return self.prompt_service.get_reset_message(), {}
         
+        # 只有進入對話階段才需要歷史（摘要之後最近的訊息，不含本輪訊息）
+        recent_messages = await self.conversation_service.get_recent_messages(
+            conversation.id,
+            limit=self.settings.max_conversation_history,
+            after=conversation.summary_position
+        )
+        conversation_history = list(reversed(recent_messages))
+        
         # 獲取分類的Prompt模板
+        category = None
         if conversation.category_key:
-            category = self.prompt_service.get_category_from_db(conversation.category_key)
-            if category:
-                return self.ai_service.generate_category_response(
-                    user_message=user_message,
-                    category_prompt=category.prompt_template,
-                    conversation_history=conversation_history,
-                    model=model,
-                    conversation_id=str(conversation.id)
-                )
+            category = await self.prompt_service.get_category_from_db(conversation.category_key)
+        
+        await self._release_connection()
+        
+        # 依對話指定的ai_model與模型健康狀態選擇模型
+        model = model or self.ai_service.model_router.select("coaching", conversation.ai_model)
+        
+        if category:
+            # 選定分類後的第一個提問常常大同小異，先查核准回答的相似度快取
+            if self.first_turn_cache.enabled and self._is_first_category_turn(conversation, conversation_history):
+                cached = self.first_turn_cache.lookup(category.category_key, user_message)
+                if cached:
+                    response, similarity = cached
+                    return response, {
+                        "prompt_tokens": 0,
+                        "completion_tokens": 0,
+                        "total_tokens": 0,
+                        "model": model,
+                        "cached": True,
+                        "semantic_similarity": similarity
+                    }
+            
+            return await self.ai_service.generate_category_response(
+                user_message=user_message,
+                category_prompt=category.prompt_template,
+                conversation_history=conversation_history,
+                model=model,
+                conversation_id=str(conversation.id),
+                summary=conversation.summary,
+                on_chunk=on_chunk
+            )
         
         # 如果沒有分類，使用通用回應
-        return self.ai_service.generate_conversation_response(
+        return await self.ai_service.generate_conversation_response(
             user_message=user_message,
             conversation_history=conversation_history,
             system_prompt="你是一個友善的AI助手，請根據用戶的問題提供有用的建議。",
             model=model,
-            conversation_id=str(conversation.id)
+            conversation_id=str(conversation.id),
+            summary=conversation.summary,
+            on_chunk=on_chunk
         )
     
-    def _handle_unknown_state(
+    def _is_first_category_turn(self, conversation: Conversation, conversation_history: List[Message]) -> bool:
+        """是否為選定分類後的第一個提問（歷史中最後一則用戶訊息是確認分類）"""
+        if conversation.summary:
+            return False
+        last_user_message = next(
+            (msg for msg in reversed(conversation_history) if msg.message_type == "user"), None
+        )
+        return (
+            last_user_message is not None
+            and self.prompt_service.is_confirm_keyword(last_user_message.content) == "yes"
+        )
+    
+    async def _handle_unknown_state(
         self,
         conversation: Conversation,
         user_message: str,
@@ -212,48 +311,37 @@ class AIManager:
     ) -> Tuple[str, Dict[str, Any]]:
         """處理未知狀態"""
         # 重置到初始狀態
-        self.conversation_service.update_conversation_state(
-            conversation.id, "initial"
+        await self.conversation_service.update_conversation_state(
+            conversation.id, "initial", commit=False
         )
         return self.prompt_service.get_reset_message(), {}
     
-    def _update_conversation_stats(
-        self,
-        conversation: Conversation,
-        usage_info: Dict[str, Any]
-    ):
-        """更新對話統計"""
-        try:
-            if usage_info.get("total_tokens"):
-                conversation.total_tokens += usage_info["total_tokens"]
-            
-            conversation.last_activity_at = datetime.utcnow()
-            self.db_session.commit()
-            
-        except Exception as e:
-            # 統計更新失敗不影響主要功能
-            print(f"更新對話統計失敗: {e}")
-    
-    def get_conversation_summary(
+    async def get_conversation_summary(
         self,
         conversation_id: str,
         model: Optional[str] = None
     ) -> Tuple[str, Dict[str, Any]]:
         """獲取對話總結"""
         try:
-            conversation = self.conversation_service.get_conversation_by_id(conversation_id)
+            conversation = await self.conversation_service.get_conversation_by_id(conversation_id)
             if not conversation:
                 raise AIServiceException(f"找不到對話 ID: {conversation_id}")
             
-            # 獲取對話歷史
-            conversation_history = self.conversation_service.get_conversation_messages(
-                conversation_id, limit=50
+            # 已有滾動摘要時只整合摘要之後的訊息
+            recent_messages = await self.conversation_service.get_recent_messages(
+                conversation_id, limit=50, after=conversation.summary_position
             )
+            conversation_history = list(reversed(recent_messages))
+            if conversation.summary and not conversation_history:
+                return conversation.summary, {}
+            
+            await self._release_connection()
             
             # 生成總結
-            summary, usage_info = self.ai_service.generate_summary_response(
+            summary, usage_info = await self.ai_service.generate_summary_response(
                 conversation_history=conversation_history,
-                model=model
+                model=model,
+                previous_summary=conversation.summary
             )
             
             return summary, usage_info
@@ -261,10 +349,10 @@ class AIManager:
         except Exception as e:
             raise AIServiceException(f"獲取對話總結失敗: {e}")
     
-    def check_ai_service_health(self) -> Dict[str, Any]:
+    async def check_ai_service_health(self) -> Dict[str, Any]:
         """檢查AI服務健康狀態"""
         try:
-            return self.ai_service.check_api_health()
+            return await self.ai_service.check_api_health()
         except Exception as e:
             return {
                 "status": "unhealthy",
@@ -272,17 +360,17 @@ class AIManager:
                 "timestamp": datetime.utcnow().isoformat()
             }
     
-    def get_available_models(self) -> List[str]:
+    async def get_available_models(self) -> List[str]:
         """獲取可用模型列表"""
         try:
-            return self.ai_service.get_available_models()
+            return await self.ai_service.get_available_models()
         except Exception as e:
             raise AIServiceException(f"獲取可用模型失敗: {e}")
     
-    def validate_model(self, model: str) -> bool:
+    async def validate_model(self, model: str) -> bool:
         """驗證模型是否可用"""
         try:
-            return self.ai_service.validate_model(model)
+            return await self.ai_service.validate_model(model)
         except Exception as e:
             raise AIServiceException(f"驗證模型失敗: {e}")
     
@@ -293,40 +381,51 @@ class AIManager:
     ) -> Dict[str, Any]:
         """估算對話成本"""
         try:
-            # 估算輸入token
-            input_tokens = 0
-            for msg in conversation_history:
-                input_tokens += self.ai_service.estimate_tokens(msg.content)
+            token_counter = self.ai_service.token_counter
             
-            # 估算輸出token
-            output_tokens = self.ai_service.estimate_tokens("x" * estimated_response_length)
+            # 計算輸入token（已存的token數直接使用，其餘一次批次計算）
+            input_tokens = sum(token_counter.count_history(conversation_history))
+            input_tokens += (
+                token_counter.TOKENS_PER_MESSAGE * len(conversation_history) + token_counter.TOKENS_PER_REPLY
+            )
+            
+            # 估算輸出token（中文回應約每字1個token）
+            output_tokens = estimated_response_length
             
-            # 簡單的成本估算（GPT-3.5-turbo的價格）
-            input_cost = input_tokens * 0.0015 / 1000  # $0.0015 per 1K tokens
-            output_cost = output_tokens * 0.002 / 1000  # $0.002 per 1K tokens
+            # 依對話輔導使用的模型價格估算
+            model_router = self.ai_service.model_router
+            model = model_router.select("coaching")
             
             return {
                 "input_tokens": input_tokens,
                 "output_tokens": output_tokens,
                 "total_tokens": input_tokens + output_tokens,
-                "estimated_cost_usd": input_cost + output_cost,
-                "model": self.settings.openai_model
+                "estimated_cost_usd": model_router.estimate_cost(model, input_tokens, output_tokens),
+                "model": model
             }
             
         except Exception as e:
             raise AIServiceException(f"估算成本失敗: {e}")
     
-    def get_usage_statistics(self, user_id: str) -> Dict[str, Any]:
+    async def get_usage_statistics(self, user_id: str) -> Dict[str, Any]:
         """獲取用戶使用統計"""
         try:
-            stats = self.conversation_service.get_conversation_statistics(user_id)
+            stats = await self.conversation_service.get_conversation_statistics(user_id)
             
-            # 計算總成本（簡單估算）
-            total_cost = stats["total_tokens"] * 0.002 / 1000  # 假設平均價格
+            # 依各對話使用的模型與模型價格（與模型路由器的成本統計相同）估算成本
+            model_router = self.ai_service.model_router
+            cost_by_model: Dict[str, float] = {}
+            usage_by_ai_model = await self.conversation_service.get_token_usage_by_model(user_id)
+            for ai_model, usage in usage_by_ai_model.items():
+                model = model_router.conversation_model(ai_model)
+                cost_by_model[model] = cost_by_model.get(model, 0.0) + model_router.estimate_cost(
+                    model, usage["prompt_tokens"], usage["completion_tokens"]
+                )
             
             return {
                 **stats,
-                "estimated_total_cost_usd": total_cost,
+                "estimated_total_cost_usd": sum(cost_by_model.values()),
+                "estimated_cost_by_model_usd": cost_by_model,
                 "average_tokens_per_conversation": (
                     stats["total_tokens"] / stats["total_conversations"]
                     if stats["total_conversations"] > 0 else 0
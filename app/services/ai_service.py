@@ -1,15 +1,133 @@
 """
 AI服務整合
 """
+import asyncio
 import time
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
 from datetime import datetime
+import httpx
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
 
+from app.core.circuit_breaker import AdaptiveConcurrencyLimiter, CircuitBreaker
 from app.core.config import Settings
-from app.core.exceptions import AIServiceException, DatabaseError
+from app.core.hedging import RequestHedger
+from app.core.exceptions import AIServiceException, AIServiceUnavailableError, DatabaseError
+from app.core.rate_limiter import get_rate_limiter
 from app.models import Message, Conversation
+from app.services.context_builder import ContextBuilder
+from app.services.model_router import get_model_router
+from app.services.response_chunker import ResponseChunker
+from app.services.response_cache import ResponseCache, get_response_cache
+from app.services.token_counter import get_token_counter
+
+
+# 行程共用的OpenAI非同步客戶端（保持連線池與keep-alive連線）
+_async_client: Optional[AsyncOpenAI] = None
+
+
+def get_async_openai_client(settings: Settings) -> AsyncOpenAI:
+    """獲取行程共用的OpenAI非同步客戶端"""
+    global _async_client
+    if _async_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive_connections,
+                keepalive_expiry=settings.openai_keepalive_expiry_seconds
+            ),
+            timeout=httpx.Timeout(settings.openai_timeout_seconds, connect=5.0)
+        )
+        _async_client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            timeout=settings.openai_timeout_seconds,
+            max_retries=settings.openai_max_retries,
+            http_client=http_client
+        )
+    return _async_client
+
+
+async def close_async_openai_client():
+    """關閉行程共用的OpenAI非同步客戶端"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+
+def _is_upstream_failure(error: BaseException) -> bool:
+    """是否為OpenAI端的故障（計入斷路器失敗率）"""
+    return isinstance(error, (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError
+    ))
+
+
+def _is_overload(error: BaseException) -> bool:
+    """是否為過載訊號（降低並發上限）"""
+    return isinstance(error, (openai.RateLimitError, openai.APITimeoutError))
+
+
+# 行程共用的API探測結果（models.retrieve不消耗token，結果快取openai_health_probe_interval_seconds）
+_health_probe: Optional[Dict[str, Any]] = None
+
+# 行程共用的斷路器、並發限制器與對沖請求器（所有OpenAI呼叫共用同一份狀態）
+_circuit_breaker: Optional[CircuitBreaker] = None
+_concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None
+_request_hedger: Optional[RequestHedger] = None
+
+
+def get_openai_circuit_breaker(settings: Settings) -> CircuitBreaker:
+    """獲取行程共用的OpenAI斷路器"""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker(
+            name="OpenAI",
+            enabled=settings.openai_circuit_breaker_enabled,
+            failure_rate_threshold=settings.openai_circuit_failure_rate_threshold,
+            minimum_calls=settings.openai_circuit_minimum_calls,
+            window_seconds=settings.openai_circuit_window_seconds,
+            open_seconds=settings.openai_circuit_open_seconds,
+            half_open_max_calls=settings.openai_circuit_half_open_max_calls,
+            is_failure=_is_upstream_failure
+        )
+    return _circuit_breaker
+
+
+def get_openai_concurrency_limiter(settings: Settings) -> AdaptiveConcurrencyLimiter:
+    """獲取行程共用的OpenAI並發限制器"""
+    global _concurrency_limiter
+    if _concurrency_limiter is None:
+        _concurrency_limiter = AdaptiveConcurrencyLimiter(
+            name="OpenAI",
+            enabled=settings.openai_adaptive_concurrency_enabled,
+            initial_limit=settings.openai_concurrency_initial_limit,
+            min_limit=settings.openai_concurrency_min_limit,
+            max_limit=settings.openai_concurrency_max_limit,
+            latency_tolerance=settings.openai_concurrency_latency_tolerance,
+            baseline_min_samples=settings.openai_concurrency_baseline_min_samples,
+            backoff_ratio=settings.openai_concurrency_backoff_ratio,
+            queue_timeout_seconds=settings.openai_concurrency_queue_timeout_seconds,
+            is_overload=_is_overload
+        )
+    return _concurrency_limiter
+
+
+def get_openai_request_hedger(settings: Settings) -> RequestHedger:
+    """獲取行程共用的OpenAI對沖請求器"""
+    global _request_hedger
+    if _request_hedger is None:
+        _request_hedger = RequestHedger(
+            name="OpenAI",
+            enabled=settings.openai_hedging_enabled,
+            percentile=settings.openai_hedge_percentile,
+            budget_ratio=settings.openai_hedge_budget_ratio,
+            min_samples=settings.openai_hedge_min_samples,
+            min_delay_seconds=settings.openai_hedge_min_delay_seconds
+        )
+    return _request_hedger
 
 
 class AIService:
@@ -17,24 +135,59 @@ class AIService:
     
     def __init__(self, settings: Settings):
         self.settings = settings
-        self.client = OpenAI(api_key=settings.openai_api_key)
+        self.client = get_async_openai_client(settings)
         self.default_model = settings.openai_model
+        self.token_counter = get_token_counter()
+        self.context_builder = ContextBuilder(settings, self.token_counter)
+        self.response_cache = get_response_cache(settings) if settings.response_cache_enabled else None
+        self.circuit_breaker = get_openai_circuit_breaker(settings)
+        self.concurrency_limiter = get_openai_concurrency_limiter(settings)
+        self.rate_limiter = get_rate_limiter(settings) if settings.rate_limit_enabled else None
+        self.model_router = get_model_router(settings)
+        self.hedger = get_openai_request_hedger(settings)
+        
+        # 串流回應統計
+        self.streaming_stats = {
+            "stream_count": 0,
+            "chunk_count": 0,
+            "error_count": 0,
+            "time_to_first_chunk_ms_total": 0
+        }
     
-    def generate_response(
+    async def generate_response(
         self,
         messages: List[Dict[str, str]],
         model: Optional[str] = None,
         temperature: float = 0.7,
         max_tokens: Optional[int] = None,
-        conversation_id: Optional[str] = None
+        conversation_id: Optional[str] = None,
+        cache: bool = False,
+        call_type: str = "coaching"
     ) -> Tuple[str, Dict[str, Any]]:
-        """生成AI回應"""
+        """生成AI回應（cache=True時先查回應快取，只適用於與用戶無關的固定輸入；call_type用於並發限制的延遲基準）"""
         try:
             start_time = time.time()
             
             # 使用指定的模型或預設模型
             model_name = model or self.default_model
             
+            cache_key = None
+            if cache and self.response_cache:
+                cache_key = ResponseCache.make_key(model_name, messages, temperature)
+                cached = await self.response_cache.get(cache_key)
+                if cached:
+                    ai_response, usage_info = cached
+                    # 命中快取不消耗token
+                    usage_info.update({
+                        "prompt_tokens": 0,
+                        "completion_tokens": 0,
+                        "total_tokens": 0,
+                        "processing_time_ms": int((time.time() - start_time) * 1000),
+                        "conversation_id": conversation_id,
+                        "cached": True
+                    })
+                    return ai_response, usage_info
+            
             # 準備API請求參數
             request_params = {
                 "model": model_name,
@@ -45,8 +198,38 @@ class AIService:
             if max_tokens:
                 request_params["max_tokens"] = max_tokens
             
-            # 調用OpenAI API
-            response = self.client.chat.completions.create(**request_params)
+            # 依模型的RPM/TPM預約額度，不足時排隊等待
+            _, rate_limit_wait = await self._wait_for_rate_limit(model_name, messages, max_tokens)
+            
+            # 調用OpenAI API（回應過慢時視需要送出對沖請求）
+            call_start = time.time()
+            try:
+                response = await self.hedger.run(
+                    model_name,
+                    lambda hedge: self._create_completion(request_params, call_type, hedge, messages, max_tokens)
+                )
+            except Exception as e:
+                self._record_model_failure(model_name, call_start, e)
+                retry_model = self.model_router.retry_model(model_name) if _is_upstream_failure(e) else None
+                if not retry_model:
+                    raise
+                
+                # 上游故障時以備援模型重試一次
+                print(f"模型 {model_name} 呼叫失敗，改用 {retry_model} 重試: {e}")
+                model_name = retry_model
+                request_params["model"] = retry_model
+                # 備援模型的回應不寫入主要模型的快取
+                cache_key = None
+                await self._wait_for_rate_limit(model_name, messages, max_tokens)
+                call_start = time.time()
+                try:
+                    response = await self.hedger.run(
+                        model_name,
+                        lambda hedge: self._create_completion(request_params, call_type, hedge, messages, max_tokens)
+                    )
+                except Exception as retry_error:
+                    self._record_model_failure(model_name, call_start, retry_error)
+                    raise
             
             # 計算處理時間
             processing_time_ms = int((time.time() - start_time) * 1000)
@@ -63,90 +246,321 @@ class AIService:
                 "processing_time_ms": processing_time_ms,
                 "conversation_id": conversation_id
             }
+            if rate_limit_wait:
+                usage_info["rate_limit_wait_ms"] = int(rate_limit_wait * 1000)
+            self.model_router.record(
+                model_name,
+                int((time.time() - call_start) * 1000),
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens
+            )
+            
+            if cache_key and ai_response:
+                await self.response_cache.set(cache_key, ai_response, usage_info)
             
             return ai_response, usage_info
             
-        except openai.RateLimitError as e:
-            raise AIServiceException(f"API速率限制: {e}")
-        except openai.APITimeoutError as e:
-            raise AIServiceException(f"API超時: {e}")
-        except openai.APIConnectionError as e:
-            raise AIServiceException(f"API連接錯誤: {e}")
-        except openai.AuthenticationError as e:
-            raise AIServiceException(f"API認證錯誤: {e}")
-        except openai.PermissionError as e:
-            raise AIServiceException(f"API權限錯誤: {e}")
         except Exception as e:
-            raise AIServiceException(f"AI服務錯誤: {e}")
+            raise self._wrap_api_error(e)
     
-    def generate_conversation_response(
+    async def generate_streaming_response(
+        self,
+        messages: List[Dict[str, str]],
+        on_chunk: Callable[[str], Awaitable[None]],
+        model: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        conversation_id: Optional[str] = None,
+        call_type: str = "coaching"
+    ) -> Tuple[str, Dict[str, Any]]:
+        """以串流方式生成AI回應，每完成一段（句子或段落）就交給on_chunk，回傳完整回應
+
+        段落先放入佇列，由另一個任務交給on_chunk（例如呼叫LINE API），
+        斷路器與並發名額只在讀取上游串流期間佔用，不會因下游送出變慢而被拖住。
+        """
+        try:
+            start_time = time.time()
+            model_name = model or self.default_model
+            
+            request_params = {
+                "model": model_name,
+                "messages": messages,
+                "temperature": temperature,
+                "stream": True,
+            }
+            
+            if max_tokens:
+                request_params["max_tokens"] = max_tokens
+            
+            chunker = ResponseChunker(
+                first_chunk_min_chars=self.settings.stream_first_chunk_min_chars,
+                chunk_min_chars=self.settings.stream_chunk_min_chars,
+                chunk_max_chars=self.settings.stream_chunk_max_chars
+            )
+            parts: List[str] = []
+            first_token_ms = None
+            first_token_at = None
+            first_chunk_ms = None
+            
+            prompt_tokens, rate_limit_wait = await self._wait_for_rate_limit(model_name, messages, max_tokens)
+            
+            chunks: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+            sender = asyncio.create_task(self._send_chunks(chunks, on_chunk))
+            call_start = time.time()
+            try:
+                try:
+                    # 並發限制與非串流呼叫相同，以完整呼叫時間與同類型呼叫的基準比較
+                    async with self.circuit_breaker.guard(), self.concurrency_limiter.acquire(call_type):
+                        stream = await self.client.chat.completions.create(**request_params)
+                        async for event in stream:
+                            if sender.done():
+                                # 下游送出失敗，不再讀取串流
+                                await stream.response.aclose()
+                                break
+                            if not event.choices:
+                                continue
+                            delta = event.choices[0].delta.content
+                            if not delta:
+                                continue
+                            if first_token_ms is None:
+                                first_token_at = time.time()
+                                first_token_ms = int((first_token_at - start_time) * 1000)
+                            parts.append(delta)
+                            
+                            for chunk in chunker.feed(delta):
+                                if first_chunk_ms is None:
+                                    first_chunk_ms = int((time.time() - start_time) * 1000)
+                                chunks.put_nowait(chunk)
+                except Exception as e:
+                    self._record_model_failure(model_name, call_start, e, streamed=True)
+                    raise
+                
+                last_chunk = chunker.flush()
+                if last_chunk:
+                    if first_chunk_ms is None:
+                        first_chunk_ms = int((time.time() - start_time) * 1000)
+                    chunks.put_nowait(last_chunk)
+            finally:
+                # 上游結束或失敗後，送完已產生的段落（取消時連同送出任務一起取消）
+                chunks.put_nowait(None)
+                send_result = (await asyncio.gather(sender, return_exceptions=True))[0]
+            if isinstance(send_result, Exception):
+                raise send_result
+            
+            processing_time_ms = int((time.time() - start_time) * 1000)
+            ai_response = "".join(parts)
+            
+            # 串流回應不含用量，以tokenizer計算
+            completion_tokens = self.token_counter.count(ai_response)
+            
+            self.streaming_stats["stream_count"] += 1
+            self.streaming_stats["chunk_count"] += chunker.chunk_count
+            if first_chunk_ms is not None:
+                self.streaming_stats["time_to_first_chunk_ms_total"] += first_chunk_ms
+            
+            usage_info = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "model": model_name,
+                "processing_time_ms": processing_time_ms,
+                "time_to_first_token_ms": first_token_ms,
+                "time_to_first_chunk_ms": first_chunk_ms,
+                "chunks": chunker.chunk_count,
+                "streamed": True,
+                "conversation_id": conversation_id
+            }
+            if rate_limit_wait:
+                usage_info["rate_limit_wait_ms"] = int(rate_limit_wait * 1000)
+            # 串流的完整時間隨回應長度增加，模型路由以首個token的時間判斷延遲
+            self.model_router.record(
+                model_name,
+                int(((first_token_at or time.time()) - call_start) * 1000),
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                streamed=True
+            )
+            
+            return ai_response, usage_info
+            
+        except Exception as e:
+            self.streaming_stats["error_count"] += 1
+            raise self._wrap_api_error(e)
+    
+    @staticmethod
+    async def _send_chunks(
+        chunks: "asyncio.Queue[Optional[str]]",
+        on_chunk: Callable[[str], Awaitable[None]]
+    ):
+        """依序將佇列中的段落交給on_chunk，收到None時結束"""
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                return
+            await on_chunk(chunk)
+    
+    async def _create_completion(
+        self,
+        request_params: Dict[str, Any],
+        call_type: str,
+        hedge: bool = False,
+        messages: Optional[List[Dict[str, str]]] = None,
+        max_tokens: Optional[int] = None
+    ):
+        """調用OpenAI API（斷路器斷開時快速失敗，超過並發上限時排隊）"""
+        if hedge:
+            # 對沖請求同樣計入RPM/TPM額度
+            await self._wait_for_rate_limit(request_params["model"], messages or [], max_tokens)
+        async with self.circuit_breaker.guard(), self.concurrency_limiter.acquire(call_type):
+            return await self.client.chat.completions.create(**request_params)
+    
+    async def _wait_for_rate_limit(
+        self,
+        model_name: str,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None
+    ) -> Tuple[int, float]:
+        """依模型的每分鐘請求數與token數預約額度，回傳（輸入token數, 等待秒數）"""
+        prompt_tokens = self.token_counter.count_messages(messages)
+        if not self.rate_limiter:
+            return prompt_tokens, 0.0
+        
+        limits = self.settings.openai_model_rate_limits.get(model_name, {})
+        requests_per_minute = limits.get("requests_per_minute", self.settings.openai_requests_per_minute)
+        tokens_per_minute = limits.get("tokens_per_minute", self.settings.openai_tokens_per_minute)
+        # OpenAI以輸入token加上max_tokens計算TPM
+        estimated_tokens = prompt_tokens + (max_tokens or self.settings.rate_limit_completion_tokens_estimate)
+        
+        waited = await self.rate_limiter.acquire([
+            (f"openai:{model_name}:requests", requests_per_minute / 60, 1),
+            (f"openai:{model_name}:tokens", tokens_per_minute / 60, estimated_tokens)
+        ])
+        return prompt_tokens, waited
+    
+    def _record_model_failure(self, model_name: str, call_start: float, error: Exception, streamed: bool = False):
+        """記錄上游故障，供模型路由判斷是否改用備援模型"""
+        if _is_upstream_failure(error):
+            self.model_router.record(
+                model_name,
+                int((time.time() - call_start) * 1000),
+                success=False,
+                streamed=streamed
+            )
+    
+    @staticmethod
+    def _wrap_api_error(error: Exception) -> AIServiceException:
+        """將OpenAI錯誤轉換為AIServiceException"""
+        if isinstance(error, AIServiceException):
+            return error
+        if isinstance(error, openai.RateLimitError):
+            return AIServiceException(f"API速率限制: {error}")
+        if isinstance(error, openai.APITimeoutError):
+            return AIServiceException(f"API超時: {error}")
+        if isinstance(error, openai.APIConnectionError):
+            return AIServiceException(f"API連接錯誤: {error}")
+        if isinstance(error, openai.AuthenticationError):
+            return AIServiceException(f"API認證錯誤: {error}")
+        if isinstance(error, openai.PermissionDeniedError):
+            return AIServiceException(f"API權限錯誤: {error}")
+        return AIServiceException(f"AI服務錯誤: {error}")
+    
+    def get_streaming_stats(self) -> Dict[str, Any]:
+        """獲取串流回應統計"""
+        stats = self.streaming_stats
+        return {
+            **stats,
+            "average_time_to_first_chunk_ms": (
+                stats["time_to_first_chunk_ms_total"] / stats["stream_count"] if stats["stream_count"] else 0
+            ),
+            "average_chunks": stats["chunk_count"] / stats["stream_count"] if stats["stream_count"] else 0
+        }
+    
+    async def generate_conversation_response(
         self,
         user_message: str,
         conversation_history: List[Message],
         system_prompt: str,
         model: Optional[str] = None,
-        conversation_id: Optional[str] = None
+        conversation_id: Optional[str] = None,
+        summary: Optional[str] = None,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Tuple[str, Dict[str, Any]]:
-        """生成對話回應"""
+        """生成對話回應（歷史依模型的token預算由新到舊截取，較舊的內容以摘要代替）
+
+        提供on_chunk且啟用串流時，以串流方式生成並逐段交給on_chunk。
+        """
         try:
-            # 構建訊息列表
-            messages = [{"role": "system", "content": system_prompt}]
+            model = model or self.model_router.select("coaching")
             
-            # 添加對話歷史
-            for msg in conversation_history:
-                role = "user" if msg.message_type == "user" else "assistant"
-                messages.append({
-                    "role": role,
-                    "content": msg.content
-                })
-            
-            # 添加當前用戶訊息
-            messages.append({
-                "role": "user",
-                "content": user_message
-            })
-            
-            # 生成回應
-            return self.generate_response(
-                messages=messages,
+            # 構建訊息列表
+            messages, context_info = self.context_builder.build(
+                system_prompt=system_prompt,
+                conversation_history=conversation_history,
+                user_message=user_message,
                 model=model,
-                conversation_id=conversation_id
+                summary=summary
             )
             
+            # 生成回應
+            if on_chunk and self.settings.openai_streaming_enabled:
+                ai_response, usage_info = await self.generate_streaming_response(
+                    messages=messages,
+                    on_chunk=on_chunk,
+                    model=model,
+                    conversation_id=conversation_id
+                )
+            else:
+                ai_response, usage_info = await self.generate_response(
+                    messages=messages,
+                    model=model,
+                    conversation_id=conversation_id
+                )
+            usage_info.update(context_info)
+            
+            return ai_response, usage_info
+            
+        except AIServiceUnavailableError:
+            raise
         except Exception as e:
             raise AIServiceException(f"生成對話回應失敗: {e}")
     
-    def generate_category_response(
+    async def generate_category_response(
         self,
         user_message: str,
         category_prompt: str,
         conversation_history: List[Message],
         model: Optional[str] = None,
-        conversation_id: Optional[str] = None
+        conversation_id: Optional[str] = None,
+        summary: Optional[str] = None,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Tuple[str, Dict[str, Any]]:
         """生成分類專用回應"""
         try:
             # 直接使用分類的prompt模板作為系統提示
             system_prompt = category_prompt
             
-            return self.generate_conversation_response(
+            return await self.generate_conversation_response(
                 user_message=user_message,
                 conversation_history=conversation_history,
                 system_prompt=system_prompt,
                 model=model,
-                conversation_id=conversation_id
+                conversation_id=conversation_id,
+                summary=summary,
+                on_chunk=on_chunk
             )
             
+        except AIServiceUnavailableError:
+            raise
         except Exception as e:
             raise AIServiceException(f"生成分類回應失敗: {e}")
     
-    def generate_initial_response(
+    async def generate_initial_response(
         self,
         category_name: str,
         category_description: str,
         model: Optional[str] = None
     ) -> Tuple[str, Dict[str, Any]]:
-        """生成初始回應"""
+        """生成初始回應（輸入只有分類資訊，與用戶無關，使用回應快取）"""
         try:
             system_prompt = f"""你是一個專業的{category_name}顧問。
 
@@ -159,20 +573,25 @@ class AIService:
                 {"role": "user", "content": "你好，我想開始對話"}
             ]
             
-            return self.generate_response(
+            return await self.generate_response(
                 messages=messages,
-                model=model
+                model=model or self.model_router.select("greeting"),
+                cache=True,
+                call_type="greeting"
             )
             
+        except AIServiceUnavailableError:
+            raise
         except Exception as e:
             raise AIServiceException(f"生成初始回應失敗: {e}")
     
-    def generate_summary_response(
+    async def generate_summary_response(
         self,
         conversation_history: List[Message],
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        previous_summary: Optional[str] = None
     ) -> Tuple[str, Dict[str, Any]]:
-        """生成對話總結"""
+        """生成對話總結（提供previous_summary時只整合新增的對話）"""
         try:
             # 構建對話內容
             conversation_text = ""
@@ -188,90 +607,109 @@ class AIService:
 
 請用繁體中文回應，保持專業和友善的語氣。"""
             
+            if previous_summary:
+                user_content = (
+                    f"以下是先前對話的總結：\n\n{previous_summary}\n\n"
+                    f"請將以下新的對話內容整合進總結，輸出更新後的完整總結：\n\n{conversation_text}"
+                )
+            else:
+                user_content = f"請總結以下對話：\n\n{conversation_text}"
+            
             messages = [
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"請總結以下對話：\n\n{conversation_text}"}
+                {"role": "user", "content": user_content}
             ]
             
-            return self.generate_response(
+            return await self.generate_response(
                 messages=messages,
-                model=model
+                model=model or self.model_router.select("summary"),
+                call_type="summary"
             )
             
+        except AIServiceUnavailableError:
+            raise
         except Exception as e:
             raise AIServiceException(f"生成對話總結失敗: {e}")
     
-    def validate_model(self, model: str) -> bool:
+    async def validate_model(self, model: str) -> bool:
         """驗證模型是否可用"""
         try:
             # 嘗試獲取模型列表
-            models = self.client.models.list()
+            models = await self.client.models.list()
             available_models = [model.id for model in models.data]
             return model in available_models
         except Exception:
             return False
     
-    def get_available_models(self) -> List[str]:
+    async def get_available_models(self) -> List[str]:
         """獲取可用模型列表"""
         try:
-            models = self.client.models.list()
+            models = await self.client.models.list()
             return [model.id for model in models.data if model.id.startswith('gpt')]
         except Exception as e:
             raise AIServiceException(f"獲取模型列表失敗: {e}")
     
     def estimate_tokens(self, text: str) -> int:
-        """估算文本的token數量"""
-        try:
-            # 簡單的token估算（實際使用時可以更精確）
-            # 一般來說，1個token約等於0.75個英文單詞或2-3個中文字符
-            chinese_chars = len([c for c in text if '\u4e00' <= c <= '\u9fff'])
-            english_chars = len(text) - chinese_chars
-            
-            # 估算token數量
-            estimated_tokens = int(chinese_chars / 2.5 + english_chars / 4)
-            return max(estimated_tokens, 1)
-        except Exception:
-            return len(text) // 4  # 簡單估算
+        """計算文本的token數量（使用附帶詞表的tokenizer）"""
+        return self.token_counter.count(text)
     
-    def check_api_health(self) -> Dict[str, Any]:
-        """檢查API健康狀態"""
+    async def check_api_health(self) -> Dict[str, Any]:
+        """檢查API健康狀態（以快取的models.retrieve探測連線與金鑰，不消耗token；並回報斷路器與並發限制器狀態）"""
+        probe = await self._probe_api()
+        breaker = self.circuit_breaker.get_stats()
+        if breaker["state"] == CircuitBreaker.OPEN:
+            status = "circuit_open"
+        elif not probe["ok"]:
+            status = "unhealthy"
+        elif breaker["state"] == CircuitBreaker.HALF_OPEN:
+            status = "recovering"
+        else:
+            status = "healthy"
+        return {
+            "status": status,
+            "model": self.default_model,
+            "api_reachable": probe["ok"],
+            "probe_error": probe["error"],
+            "probe_latency_ms": probe["latency_ms"],
+            "probe_age_seconds": int(time.monotonic() - probe["checked_at"]),
+            "circuit_state": breaker["state"],
+            "window_calls": breaker["window_calls"],
+            "window_failure_rate": breaker["window_failure_rate"],
+            "retry_after_seconds": breaker["retry_after_seconds"],
+            "concurrency_limit": round(self.concurrency_limiter.limit, 2),
+            "in_flight": self.concurrency_limiter.in_flight,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    
+    async def _probe_api(self) -> Dict[str, Any]:
+        """以models.retrieve確認API可連線且金鑰有效，結果在行程內快取一段時間"""
+        global _health_probe
+        now = time.monotonic()
+        interval = self.settings.openai_health_probe_interval_seconds
+        if _health_probe is not None and now - _health_probe["checked_at"] < interval:
+            return _health_probe
+        
+        start_time = time.time()
         try:
-            start_time = time.time()
-            
-            # 發送簡單的測試請求
-            response = self.client.chat.completions.create(
-                model=self.default_model,
-                messages=[{"role": "user", "content": "Hello"}],
-                max_tokens=10
-            )
-            
-            response_time_ms = int((time.time() - start_time) * 1000)
-            
-            return {
-                "status": "healthy",
-                "model": self.default_model,
-                "response_time_ms": response_time_ms,
-                "tokens_used": response.usage.total_tokens if response.usage else 0,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
+            await self.client.with_options(
+                timeout=self.settings.openai_health_probe_timeout_seconds, max_retries=0
+            ).models.retrieve(self.default_model)
+            error = None
         except Exception as e:
-            return {
-                "status": "unhealthy",
-                "error": str(e),
-                "timestamp": datetime.utcnow().isoformat()
-            }
+            error = str(self._wrap_api_error(e))
+        _health_probe = {
+            "ok": error is None,
+            "error": error,
+            "latency_ms": int((time.time() - start_time) * 1000),
+            "checked_at": now
+        }
+        return _health_probe
     
     def get_usage_statistics(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Dict[str, Any]:
-        """獲取使用統計（需要OpenAI Pro帳戶）"""
+        """獲取各模型的使用統計（本行程最近的延遲、錯誤率與累計token成本）"""
         try:
-            # 注意：這需要OpenAI Pro帳戶才能使用
-            # 在實際應用中，我們會從自己的資料庫中統計使用情況
-            
-            return {
-                "message": "使用統計功能需要OpenAI Pro帳戶",
-                "suggestion": "建議從應用程式資料庫中統計使用情況"
-            }
+            # OpenAI的用量API需要另外的權限，這裡回傳模型路由器記錄的統計
+            return self.model_router.get_stats()
             
         except Exception as e:
             raise AIServiceException(f"獲取使用統計失敗: {e}")
@@ -301,7 +739,9 @@ class AIService:
     
     def format_error_response(self, error: Exception) -> str:
         """格式化錯誤回應"""
-        if isinstance(error, openai.RateLimitError):
+        if isinstance(error, AIServiceUnavailableError):
+            return "抱歉，目前使用人數較多，請稍後再試。"
+        elif isinstance(error, openai.RateLimitError):
             return "抱歉，目前服務使用量較高，請稍後再試。"
         elif isinstance(error, openai.APITimeoutError):
             return "抱歉，服務回應時間過長，請稍後再試。"
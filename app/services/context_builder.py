@@ -0,0 +1,88 @@
+"""
+對話上下文建構
+"""
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.core.config import Settings
+from app.models import Message
+from app.services.token_counter import TokenCounter
+
+
+class ContextBuilder:
+    """對話上下文建構器
+
+    在每個模型的token預算內，由新到舊挑選最近的對話歷史；
+    系統提示、先前對話摘要與本輪用戶訊息一定保留，且本輪訊息不會重複出現。
+    """
+
+    def __init__(self, settings: Settings, token_counter: TokenCounter):
+        self.settings = settings
+        self.token_counter = token_counter
+
+    def get_token_budget(self, model: str) -> int:
+        """獲取模型的上下文token預算（token數只是近似值的模型預留一部分餘裕）"""
+        budget = self.settings.context_token_budgets.get(model, self.settings.context_token_budget)
+        if not self.token_counter.is_exact(model):
+            budget = int(budget * (1 - self.settings.context_token_margin))
+        return budget
+
+    def build(
+        self,
+        system_prompt: str,
+        conversation_history: List[Message],
+        user_message: str,
+        model: str,
+        summary: Optional[str] = None
+    ) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """建構送往模型的訊息列表，並回傳上下文統計"""
+        history = list(conversation_history)
+
+        # 歷史已包含本輪訊息時移除，避免重複送出
+        if history and history[-1].message_type == "user" and history[-1].content == user_message:
+            history.pop()
+
+        overhead = TokenCounter.TOKENS_PER_MESSAGE
+        summary_message = None
+        fixed_texts = [system_prompt, user_message]
+        if summary:
+            summary_message = {"role": "system", "content": f"先前對話的摘要：\n{summary}"}
+            fixed_texts.append(summary_message["content"])
+        fixed_tokens = sum(self.token_counter.count_many(fixed_texts)) + overhead * len(fixed_texts)
+        fixed_tokens += TokenCounter.TOKENS_PER_REPLY
+        remaining = self.get_token_budget(model) - fixed_tokens
+
+        # 歷史訊息優先使用寫入時存下的token數
+        history_counts = [count + overhead for count in self.token_counter.count_history(history)]
+
+        # 由新到舊挑選，遇到放不下的訊息即停止，維持上下文連續
+        selected: List[Dict[str, str]] = []
+        history_tokens = 0
+        skipped_tokens = 0
+        for index in range(len(history) - 1, -1, -1):
+            msg = history[index]
+            tokens = history_counts[index]
+            if tokens > remaining:
+                skipped_tokens = sum(history_counts[:index + 1])
+                break
+            remaining -= tokens
+            history_tokens += tokens
+            selected.append({
+                "role": "user" if msg.message_type == "user" else "assistant",
+                "content": msg.content
+            })
+        selected.reverse()
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if summary_message:
+            messages.append(summary_message)
+        messages.extend(selected)
+        messages.append({"role": "user", "content": user_message})
+
+        context_info = {
+            "context_messages": len(selected),
+            "context_messages_dropped": len(history) - len(selected),
+            "context_summary_used": summary_message is not None,
+            "context_tokens": fixed_tokens + history_tokens,
+            "context_tokens_saved": skipped_tokens
+        }
+        return messages, context_info
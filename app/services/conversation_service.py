@@ -1,31 +1,46 @@
 """
 對話管理服務
 """
-from typing import Optional, List, Dict, Any
+import base64
+import uuid
+from typing import Optional, List, Dict, Any, Tuple, Union
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy import func, inspect, select, update, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import set_committed_value
 
-from app.models import User, Conversation, Message, PromptCategory
+from app.models import User, Conversation, Message, PromptCategory, UserConversationStats
 from app.core.exceptions import (
     ConversationServiceError,
     ConversationNotFoundError,
     UserNotFoundError,
-    DatabaseError
+    DatabaseError,
+    ValidationException
 )
+from app.services.conversation_state_cache import ConversationStateCache
+from app.services.message_log import MessageWriteBehindLog
+from app.services.token_counter import get_token_counter
 
 
 class ConversationService:
     """對話管理服務"""
     
-    def __init__(self, db_session: Session):
+    def __init__(
+        self,
+        db_session: AsyncSession,
+        state_cache: Optional[ConversationStateCache] = None,
+        message_log: Optional[MessageWriteBehindLog] = None
+    ):
         self.db_session = db_session
+        self.state_cache = state_cache
+        self.message_log = message_log
     
-    def create_user(self, line_user_id: str, display_name: str) -> User:
+    async def create_user(self, line_user_id: str, display_name: str) -> User:
         """創建新用戶"""
         try:
             # 檢查用戶是否已存在
-            existing_user = User.get_by_line_user_id(self.db_session, line_user_id)
+            existing_user = await User.get_by_line_user_id_async(self.db_session, line_user_id)
             if existing_user:
                 return existing_user
             
@@ -36,34 +51,35 @@ class ConversationService:
             )
             
             self.db_session.add(user)
-            self.db_session.commit()
+            await self.db_session.commit()
             
             return user
             
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"創建用戶失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise ConversationServiceError(f"創建用戶失敗: {e}")
     
-    def get_user_by_line_id(self, line_user_id: str) -> Optional[User]:
+    async def get_user_by_line_id(self, line_user_id: str) -> Optional[User]:
         """根據LINE用戶ID獲取用戶"""
         try:
-            return User.get_by_line_user_id(self.db_session, line_user_id)
+            return await User.get_by_line_user_id_async(self.db_session, line_user_id)
         except Exception as e:
             raise DatabaseError(f"獲取用戶失敗: {e}")
     
-    def create_conversation(
+    async def create_conversation(
         self, 
         user_id: str, 
         category_key: Optional[str] = None,
-        ai_model: str = "chatgpt"
+        ai_model: str = "chatgpt",
+        commit: bool = True
     ) -> Conversation:
-        """創建新對話"""
+        """創建新對話（commit=False時僅flush，由呼叫端統一提交）"""
         try:
             # 檢查用戶是否存在
-            user = self.db_session.query(User).filter(User.id == user_id).first()
+            user = await User.get_by_id_async(self.db_session, user_id)
             if not user:
                 raise UserNotFoundError(f"找不到用戶 ID: {user_id}")
             
@@ -77,50 +93,78 @@ class ConversationService:
             )
             
             self.db_session.add(conversation)
-            self.db_session.commit()
+            if commit:
+                await self.db_session.commit()
+            else:
+                await self.db_session.flush()
             
             return conversation
             
         except UserNotFoundError:
             raise
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"創建對話失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise ConversationServiceError(f"創建對話失敗: {e}")
     
-    def get_active_conversation(self, user_id: str) -> Optional[Conversation]:
-        """獲取用戶的活躍對話"""
+    async def get_active_conversation(self, user_id: str) -> Optional[Conversation]:
+        """獲取用戶的活躍對話（優先使用狀態快取）"""
         try:
-            return Conversation.get_active_conversation(self.db_session, user_id)
+            if self.state_cache:
+                state = await self.state_cache.get(user_id)
+                if state:
+                    return await self._attach_cached_conversation(state)
+            
+            conversation = await Conversation.get_active_conversation_async(self.db_session, user_id)
+            if conversation and self.state_cache:
+                await self.state_cache.set(conversation)
+            return conversation
         except Exception as e:
             raise DatabaseError(f"獲取活躍對話失敗: {e}")
     
-    def get_conversation_by_id(self, conversation_id: str) -> Optional[Conversation]:
+    async def _attach_cached_conversation(self, state: Dict[str, Any]) -> Conversation:
+        """將快取的對話狀態掛回會話，之後的修改照常以UPDATE寫入（不查詢資料庫）"""
+        conversation = self.state_cache.to_conversation(state)
+        return await self.db_session.merge(conversation, load=False)
+    
+    async def _sync_state_cache(self, conversation: Conversation):
+        """提交後同步狀態快取"""
+        if self.state_cache:
+            await self.state_cache.set(conversation)
+    
+    async def _invalidate_state_cache(self, conversation: Conversation):
+        """使狀態快取失效"""
+        if self.state_cache:
+            await self.state_cache.invalidate(str(conversation.user_id))
+    
+    async def get_conversation_by_id(self, conversation_id: str) -> Optional[Conversation]:
         """根據ID獲取對話"""
         try:
-            return self.db_session.query(Conversation).filter(
-                Conversation.id == conversation_id
-            ).first()
+            # 優先從會話的identity map取得，已載入的對話不會重複查詢
+            return await self.db_session.get(Conversation, conversation_id)
         except Exception as e:
             raise DatabaseError(f"獲取對話失敗: {e}")
     
-    def get_user_conversations(
+    async def get_user_conversations(
         self, 
         user_id: str, 
         limit: int = 10,
-        offset: int = 0
+        cursor: Optional[str] = None
     ) -> List[Conversation]:
-        """獲取用戶的對話列表"""
+        """獲取用戶的對話列表（由新到舊；cursor為上一頁最後一個對話以encode_history_cursor編碼的游標）"""
         try:
-            return Conversation.get_conversations_by_user(
-                self.db_session, user_id, limit
+            before = self.decode_history_cursor(cursor) if cursor else None
+            return await Conversation.get_conversations_by_user_async(
+                self.db_session, user_id, limit, before=before
             )
+        except ValidationException:
+            raise
         except Exception as e:
             raise DatabaseError(f"獲取用戶對話列表失敗: {e}")
     
-    def add_message(
+    async def add_message(
         self,
         conversation_id: str,
         message_type: str,
@@ -131,7 +175,7 @@ class ConversationService:
         """添加訊息到對話"""
         try:
             # 檢查對話是否存在
-            conversation = self.get_conversation_by_id(conversation_id)
+            conversation = await self.get_conversation_by_id(conversation_id)
             if not conversation:
                 raise ConversationNotFoundError(f"找不到對話 ID: {conversation_id}")
             
@@ -141,136 +185,327 @@ class ConversationService:
                 message_type=message_type,
                 content=content,
                 tokens_used=tokens_used,
-                processing_time_ms=processing_time_ms
+                processing_time_ms=processing_time_ms,
+                token_count=get_token_counter().count(content)
             )
             
-            self.db_session.add(message)
-            
             # 更新對話統計
             conversation.message_count += 1
             if tokens_used:
                 conversation.total_tokens += tokens_used
             conversation.last_activity_at = datetime.utcnow()
             
-            self.db_session.commit()
+            entry_ids = await self._stage_messages([message])
+            await self._commit_staged_messages([message], entry_ids)
             
             return message
             
         except ConversationNotFoundError:
             raise
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"添加訊息失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise ConversationServiceError(f"添加訊息失敗: {e}")
     
-    def get_conversation_messages(
+    async def save_turn(
+        self,
+        conversation: Conversation,
+        user_message: Optional[Message],
+        assistant_message: Optional[Message] = None
+    ) -> None:
+        """在單一交易中寫入一輪對話：用戶與助手訊息、對話計數、狀態變更，只提交一次
+
+        啟用訊息寫入緩衝時，提交前先將訊息寫入緩衝，交易只更新對話，由背景批次寫入messages；
+        緩衝無法使用時訊息改在同一個交易中寫入。
+        """
+        try:
+            messages = [message for message in (user_message, assistant_message) if message is not None]
+            for message in messages:
+                message.conversation_id = conversation.id
+            
+            # 寫入時計算訊息的token數，之後組裝上下文不再重新斷詞
+            missing = [message for message in messages if message.token_count is None]
+            for message, token_count in zip(
+                missing, get_token_counter().count_many(message.content for message in missing)
+            ):
+                message.token_count = token_count
+            
+            # 更新對話統計（在資料庫端累加，不依賴快取中的計數）
+            last_activity_at = datetime.utcnow()
+            result = await self.db_session.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation.id)
+                .values(
+                    message_count=Conversation.message_count + len(messages),
+                    total_tokens=Conversation.total_tokens + sum(
+                        message.tokens_used or 0 for message in messages
+                    ),
+                    last_activity_at=last_activity_at
+                )
+                .returning(
+                    Conversation.message_count,
+                    Conversation.total_tokens,
+                    Conversation.updated_at,
+                    Conversation.status
+                )
+                .execution_options(synchronize_session=False)
+            )
+            message_count, total_tokens, updated_at, status = result.one()
+            set_committed_value(conversation, "message_count", message_count)
+            set_committed_value(conversation, "total_tokens", total_tokens)
+            set_committed_value(conversation, "updated_at", updated_at)
+            set_committed_value(conversation, "last_activity_at", last_activity_at)
+            if not inspect(conversation).attrs.status.history.has_changes():
+                # 本輪處理期間狀態可能已被維護工作改變（例如已過期），
+                # 以資料庫的狀態為準，非活躍的對話在同步時使快取失效而不寫回
+                set_committed_value(conversation, "status", status)
+            
+            entry_ids = await self._stage_messages(messages)
+            await self._commit_staged_messages(messages, entry_ids)
+            await self._sync_state_cache(conversation)
+            
+        except SQLAlchemyError as e:
+            await self.db_session.rollback()
+            raise DatabaseError(f"寫入對話失敗: {e}")
+        except Exception as e:
+            await self.db_session.rollback()
+            raise ConversationServiceError(f"寫入對話失敗: {e}")
+    
+    def _message_log_available(self) -> bool:
+        """是否使用訊息寫入緩衝"""
+        return self.message_log is not None and self.message_log.enabled
+    
+    async def _stage_messages(self, messages: List[Message]) -> Optional[List[str]]:
+        """提交前寫入訊息：優先寫入緩衝（回傳stream的entry id），否則加入目前的交易"""
+        if self._message_log_available():
+            entry_ids = await self.message_log.append(messages)
+            if entry_ids is not None:
+                return entry_ids
+        self.db_session.add_all(messages)
+        return None
+    
+    async def _commit_staged_messages(self, messages: List[Message], entry_ids: Optional[List[str]]):
+        """提交交易，失敗時撤回已寫入緩衝的訊息，避免訊息寫入而計數未更新"""
+        try:
+            await self.db_session.commit()
+        except Exception:
+            if entry_ids:
+                await self.message_log.discard(messages, entry_ids)
+            raise
+    
+    async def _pending_messages(self, conversation_id: str) -> List[Message]:
+        """尚在寫入緩衝中的訊息（需在查詢資料庫之前讀取）"""
+        if not self._message_log_available():
+            return []
+        return await self.message_log.pending_messages(conversation_id)
+    
+    async def get_conversation_messages(
         self, 
         conversation_id: str, 
         limit: int = 50,
         offset: int = 0
     ) -> List[Message]:
-        """獲取對話的訊息列表"""
+        """獲取對話的訊息列表（依時間排序；offset需掃過前面的訊息，長對話請用get_message_history）"""
         try:
-            return Message.get_conversation_messages(
-                self.db_session, conversation_id, limit
+            return await Message.get_conversation_messages_async(
+                self.db_session, conversation_id, limit, offset=offset
             )
         except Exception as e:
             raise DatabaseError(f"獲取對話訊息失敗: {e}")
     
-    def get_recent_messages(
+    async def get_message_history(
+        self,
+        conversation_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """以keyset分頁獲取對話歷史（由新到舊）
+
+        游標為上一頁最後一則訊息的(created_at, id)，每頁只沿
+        (conversation_id, created_at DESC, id DESC) 索引讀取limit+1筆，成本與對話長度無關。
+        """
+        try:
+            before = self.decode_history_cursor(cursor) if cursor else None
+            pending = await self._pending_messages(conversation_id)
+            messages = await Message.get_messages_page_async(
+                self.db_session, conversation_id, limit + 1, before=before
+            )
+            messages = MessageWriteBehindLog.merge(messages, pending, limit=limit + 1, before=before)
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            return {
+                "messages": messages,
+                "has_more": has_more,
+                "next_cursor": self.encode_history_cursor(messages[-1]) if has_more else None
+            }
+        except ValidationException:
+            raise
+        except Exception as e:
+            raise DatabaseError(f"獲取對話歷史失敗: {e}")
+    
+    @staticmethod
+    def encode_history_cursor(item: Union[Message, Conversation]) -> str:
+        """將訊息或對話的(created_at, id)編碼為分頁游標"""
+        raw = f"{item.created_at.isoformat()}|{item.id}"
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+    
+    @staticmethod
+    def decode_history_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+        """解析分頁游標"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+            created_at, message_id = raw.split("|", 1)
+            return datetime.fromisoformat(created_at), uuid.UUID(message_id)
+        except Exception:
+            raise ValidationException(f"無效的分頁游標: {cursor}")
+    
+    async def get_recent_messages(
         self, 
         conversation_id: str, 
-        limit: int = 10
+        limit: int = 10,
+        after: Optional[Tuple[datetime, uuid.UUID]] = None
     ) -> List[Message]:
-        """獲取對話的最近訊息"""
+        """獲取對話的最近訊息（after：摘要涵蓋到的(created_at, id)，只取其後的訊息；包含尚在寫入緩衝中的訊息）"""
         try:
-            return Message.get_recent_messages(
-                self.db_session, conversation_id, limit
+            pending = await self._pending_messages(conversation_id)
+            messages = await Message.get_recent_messages_async(
+                self.db_session, conversation_id, limit, after=after
             )
+            return MessageWriteBehindLog.merge(messages, pending, limit=limit, after=after)
         except Exception as e:
             raise DatabaseError(f"獲取最近訊息失敗: {e}")
     
-    def update_conversation_state(
+    async def update_conversation_state(
         self, 
         conversation_id: str, 
-        state: str
+        state: str,
+        commit: bool = True
     ) -> bool:
-        """更新對話狀態"""
+        """更新對話狀態（commit=False時由呼叫端統一提交）"""
         try:
-            conversation = self.get_conversation_by_id(conversation_id)
+            conversation = await self.get_conversation_by_id(conversation_id)
             if not conversation:
                 return False
             
             conversation.state = state
             conversation.last_activity_at = datetime.utcnow()
-            self.db_session.commit()
+            if commit:
+                await self.db_session.commit()
+                await self._sync_state_cache(conversation)
+            else:
+                # 提交前先失效，提交後由save_turn寫回
+                await self._invalidate_state_cache(conversation)
             
             return True
             
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"更新對話狀態失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise ConversationServiceError(f"更新對話狀態失敗: {e}")
     
-    def update_conversation_status(
+    async def update_conversation_status(
         self, 
         conversation_id: str, 
         status: str
     ) -> bool:
         """更新對話狀態"""
         try:
-            conversation = self.get_conversation_by_id(conversation_id)
+            conversation = await self.get_conversation_by_id(conversation_id)
             if not conversation:
                 return False
             
             conversation.status = status
             conversation.last_activity_at = datetime.utcnow()
-            self.db_session.commit()
+            await self.db_session.commit()
+            await self._sync_state_cache(conversation)
             
             return True
             
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"更新對話狀態失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise ConversationServiceError(f"更新對話狀態失敗: {e}")
     
-    def expire_inactive_conversations(self, inactivity_minutes: int = 30) -> int:
-        """過期不活躍的對話"""
+    async def expire_inactive_conversations(
+        self,
+        inactivity_minutes: int = 30,
+        batch_size: int = 1000,
+        lock_timeout_ms: int = 2000
+    ) -> int:
+        """過期不活躍的對話（分批以單一UPDATE處理，不將對話載入記憶體）"""
         try:
             cutoff_time = datetime.utcnow() - timedelta(minutes=inactivity_minutes)
-            
-            # 查找不活躍的對話
-            inactive_conversations = self.db_session.query(Conversation).filter(
-                Conversation.status == "active",
-                Conversation.last_activity_at < cutoff_time
-            ).all()
-            
-            expired_count = 0
-            for conversation in inactive_conversations:
-                conversation.status = "expired"
-                expired_count += 1
-            
-            self.db_session.commit()
-            
-            return expired_count
+            return await self._update_status_in_batches(
+                "active", "expired", cutoff_time, batch_size, lock_timeout_ms
+            )
             
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"過期不活躍對話失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise ConversationServiceError(f"過期不活躍對話失敗: {e}")
     
-    def reset_conversation(self, conversation_id: str) -> bool:
-        """重置對話"""
+    async def _update_status_in_batches(
+        self,
+        from_status: str,
+        to_status: str,
+        cutoff_time: datetime,
+        batch_size: int,
+        lock_timeout_ms: int
+    ) -> int:
+        """分批更新對話狀態，每批一個交易，回傳更新的總筆數
+
+        每批以CTE選出最多batch_size筆並鎖定（略過其他交易已鎖定的列），
+        在同一個UPDATE ... RETURNING中完成更新；鎖等待超過lock_timeout_ms即放棄該批。
+        每批提交後使對應用戶的狀態快取失效。
+        """
+        statement = text("""
+            WITH batch AS (
+                SELECT id FROM conversations
+                WHERE status = :from_status AND last_activity_at < :cutoff_time
+                ORDER BY last_activity_at
+                LIMIT :batch_size
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE conversations AS c
+            SET status = :to_status, updated_at = now()
+            FROM batch
+            WHERE c.id = batch.id
+            RETURNING c.user_id
+        """)
+        params = {
+            "from_status": from_status,
+            "to_status": to_status,
+            "cutoff_time": cutoff_time,
+            "batch_size": batch_size
+        }
+        
+        total = 0
+        while True:
+            # SET LOCAL只在目前交易內有效
+            await self.db_session.execute(text(f"SET LOCAL lock_timeout = {int(lock_timeout_ms)}"))
+            result = await self.db_session.execute(statement, params)
+            user_ids = [str(row.user_id) for row in result]
+            await self.db_session.commit()
+            
+            if self.state_cache:
+                await self.state_cache.invalidate_many(user_ids)
+            
+            total += len(user_ids)
+            if len(user_ids) < batch_size:
+                return total
+    
+    async def reset_conversation(self, conversation_id: str, commit: bool = True) -> bool:
+        """重置對話（commit=False時由呼叫端統一提交）"""
         try:
-            conversation = self.get_conversation_by_id(conversation_id)
+            conversation = await self.get_conversation_by_id(conversation_id)
             if not conversation:
                 return False
             
@@ -281,80 +516,80 @@ class ConversationService:
             conversation.selected_category_id = None
             conversation.last_activity_at = datetime.utcnow()
             
-            self.db_session.commit()
+            await self._invalidate_state_cache(conversation)
+            if commit:
+                await self.db_session.commit()
             
             return True
             
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"重置對話失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise ConversationServiceError(f"重置對話失敗: {e}")
     
-    def get_conversation_statistics(self, user_id: str) -> Dict[str, Any]:
-        """獲取用戶的對話統計"""
+    async def get_conversation_statistics(self, user_id: str) -> Dict[str, Any]:
+        """獲取用戶的對話統計（讀取觸發器維護的彙總表，尚無彙總時在資料庫端即時彙總）"""
         try:
-            conversations = self.get_user_conversations(user_id, limit=1000)
-            
-            stats = {
-                "total_conversations": len(conversations),
-                "active_conversations": 0,
-                "expired_conversations": 0,
-                "reset_conversations": 0,
-                "total_messages": 0,
-                "total_tokens": 0,
-                "by_category": {},
-                "by_model": {}
-            }
-            
-            for conversation in conversations:
-                # 按狀態統計
-                if conversation.status == "active":
-                    stats["active_conversations"] += 1
-                elif conversation.status == "expired":
-                    stats["expired_conversations"] += 1
-                elif conversation.status == "reset":
-                    stats["reset_conversations"] += 1
-                
-                # 累計訊息和token
-                stats["total_messages"] += conversation.message_count
-                stats["total_tokens"] += conversation.total_tokens
-                
-                # 按分類統計
-                if conversation.category_key:
-                    if conversation.category_key not in stats["by_category"]:
-                        stats["by_category"][conversation.category_key] = 0
-                    stats["by_category"][conversation.category_key] += 1
-                
-                # 按模型統計
-                if conversation.ai_model not in stats["by_model"]:
-                    stats["by_model"][conversation.ai_model] = 0
-                stats["by_model"][conversation.ai_model] += 1
+            rollup = await UserConversationStats.get_by_user_id_async(self.db_session, user_id)
+            if rollup is not None:
+                return rollup.to_dict()
             
+            stats = await Conversation.aggregate_statistics_async(self.db_session, user_id)
+            stats.pop("by_status", None)
             return stats
             
         except Exception as e:
             raise DatabaseError(f"獲取對話統計失敗: {e}")
     
-    def get_conversation_summary(self, conversation_id: str) -> Dict[str, Any]:
+    async def get_token_usage_by_model(self, user_id: str) -> Dict[str, Dict[str, int]]:
+        """獲取用戶各ai_model的token用量（助理訊息的tokens_used為整次呼叫，token_count為回應本身）"""
+        try:
+            result = await self.db_session.execute(
+                select(
+                    Conversation.ai_model,
+                    func.coalesce(func.sum(Message.tokens_used), 0).label("total_tokens"),
+                    func.coalesce(func.sum(Message.token_count), 0).label("completion_tokens")
+                ).join(
+                    Conversation, Conversation.id == Message.conversation_id
+                ).where(
+                    Conversation.user_id == user_id,
+                    Message.message_type == "assistant",
+                    Message.tokens_used.isnot(None)
+                ).group_by(Conversation.ai_model)
+            )
+            usage = {}
+            for row in result:
+                completion_tokens = min(int(row.completion_tokens), int(row.total_tokens))
+                usage[row.ai_model] = {
+                    "prompt_tokens": int(row.total_tokens) - completion_tokens,
+                    "completion_tokens": completion_tokens
+                }
+            return usage
+            
+        except Exception as e:
+            raise DatabaseError(f"獲取模型用量失敗: {e}")
+    
+    async def get_conversation_summary(self, conversation_id: str) -> Dict[str, Any]:
         """獲取對話摘要"""
         try:
-            conversation = self.get_conversation_by_id(conversation_id)
+            conversation = await self.get_conversation_by_id(conversation_id)
             if not conversation:
                 return {}
             
             # 獲取用戶資訊
-            user = self.db_session.query(User).filter(
-                User.id == conversation.user_id
-            ).first()
+            user = await User.get_by_id_async(self.db_session, conversation.user_id)
             
             # 獲取分類資訊
             category = None
             if conversation.category_key:
-                category = self.db_session.query(PromptCategory).filter(
-                    PromptCategory.category_key == conversation.category_key
-                ).first()
+                result = await self.db_session.execute(
+                    select(PromptCategory).where(
+                        PromptCategory.category_key == conversation.category_key
+                    )
+                )
+                category = result.scalars().first()
             
             summary = {
                 "conversation_id": conversation.id,
@@ -382,29 +617,22 @@ class ConversationService:
         except Exception as e:
             raise DatabaseError(f"獲取對話摘要失敗: {e}")
     
-    def cleanup_old_conversations(self, days_old: int = 30) -> int:
-        """清理舊對話（僅標記為已刪除，不實際刪除）"""
+    async def cleanup_old_conversations(
+        self,
+        days_old: int = 30,
+        batch_size: int = 1000,
+        lock_timeout_ms: int = 2000
+    ) -> int:
+        """封存舊的過期對話（僅標記為archived，不實際刪除；分批以單一UPDATE處理）"""
         try:
             cutoff_time = datetime.utcnow() - timedelta(days=days_old)
-            
-            # 查找舊的過期對話
-            old_conversations = self.db_session.query(Conversation).filter(
-                Conversation.status == "expired",
-                Conversation.last_activity_at < cutoff_time
-            ).all()
-            
-            cleaned_count = 0
-            for conversation in old_conversations:
-                conversation.status = "archived"
-                cleaned_count += 1
-            
-            self.db_session.commit()
-            
-            return cleaned_count
+            return await self._update_status_in_batches(
+                "expired", "archived", cutoff_time, batch_size, lock_timeout_ms
+            )
             
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"清理舊對話失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise ConversationServiceError(f"清理舊對話失敗: {e}")
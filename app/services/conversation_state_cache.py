@@ -0,0 +1,196 @@
+"""
+對話狀態快取
+"""
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import redis.asyncio as aioredis
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.models import Conversation
+
+
+class ConversationStateCache:
+    """對話狀態快取
+
+    以Redis hash保存每個用戶目前活躍對話的所有欄位，
+    寫入成功提交後同步更新（write-through），重置、狀態變更與過期時失效；
+    TTL與會話逾時一致，不活躍的對話自然過期。Redis無法使用或欄位不完整時一律視為未命中。
+    """
+
+    KEY_PREFIX = "conv_state:"
+
+    # 快取的欄位（conversations的所有欄位，由快取還原的物件不需延遲載入任何欄位）
+    UUID_FIELDS = ("id", "user_id", "selected_category_id", "summarized_until_id")
+    STRING_FIELDS = ("status", "state", "category_key", "ai_model", "summary")
+    INTEGER_FIELDS = ("message_count", "total_tokens", "summary_message_count")
+    DATETIME_FIELDS = ("last_activity_at", "summarized_until", "created_at", "updated_at")
+    FIELDS = UUID_FIELDS + STRING_FIELDS + INTEGER_FIELDS + DATETIME_FIELDS
+
+    def __init__(
+        self,
+        redis_client: Optional[aioredis.Redis] = None,
+        ttl_seconds: int = 1800,
+        redis_retry_seconds: int = 30
+    ):
+        self.redis_client = redis_client
+        self.ttl_seconds = ttl_seconds
+        self.redis_retry_seconds = redis_retry_seconds
+
+        self._redis_disabled_until = 0.0
+
+        # 統計資訊
+        self.hit_count = 0
+        self.miss_count = 0
+        self.write_count = 0
+        self.invalidation_count = 0
+        self.error_count = 0
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """讀取用戶的對話狀態，未命中回傳None"""
+        if not self._redis_available():
+            self.miss_count += 1
+            return None
+
+        try:
+            data = await self.redis_client.hgetall(self._key(user_id))
+        except Exception as e:
+            self._disable(e)
+            self.miss_count += 1
+            return None
+
+        if not data or "id" not in data:
+            self.miss_count += 1
+            return None
+
+        try:
+            state = self._deserialize(data)
+        except (ValueError, TypeError) as e:
+            # 格式不符（例如舊版本寫入）時丟棄
+            print(f"對話狀態快取格式錯誤: {e}")
+            await self.invalidate(user_id)
+            self.miss_count += 1
+            return None
+
+        self.hit_count += 1
+        return state
+
+    async def set(self, conversation: Conversation):
+        """寫入對話狀態（僅快取活躍對話，其餘狀態直接失效）"""
+        user_id = str(conversation.user_id)
+        if conversation.status != "active":
+            await self.invalidate(user_id)
+            return
+
+        if not self._redis_available():
+            return
+
+        if inspect(conversation).unloaded.intersection(self.FIELDS):
+            # 有欄位尚未載入（例如被提交過期）時不寫入不完整的狀態
+            await self.invalidate(user_id)
+            return
+
+        try:
+            key = self._key(user_id)
+            pipeline = self.redis_client.pipeline(transaction=True)
+            pipeline.delete(key)
+            pipeline.hset(key, mapping=self._serialize(conversation))
+            pipeline.expire(key, self.ttl_seconds)
+            await pipeline.execute()
+            self.write_count += 1
+        except Exception as e:
+            self._disable(e)
+
+    async def invalidate(self, user_id: str):
+        """使用戶的對話狀態快取失效"""
+        self.invalidation_count += 1
+        if not self._redis_available():
+            return
+
+        try:
+            await self.redis_client.delete(self._key(str(user_id)))
+        except Exception as e:
+            self._disable(e)
+
+    async def invalidate_many(self, user_ids: List[str]):
+        """批次使多個用戶的對話狀態快取失效（一次DEL多個鍵）"""
+        if not user_ids:
+            return
+        self.invalidation_count += len(user_ids)
+        if not self._redis_available():
+            return
+
+        try:
+            await self.redis_client.delete(*[self._key(str(user_id)) for user_id in user_ids])
+        except Exception as e:
+            self._disable(e)
+
+    def to_conversation(self, state: Dict[str, Any]) -> Conversation:
+        """由快取狀態建立detached的對話物件（欄位皆為已提交的值，沒有待寫入的變更）"""
+        conversation = Conversation()
+        for field in self.FIELDS:
+            set_committed_value(conversation, field, state[field])
+        make_transient_to_detached(conversation)
+        return conversation
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.KEY_PREFIX}{user_id}"
+
+    def _serialize(self, conversation: Conversation) -> Dict[str, str]:
+        """轉換為Redis hash欄位（None以空字串保存）"""
+        data = {}
+        for field in self.UUID_FIELDS + self.STRING_FIELDS + self.INTEGER_FIELDS:
+            value = getattr(conversation, field)
+            data[field] = "" if value is None else str(value)
+        for field in self.DATETIME_FIELDS:
+            value = getattr(conversation, field)
+            data[field] = value.isoformat() if isinstance(value, datetime) else ""
+        return data
+
+    def _deserialize(self, data: Dict[str, str]) -> Dict[str, Any]:
+        """由Redis hash欄位還原（缺少欄位時視為格式不符）"""
+        missing = [field for field in self.FIELDS if field not in data]
+        if missing:
+            raise ValueError(f"缺少欄位 {', '.join(missing)}")
+        state: Dict[str, Any] = {}
+        for field in self.UUID_FIELDS:
+            value = data.get(field)
+            state[field] = uuid.UUID(value) if value else None
+        for field in self.STRING_FIELDS:
+            state[field] = data.get(field) or None
+        for field in self.INTEGER_FIELDS:
+            state[field] = int(data.get(field) or 0)
+        for field in self.DATETIME_FIELDS:
+            value = data.get(field)
+            state[field] = datetime.fromisoformat(value) if value else None
+        return state
+
+    def _redis_available(self) -> bool:
+        """Redis是否可用（失敗後暫停一段時間再重試）"""
+        return self.redis_client is not None and time.monotonic() >= self._redis_disabled_until
+
+    def _disable(self, error: Exception):
+        """Redis操作失敗時暫停使用快取"""
+        self.error_count += 1
+        self._redis_disabled_until = time.monotonic() + self.redis_retry_seconds
+        print(f"對話狀態快取失敗，暫時改用資料庫: {error}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取快取統計"""
+        lookups = self.hit_count + self.miss_count
+        return {
+            "backend": "redis" if self._redis_available() else "disabled",
+            "hits": self.hit_count,
+            "misses": self.miss_count,
+            "hit_rate": self.hit_count / lookups if lookups else 0,
+            "writes": self.write_count,
+            "invalidations": self.invalidation_count,
+            "errors": self.error_count,
+            "ttl_seconds": self.ttl_seconds,
+            "timestamp": datetime.utcnow().isoformat()
+        }
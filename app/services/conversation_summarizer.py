@@ -0,0 +1,154 @@
+"""
+對話滾動摘要
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from sqlalchemy import update
+
+from app.core.config import Settings
+from app.core.database import AsyncSessionLocal
+from app.models import Conversation, Message
+from app.services.ai_service import AIService
+from app.services.conversation_state_cache import ConversationStateCache
+from app.services.message_log import MessageWriteBehindLog
+
+
+class ConversationSummarizer:
+    """對話滾動摘要器
+
+    未摘要的訊息超過門檻時，在背景將較舊的訊息與既有摘要合併成新摘要，
+    只保留最近幾則原始訊息；每次只處理新增的部分，不會從頭重新摘要。
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        ai_service: AIService,
+        state_cache: Optional[ConversationStateCache] = None,
+        message_log: Optional[MessageWriteBehindLog] = None
+    ):
+        self.settings = settings
+        self.ai_service = ai_service
+        self.state_cache = state_cache
+        self.message_log = message_log
+        self.trigger_messages = settings.summary_trigger_messages
+        self.keep_recent_messages = settings.summary_keep_recent_messages
+
+        # 每個對話同時只執行一個摘要任務
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        # 統計資訊
+        self.run_count = 0
+        self.folded_message_count = 0
+        self.skipped_count = 0
+        self.error_count = 0
+
+    def should_summarize(self, conversation: Conversation) -> bool:
+        """是否需要摺疊較舊的訊息"""
+        if not self.settings.summary_enabled or conversation.state != "conversation":
+            return False
+        unsummarized = conversation.message_count - (conversation.summary_message_count or 0)
+        return unsummarized > self.trigger_messages + self.keep_recent_messages
+
+    def schedule(self, conversation: Conversation) -> Optional[asyncio.Task]:
+        """需要時在背景更新摘要（於本輪提交之後呼叫）"""
+        if not self.should_summarize(conversation):
+            return None
+
+        conversation_id = str(conversation.id)
+        running = self._tasks.get(conversation_id)
+        if running is not None and not running.done():
+            return running
+
+        task = asyncio.create_task(self._run(conversation_id))
+        self._tasks[conversation_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(conversation_id, None))
+        return task
+
+    async def _run(self, conversation_id: str):
+        try:
+            await self.summarize(conversation_id)
+        except Exception as e:
+            self.error_count += 1
+            print(f"更新對話摘要失敗: {e}")
+
+    async def summarize(self, conversation_id: str) -> bool:
+        """將摘要之後、最近訊息之前的部分併入摘要，回傳是否有更新"""
+        async with AsyncSessionLocal() as db_session:
+            conversation = await db_session.get(Conversation, conversation_id)
+            if not conversation:
+                return False
+
+            buffered = await self.message_log.pending_messages(conversation_id) if self.message_log else []
+            pending = await Message.get_messages_after_async(
+                db_session, conversation_id, after=conversation.summary_position
+            )
+            pending = MessageWriteBehindLog.merge(
+                pending, buffered, after=conversation.summary_position, newest_first=False
+            )
+            to_fold = pending[:-self.keep_recent_messages] if self.keep_recent_messages else pending
+            if len(to_fold) < self.trigger_messages:
+                self.skipped_count += 1
+                return False
+
+            previous_summarized_until = conversation.summarized_until
+            previous_summarized_until_id = conversation.summarized_until_id
+            previous_summary = conversation.summary
+            user_id = str(conversation.user_id)
+
+            # 等待AI時不佔用連線
+            await db_session.commit()
+
+            summary, _ = await self.ai_service.generate_summary_response(
+                conversation_history=to_fold,
+                previous_summary=previous_summary
+            )
+
+            # 只有摘要未被其他任務更新時才寫入
+            result = await db_session.execute(
+                update(Conversation)
+                .where(
+                    Conversation.id == conversation_id,
+                    Conversation.summarized_until.is_not_distinct_from(previous_summarized_until),
+                    Conversation.summarized_until_id.is_not_distinct_from(previous_summarized_until_id)
+                )
+                .values(
+                    summary=summary,
+                    # 記錄完整的(created_at, id)，同一時間的其他訊息不會被略過或重複摘要
+                    summarized_until=to_fold[-1].created_at,
+                    summarized_until_id=to_fold[-1].id,
+                    summary_message_count=Conversation.summary_message_count + len(to_fold)
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db_session.commit()
+
+        if result.rowcount == 0:
+            self.skipped_count += 1
+            return False
+
+        self.run_count += 1
+        self.folded_message_count += len(to_fold)
+        if self.state_cache:
+            await self.state_cache.invalidate(user_id)
+        return True
+
+    async def close(self):
+        """等待進行中的摘要任務結束（應用程式關閉時呼叫）"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=10)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取摘要統計"""
+        return {
+            "enabled": self.settings.summary_enabled,
+            "runs": self.run_count,
+            "folded_messages": self.folded_message_count,
+            "skipped": self.skipped_count,
+            "errors": self.error_count,
+            "in_progress": len(self._tasks),
+            "timestamp": datetime.utcnow().isoformat()
+        }
@@ -0,0 +1,175 @@
+"""
+Webhook事件去重
+"""
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import redis.asyncio as aioredis
+
+
+# 只刪除自己標記的處理中鍵（處理逾時後可能已由其他worker重新接手）
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class EventDeduplicator:
+    """Webhook事件去重器
+
+    以 webhookEventId 作為冪等鍵，分兩階段標記：
+    接手時以SET NX寫入短TTL的「處理中」標記，處理完成後改為保留ttl_seconds的「已完成」標記；
+    處理失敗則刪除標記，讓LINE重送的事件可以再處理一次。
+    處理中途行程終止時，處理中標記在processing_ttl_seconds後自動過期。
+    優先使用Redis記錄（跨worker、跨容器共享），Redis無法使用時退回行程內的LRU快取。
+    """
+
+    KEY_PREFIX = "line:webhook_event:"
+    DONE = "done"
+
+    def __init__(
+        self,
+        redis_client: Optional[aioredis.Redis] = None,
+        ttl_seconds: int = 86400,
+        processing_ttl_seconds: int = 300,
+        local_max_size: int = 10000,
+        redis_retry_seconds: int = 30
+    ):
+        self.redis_client = redis_client
+        self.ttl_seconds = ttl_seconds
+        self.processing_ttl_seconds = processing_ttl_seconds
+        self.local_max_size = local_max_size
+        self.redis_retry_seconds = redis_retry_seconds
+
+        # 本行程的處理中標記值，釋放時只刪除自己的標記
+        self.processing_value = f"processing:{uuid.uuid4().hex}"
+        self._release_script = (
+            redis_client.register_script(_RELEASE_SCRIPT) if redis_client is not None else None
+        )
+        # 行程內LRU：事件ID -> 標記到期時間
+        self._local_seen: "OrderedDict[str, float]" = OrderedDict()
+        self._redis_disabled_until = 0.0
+
+        # 統計資訊
+        self.checked_count = 0
+        self.duplicate_count = 0
+        self.redelivery_count = 0
+        self.completed_count = 0
+        self.released_count = 0
+        self.redis_error_count = 0
+
+    async def filter_events(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """過濾掉已處理或處理中的事件，其餘事件標記為處理中"""
+        return [event for event in events if not await self.is_duplicate(event)]
+
+    async def is_duplicate(self, event: Dict[str, Any]) -> bool:
+        """檢查事件是否已處理或處理中，否則標記為處理中"""
+        event_id = event.get("webhookEventId")
+        if not event_id:
+            return False
+
+        self.checked_count += 1
+        if event.get("deliveryContext", {}).get("isRedelivery"):
+            self.redelivery_count += 1
+
+        if await self._claim(event_id):
+            return False
+        self.duplicate_count += 1
+        return True
+
+    async def complete(self, event: Dict[str, Any]):
+        """事件處理完成，處理中標記改為已完成"""
+        event_id = event.get("webhookEventId")
+        if not event_id:
+            return
+
+        self.completed_count += 1
+        now = time.monotonic()
+        self._set_local(event_id, now + self.ttl_seconds)
+        if self._redis_available(now):
+            try:
+                await self.redis_client.set(self._key(event_id), self.DONE, ex=self.ttl_seconds)
+            except Exception as e:
+                self._disable_redis(e)
+
+    async def release(self, event: Dict[str, Any]):
+        """事件處理失敗，移除處理中標記讓重送的事件可以再處理"""
+        event_id = event.get("webhookEventId")
+        if not event_id:
+            return
+
+        self.released_count += 1
+        self._local_seen.pop(event_id, None)
+        if self._redis_available(time.monotonic()):
+            try:
+                await self._release_script(keys=[self._key(event_id)], args=[self.processing_value])
+            except Exception as e:
+                self._disable_redis(e)
+
+    async def _claim(self, event_id: str) -> bool:
+        """標記事件為處理中，回傳是否由本次接手（先前未處理過且沒有其他人處理中）"""
+        now = time.monotonic()
+
+        # 行程內LRU
+        expires_at = self._local_seen.get(event_id)
+        if expires_at is not None and now < expires_at:
+            self._local_seen.move_to_end(event_id)
+            return False
+
+        self._set_local(event_id, now + self.processing_ttl_seconds)
+
+        # Redis跨worker、跨容器共享
+        if self._redis_available(now):
+            try:
+                claimed = await self.redis_client.set(
+                    self._key(event_id), self.processing_value, nx=True, ex=self.processing_ttl_seconds
+                )
+            except Exception as e:
+                self._disable_redis(e)
+            else:
+                if not claimed:
+                    # 由其他worker處理中或已完成，不在本地保留標記（對方失敗釋放後重送仍可接手）
+                    self._local_seen.pop(event_id, None)
+                return bool(claimed)
+
+        return True
+
+    def _set_local(self, event_id: str, expires_at: float):
+        """更新行程內標記並維持LRU大小"""
+        self._local_seen[event_id] = expires_at
+        self._local_seen.move_to_end(event_id)
+        while len(self._local_seen) > self.local_max_size:
+            self._local_seen.popitem(last=False)
+
+    def _key(self, event_id: str) -> str:
+        return f"{self.KEY_PREFIX}{event_id}"
+
+    def _disable_redis(self, error: Exception):
+        """Redis失敗後暫停一段時間再重試"""
+        self.redis_error_count += 1
+        self._redis_disabled_until = time.monotonic() + self.redis_retry_seconds
+        print(f"Redis事件去重失敗，改用行程內快取: {error}")
+
+    def _redis_available(self, now: float) -> bool:
+        """Redis是否可用（失敗後暫停一段時間再重試）"""
+        return self.redis_client is not None and now >= self._redis_disabled_until
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取去重統計"""
+        return {
+            "backend": "redis" if self._redis_available(time.monotonic()) else "local",
+            "checked": self.checked_count,
+            "duplicates": self.duplicate_count,
+            "redeliveries": self.redelivery_count,
+            "completed": self.completed_count,
+            "released": self.released_count,
+            "hit_rate": self.duplicate_count / self.checked_count if self.checked_count else 0,
+            "redis_errors": self.redis_error_count,
+            "local_size": len(self._local_seen),
+            "timestamp": datetime.utcnow().isoformat()
+        }
@@ -0,0 +1,121 @@
+"""
+Webhook事件派發器
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+
+class EventDispatcher:
+    """Webhook事件派發器
+
+    同一用戶的事件依序處理（包含跨批次），不同用戶的事件並行處理，
+    並以信號量限制同時處理中的事件數量。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        max_concurrency: int = 16
+    ):
+        self.handler = handler
+        self.max_concurrency = max(max_concurrency, 1)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # 每個用戶最後一條處理鏈，新批次需等待前一條完成以維持順序
+        self._tails: Dict[str, asyncio.Task] = {}
+
+        # 統計資訊
+        self.dispatched_batches = 0
+        self.dispatched_events = 0
+        self.failed_events = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.last_batch_ms = 0
+
+    @staticmethod
+    def get_ordering_key(event: Dict[str, Any], index: int) -> str:
+        """獲取事件的排序鍵（以來源用戶為單位）"""
+        source = event.get("source", {})
+        key = source.get("userId") or source.get("groupId") or source.get("roomId")
+        # 沒有來源的事件彼此獨立處理
+        return key or f"__anonymous_{index}"
+
+    async def dispatch(self, events: List[Dict[str, Any]]) -> List[Any]:
+        """派發一批事件，回傳與輸入順序相同的處理結果"""
+        start_time = time.monotonic()
+
+        # 依用戶分組，保持組內原始順序
+        groups: "OrderedDict[str, List[tuple]]" = OrderedDict()
+        for index, event in enumerate(events):
+            key = self.get_ordering_key(event, index)
+            groups.setdefault(key, []).append((index, event))
+
+        # 同步登記每條處理鏈，確保呼叫順序即為處理順序
+        chains = []
+        for key, indexed_events in groups.items():
+            previous = self._tails.get(key)
+            chain = asyncio.create_task(self._run_chain(key, indexed_events, previous))
+            self._tails[key] = chain
+            chains.append(chain)
+
+        self.dispatched_batches += 1
+        self.dispatched_events += len(events)
+
+        results: List[Any] = [None] * len(events)
+        for chain_results in await asyncio.gather(*chains):
+            for index, result in chain_results:
+                results[index] = result
+
+        self.last_batch_ms = int((time.monotonic() - start_time) * 1000)
+        return results
+
+    async def _run_chain(
+        self,
+        key: str,
+        indexed_events: List[tuple],
+        previous: Optional[asyncio.Task]
+    ) -> List[tuple]:
+        """依序處理同一用戶的事件"""
+        try:
+            if previous is not None and not previous.done():
+                # 使用wait避免本任務被取消時連帶取消前一條處理鏈
+                await asyncio.wait({previous})
+
+            results = []
+            for index, event in indexed_events:
+                results.append((index, await self._handle(event)))
+            return results
+        finally:
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    async def _handle(self, event: Dict[str, Any]) -> Any:
+        """在並行上限內處理單一事件"""
+        async with self._semaphore:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                return await self.handler(event)
+            except Exception as e:
+                self.failed_events += 1
+                print(f"派發事件失敗: {e}")
+                return {"status": "error", "message": str(e)}
+            finally:
+                self.in_flight -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取派發統計"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "dispatched_batches": self.dispatched_batches,
+            "dispatched_events": self.dispatched_events,
+            "failed_events": self.failed_events,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "active_users": len(self._tails),
+            "last_batch_ms": self.last_batch_ms,
+            "timestamp": datetime.utcnow().isoformat()
+        }
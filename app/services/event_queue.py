@@ -0,0 +1,130 @@
+"""
+Webhook事件背景佇列
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+
+class WebhookEventQueue:
+    """Webhook事件背景佇列
+
+    webhook端點驗證簽名後只負責把請求放進有界佇列並立即回應，
+    實際的事件處理由背景工作者協程逐一取出執行。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        max_size: int = 1000,
+        worker_count: int = 8,
+        enqueue_timeout_ms: int = 50
+    ):
+        self.handler = handler
+        self.max_size = max_size
+        self.worker_count = max(worker_count, 1)
+        self.enqueue_timeout_ms = enqueue_timeout_ms
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+        # 統計資訊
+        self.enqueued_count = 0
+        self.processed_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+        self.backpressure_count = 0
+        self.total_wait_ms = 0
+
+    @property
+    def is_running(self) -> bool:
+        """佇列是否已啟動"""
+        return bool(self._workers)
+
+    @property
+    def depth(self) -> int:
+        """目前佇列深度"""
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """啟動背景工作者"""
+        if self.is_running:
+            return
+
+        # 佇列需在執行中的事件迴圈內建立
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._workers = [
+            asyncio.create_task(self._worker(index), name=f"webhook-worker-{index}")
+            for index in range(self.worker_count)
+        ]
+        print(f"Webhook事件佇列已啟動: {self.worker_count} 個工作者, 容量 {self.max_size}")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """停止背景工作者，並盡量處理完剩餘事件"""
+        if not self.is_running:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Webhook事件佇列停止時仍有 {self.depth} 個事件未處理")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def enqueue(self, request_data: Dict[str, Any]) -> bool:
+        """將webhook請求放入佇列，佇列已滿時短暫等待，逾時則丟棄"""
+        if not self.is_running:
+            raise RuntimeError("Webhook事件佇列尚未啟動")
+
+        item = (time.monotonic(), request_data)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # 佇列已滿，施加背壓
+            self.backpressure_count += 1
+            try:
+                await asyncio.wait_for(
+                    self._queue.put(item),
+                    timeout=self.enqueue_timeout_ms / 1000
+                )
+            except asyncio.TimeoutError:
+                self.dropped_count += 1
+                return False
+
+        self.enqueued_count += 1
+        return True
+
+    async def _worker(self, index: int):
+        """背景工作者：持續從佇列取出事件並處理"""
+        while True:
+            enqueued_at, request_data = await self._queue.get()
+            try:
+                self.total_wait_ms += int((time.monotonic() - enqueued_at) * 1000)
+                await self.handler(request_data)
+                self.processed_count += 1
+            except Exception as e:
+                self.failed_count += 1
+                print(f"Webhook工作者 {index} 處理事件失敗: {e}")
+            finally:
+                self._queue.task_done()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取佇列統計"""
+        handled = self.processed_count + self.failed_count
+        return {
+            "running": self.is_running,
+            "depth": self.depth,
+            "max_size": self.max_size,
+            "worker_count": self.worker_count,
+            "enqueued": self.enqueued_count,
+            "processed": self.processed_count,
+            "failed": self.failed_count,
+            "dropped": self.dropped_count,
+            "backpressure": self.backpressure_count,
+            "average_wait_ms": self.total_wait_ms / handled if handled else 0,
+            "timestamp": datetime.utcnow().isoformat()
+        }
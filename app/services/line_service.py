@@ -1,46 +1,65 @@
 """
 LINE服務整合器
 """
+import asyncio
 from typing import Dict, Any, Optional
-from sqlalchemy.orm import Session
 from datetime import datetime
 
-from app.adapters.line_adapter import LineAdapter
-from app.services.ai_manager import AIManager
-from app.services.conversation_service import ConversationService
-from app.core.exceptions import AIServiceException, DatabaseError
+from app.adapters.line_adapter import LineAdapter, LineStreamSender
+from app.core.config import Settings
+from app.services.ai_service import AIService
+from app.services.event_dispatcher import EventDispatcher
+from app.services.event_deduplicator import EventDeduplicator
+from app.services.conversation_state_cache import ConversationStateCache
+from app.services.conversation_summarizer import ConversationSummarizer
+from app.services.maintenance_scheduler import MaintenanceScheduler
+from app.services.message_log import MessageWriteBehindLog
+from app.services.semantic_cache import get_first_turn_cache
+from app.services.unit_of_work import UnitOfWork
+from app.core.database import async_redis_client, get_pool_status
+from app.core.exceptions import AIServiceException, DatabaseError, ValidationException
 
 
 class LineService:
     """LINE服務整合器"""
     
-    def __init__(self, db_session: Session, line_config: Dict[str, Any], ai_manager: AIManager):
-        self.db_session = db_session
+    def __init__(self, line_config: Dict[str, Any], settings: Settings):
+        self.settings = settings
         self.line_adapter = LineAdapter(line_config)
-        self.ai_manager = ai_manager
-        self.conversation_service = ConversationService(db_session)
+        self.ai_service = AIService(settings)
+        self.dispatcher = EventDispatcher(
+            handler=self._handle_new_event,
+            max_concurrency=settings.webhook_dispatch_concurrency
+        )
+        self.deduplicator = EventDeduplicator(
+            redis_client=async_redis_client,
+            ttl_seconds=settings.webhook_dedupe_ttl_seconds,
+            processing_ttl_seconds=settings.webhook_dedupe_processing_ttl_seconds
+        )
+        self.state_cache = ConversationStateCache(
+            redis_client=async_redis_client if settings.conversation_state_cache_enabled else None,
+            ttl_seconds=settings.session_timeout_minutes * 60
+        )
+        self.message_log = MessageWriteBehindLog(
+            redis_client=async_redis_client if settings.message_write_behind_enabled else None,
+            batch_size=settings.message_write_behind_batch_size,
+            flush_interval_ms=settings.message_write_behind_flush_interval_ms,
+            claim_idle_seconds=settings.message_write_behind_claim_idle_seconds
+        )
+        self.summarizer = ConversationSummarizer(
+            settings, self.ai_service, self.state_cache, self.message_log
+        )
+        self.maintenance = MaintenanceScheduler(settings, self.state_cache, async_redis_client)
     
     async def handle_webhook(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
         """處理LINE webhook請求"""
         try:
             events = request_data.get("events", [])
-            responses = []
             
-            for event in events:
-                event_type = event.get("type")
-                user_id = event.get("source", {}).get("userId")
-                
-                if event_type == "follow" and user_id:
-                    # 處理加好友事件 - 發送歡迎訊息
-                    response = await self._process_follow_event(user_id, event)
-                    responses.append(response)
-                elif event_type == "message" and event.get("message", {}).get("type") == "text":
-                    # 處理文字訊息
-                    message_text = event.get("message", {}).get("text", "")
-                    
-                    if user_id and message_text:
-                        response = await self._process_message(user_id, message_text, event)
-                        responses.append(response)
+            # 同用戶依序、跨用戶並行處理（派發時同步排入用戶的處理鏈，去重在處理鏈內進行，
+            # 不會因等待Redis讓較晚的批次先排入）
+            results = await self.dispatcher.dispatch(events)
+            responses = [result for result in results if result is not None]
             
             return self.line_adapter.create_success_response(f"處理了 {len(responses)} 個事件")
             
@@ -48,17 +67,54 @@ class LineService:
             print(f"處理LINE webhook失敗: {e}")
             return self.line_adapter.create_error_response(str(e))
     
+    async def _handle_new_event(self, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """去重後處理事件：LINE逾時重送的事件在任何資料庫或AI處理前就丟棄"""
+        if await self.deduplicator.is_duplicate(event):
+            return None
+        
+        try:
+            result = await self.handle_event(event)
+        except Exception:
+            await self.deduplicator.release(event)
+            raise
+        
+        # 處理完成的事件標記為已完成；失敗的事件釋放標記，LINE重送時可以再處理
+        if isinstance(result, dict) and result.get("status") == "error":
+            await self.deduplicator.release(event)
+        else:
+            await self.deduplicator.complete(event)
+        return result
+    
+    async def handle_event(self, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """處理單一LINE事件，不需處理的事件回傳None"""
+        event_type = event.get("type")
+        user_id = event.get("source", {}).get("userId")
+        
+        if event_type == "follow" and user_id:
+            # 處理加好友事件 - 發送歡迎訊息
+            return await self._process_follow_event(user_id, event)
+        elif event_type == "message" and event.get("message", {}).get("type") == "text":
+            # 處理文字訊息
+            message_text = event.get("message", {}).get("text", "")
+            
+            if user_id and message_text:
+                return await self._process_message(user_id, message_text, event)
+        
+        return None
+    
     async def _process_follow_event(self, user_id: str, event_data: Dict[str, Any]) -> Dict[str, Any]:
         """處理加好友事件"""
+        reply_options = self._get_reply_options(event_data)
         try:
             # 獲取或創建用戶
-            user = await self._get_or_create_user(user_id, event_data)
+            async with self.unit_of_work() as uow:
+                user = await self._get_or_create_user(uow, user_id, event_data)
             if not user:
-                await self.line_adapter.send_error_message(user_id, "無法創建用戶，請稍後再試。")
+                await self.line_adapter.send_error_message(user_id, "無法創建用戶，請稍後再試。", **reply_options)
                 return {"status": "error", "message": "無法創建用戶"}
             
             # 發送歡迎訊息
-            success = await self.line_adapter.send_category_menu(user_id)
+            success = await self.line_adapter.send_category_menu(user_id, **reply_options)
             
             if success:
                 return {
@@ -77,26 +133,38 @@ class LineService:
                 
         except Exception as e:
             print(f"處理加好友事件失敗: {e}")
-            await self.line_adapter.send_error_message(user_id, "歡迎訊息發送失敗，請稍後再試。")
+            await self.line_adapter.send_error_message(user_id, "歡迎訊息發送失敗，請稍後再試。", **reply_options)
             return {"status": "error", "message": str(e)}
     
     async def _process_message(self, user_id: str, message_text: str, event_data: Dict[str, Any]) -> Dict[str, Any]:
         """處理用戶訊息"""
+        reply_options = self._get_reply_options(event_data)
+        stream_sender = None
         try:
-            # 獲取或創建用戶
-            user = await self._get_or_create_user(user_id, event_data)
-            if not user:
-                await self.line_adapter.send_error_message(user_id, "無法創建用戶，請稍後再試。")
-                return {"status": "error", "message": "無法創建用戶"}
-            
-            # 處理訊息
-            ai_response, conversation_id, usage_info = self.ai_manager.process_user_message(
-                user_id=str(user.id),
-                user_message=message_text
-            )
+            async with self.unit_of_work() as uow:
+                # 獲取或創建用戶
+                user = await self._get_or_create_user(uow, user_id, event_data)
+                if not user:
+                    await self.line_adapter.send_error_message(user_id, "無法創建用戶，請稍後再試。", **reply_options)
+                    return {"status": "error", "message": "無法創建用戶"}
+                
+                # 處理訊息（對話階段的回應以串流逐段送出）
+                stream_sender = self.line_adapter.create_stream_sender(
+                    user_id,
+                    push_interval_seconds=self.settings.stream_push_interval_seconds,
+                    **reply_options
+                )
+                ai_response, conversation_id, usage_info = await uow.ai_manager.process_user_message(
+                    user_id=str(user.id),
+                    user_message=message_text,
+                    on_chunk=stream_sender.send
+                )
             
             # 發送AI回應
-            success = await self.line_adapter.send_message(user_id, ai_response)
+            if usage_info.get("streamed"):
+                success = await stream_sender.close()
+            else:
+                success = await self.line_adapter.send_message(user_id, ai_response, **reply_options)
             
             if success:
                 return {
@@ -116,22 +184,77 @@ class LineService:
                 
         except AIServiceException as e:
             print(f"AI服務錯誤: {e}")
-            await self.line_adapter.send_error_message(user_id, "AI服務暫時無法使用，請稍後再試。")
+            await self._send_error(user_id, self.ai_service.format_error_response(e), reply_options, stream_sender)
             return {"status": "error", "message": str(e)}
         except DatabaseError as e:
             print(f"資料庫錯誤: {e}")
-            await self.line_adapter.send_error_message(user_id, "系統暫時無法使用，請稍後再試。")
+            await self._send_error(user_id, "系統暫時無法使用，請稍後再試。", reply_options, stream_sender)
             return {"status": "error", "message": str(e)}
         except Exception as e:
             print(f"處理訊息失敗: {e}")
-            await self.line_adapter.send_error_message(user_id)
+            await self._send_error(user_id, "抱歉，發生了錯誤，請稍後再試。", reply_options, stream_sender)
             return {"status": "error", "message": str(e)}
     
-    async def _get_or_create_user(self, line_user_id: str, event_data: Dict[str, Any]) -> Optional[Any]:
+    async def _send_error(
+        self,
+        user_id: str,
+        error_message: str,
+        reply_options: Dict[str, Any],
+        stream_sender: Optional[LineStreamSender] = None
+    ) -> bool:
+        """發送錯誤訊息；串流已送出部分回應時改由發送器push，並標示回應中斷"""
+        if stream_sender is not None and stream_sender.has_sent:
+            return await stream_sender.fail(error_message)
+        return await self.line_adapter.send_error_message(user_id, error_message, **reply_options)
+    
+    async def prewarm_response_cache(self) -> int:
+        """預先生成各分類的開場白並寫入回應快取，回傳成功的分類數"""
+        try:
+            async with self.unit_of_work() as uow:
+                categories = await uow.prompt_service.get_all_categories_from_db()
+            
+            results = await asyncio.gather(
+                *[
+                    self.ai_service.generate_initial_response(
+                        category_name=category.name,
+                        category_description=category.description
+                    )
+                    for category in categories
+                ],
+                return_exceptions=True
+            )
+            
+            warmed = 0
+            for category, result in zip(categories, results):
+                if isinstance(result, Exception):
+                    print(f"預熱分類開場白失敗（{category.category_key}）: {result}")
+                else:
+                    warmed += 1
+            return warmed
+            
+        except Exception as e:
+            print(f"預熱回應快取失敗: {e}")
+            return 0
+    
+    def unit_of_work(self) -> UnitOfWork:
+        """建立工作單元（每個事件使用獨立的資料庫會話）"""
+        return UnitOfWork(
+            self.settings, self.ai_service, self.state_cache, self.summarizer, self.message_log
+        )
+    
+    @staticmethod
+    def _get_reply_options(event_data: Dict[str, Any]) -> Dict[str, Any]:
+        """從事件中取出reply token與事件時間，供優先使用reply API回覆"""
+        return {
+            "reply_token": event_data.get("replyToken"),
+            "event_timestamp": event_data.get("timestamp")
+        }
+    
+    async def _get_or_create_user(self, uow: UnitOfWork, line_user_id: str, event_data: Dict[str, Any]) -> Optional[Any]:
         """獲取或創建用戶"""
         try:
             # 檢查用戶是否已存在
-            user = self.conversation_service.get_user_by_line_id(line_user_id)
+            user = await uow.conversation_service.get_user_by_line_id(line_user_id)
             if user:
                 return user
             
@@ -143,7 +266,7 @@ class LineService:
                 display_name = "LINE用戶"
             
             # 創建新用戶
-            user = self.conversation_service.create_user(line_user_id, display_name)
+            user = await uow.conversation_service.create_user(line_user_id, display_name)
             return user
             
         except Exception as e:
@@ -194,11 +317,28 @@ class LineService:
         """健康檢查"""
         try:
             line_health = await self.line_adapter.health_check()
-            ai_health = self.ai_manager.check_ai_service_health()
+            ai_health = await self.ai_service.check_api_health()
+            ai_health["streaming"] = self.ai_service.get_streaming_stats()
+            if self.ai_service.response_cache:
+                ai_health["response_cache"] = self.ai_service.response_cache.get_stats()
+            ai_health["first_turn_cache"] = get_first_turn_cache(self.settings).get_stats()
+            ai_health["circuit_breaker"] = self.ai_service.circuit_breaker.get_stats()
+            ai_health["concurrency_limiter"] = self.ai_service.concurrency_limiter.get_stats()
+            if self.ai_service.rate_limiter:
+                ai_health["rate_limiter"] = self.ai_service.rate_limiter.get_stats()
+            ai_health["models"] = self.ai_service.get_usage_statistics()
+            ai_health["hedging"] = self.ai_service.hedger.get_stats()
             
             return {
                 "line_adapter": line_health,
                 "ai_service": ai_health,
+                "dispatcher": self.dispatcher.get_stats(),
+                "deduplicator": self.deduplicator.get_stats(),
+                "conversation_state_cache": self.state_cache.get_stats(),
+                "summarizer": self.summarizer.get_stats(),
+                "maintenance": self.maintenance.get_stats(),
+                "message_log": self.message_log.get_stats(),
+                "database_pool": get_pool_status(),
                 "overall_status": "healthy" if line_health["status"] == "healthy" else "unhealthy",
                 "timestamp": datetime.utcnow().isoformat()
             }
@@ -212,17 +352,54 @@ class LineService:
     async def get_user_statistics(self, line_user_id: str) -> Dict[str, Any]:
         """獲取用戶統計"""
         try:
-            user = self.conversation_service.get_user_by_line_id(line_user_id)
-            if not user:
-                return {"error": "用戶不存在"}
-            
-            stats = self.ai_manager.get_usage_statistics(str(user.id))
-            return stats
+            async with self.unit_of_work() as uow:
+                user = await uow.conversation_service.get_user_by_line_id(line_user_id)
+                if not user:
+                    return {"error": "用戶不存在"}
+                
+                stats = await uow.ai_manager.get_usage_statistics(str(user.id))
+                return stats
             
         except Exception as e:
             print(f"獲取用戶統計失敗: {e}")
             return {"error": str(e)}
     
+    async def get_conversation_history(
+        self,
+        line_user_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        conversation_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """獲取用戶的對話歷史（keyset分頁，由新到舊；未指定對話時使用進行中的對話）"""
+        try:
+            async with self.unit_of_work() as uow:
+                service = uow.conversation_service
+                user = await service.get_user_by_line_id(line_user_id)
+                if not user:
+                    return {"error": "用戶不存在"}
+                
+                if conversation_id:
+                    conversation = await service.get_conversation_by_id(conversation_id)
+                else:
+                    conversation = await service.get_active_conversation(str(user.id))
+                if not conversation or conversation.user_id != user.id:
+                    return {"error": "對話不存在"}
+                
+                page = await service.get_message_history(str(conversation.id), limit=limit, cursor=cursor)
+                return {
+                    "conversation_id": str(conversation.id),
+                    "messages": [message.to_dict() for message in page["messages"]],
+                    "has_more": page["has_more"],
+                    "next_cursor": page["next_cursor"]
+                }
+            
+        except ValidationException:
+            raise
+        except Exception as e:
+            print(f"獲取對話歷史失敗: {e}")
+            return {"error": str(e)}
+    
     async def send_user_statistics(self, line_user_id: str) -> bool:
         """發送用戶統計給用戶"""
         try:
@@ -253,19 +430,20 @@ class LineService:
     async def send_conversation_summary(self, line_user_id: str) -> bool:
         """發送對話總結"""
         try:
-            user = self.conversation_service.get_user_by_line_id(line_user_id)
-            if not user:
-                await self.line_adapter.send_error_message(line_user_id, "用戶不存在")
-                return False
-            
-            # 獲取活躍對話
-            conversation = self.conversation_service.get_active_conversation(str(user.id))
-            if not conversation:
-                await self.line_adapter.send_message(line_user_id, "目前沒有活躍的對話")
-                return True
-            
-            # 生成對話總結
-            summary, usage_info = self.ai_manager.get_conversation_summary(str(conversation.id))
+            async with self.unit_of_work() as uow:
+                user = await uow.conversation_service.get_user_by_line_id(line_user_id)
+                if not user:
+                    await self.line_adapter.send_error_message(line_user_id, "用戶不存在")
+                    return False
+                
+                # 獲取活躍對話
+                conversation = await uow.conversation_service.get_active_conversation(str(user.id))
+                if not conversation:
+                    await self.line_adapter.send_message(line_user_id, "目前沒有活躍的對話")
+                    return True
+                
+                # 生成對話總結
+                summary, usage_info = await uow.ai_manager.get_conversation_summary(str(conversation.id))
             
             # 發送總結
             summary_message = f"📋 對話總結：\n\n{summary}"
@@ -0,0 +1,170 @@
+"""
+背景維護排程
+"""
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Settings
+from app.core.database import AsyncSessionLocal
+from app.services.conversation_service import ConversationService
+from app.services.conversation_state_cache import ConversationStateCache
+from app.services.partition_manager import MessagePartitionManager
+
+
+class MaintenanceScheduler:
+    """背景維護排程器
+
+    定期執行資料維護工作（過期不活躍對話、封存舊的過期對話、維護訊息分區），
+    對話工作以分批的集合式UPDATE處理，並記錄處理筆數、耗時與每秒筆數。
+    多個worker同時執行時以Redis鎖讓每個週期只有一個worker執行；
+    Redis不可用時各自執行（分批更新會略過其他交易已鎖定的列，重複執行也安全）。
+    """
+
+    LOCK_PREFIX = "maintenance_lock:"
+
+    def __init__(
+        self,
+        settings: Settings,
+        state_cache: Optional[ConversationStateCache] = None,
+        redis_client: Optional[aioredis.Redis] = None
+    ):
+        self.settings = settings
+        self.state_cache = state_cache
+        self.redis_client = redis_client
+        self.interval_seconds = settings.maintenance_interval_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.partition_manager = MessagePartitionManager(
+            months_ahead=settings.message_partition_months_ahead,
+            retention_months=settings.message_retention_months,
+            retention_action=settings.message_retention_action,
+            lock_timeout_ms=settings.maintenance_lock_timeout_ms
+        )
+
+        self.jobs: List[Tuple[str, Callable[[AsyncSession], Awaitable[int]]]] = [
+            ("expire_inactive_conversations", self._expire_inactive_conversations),
+            ("archive_old_conversations", self._archive_old_conversations),
+            ("manage_message_partitions", self.partition_manager.run),
+        ]
+        self._task: Optional[asyncio.Task] = None
+
+        # 各工作的統計資訊
+        self.job_stats: Dict[str, Dict[str, Any]] = {
+            name: {
+                "runs": 0,
+                "skipped": 0,
+                "errors": 0,
+                "total_rows": 0,
+                "last_rows": 0,
+                "last_duration_ms": 0,
+                "last_rows_per_second": 0.0,
+                "last_run_at": None,
+                "last_error": None
+            }
+            for name, _ in self.jobs
+        }
+
+    def start(self):
+        """啟動排程（應用程式啟動時呼叫）"""
+        if not self.settings.maintenance_enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop(), name="maintenance-scheduler")
+
+    async def stop(self):
+        """停止排程"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self) -> Dict[str, int]:
+        """執行一輪所有維護工作，回傳各工作處理的筆數"""
+        results = {}
+        for name, job in self.jobs:
+            if not await self._acquire_lock(name):
+                self.job_stats[name]["skipped"] += 1
+                continue
+            results[name] = await self._run_job(name, job)
+        return results
+
+    async def _run_job(self, name: str, job: Callable[[AsyncSession], Awaitable[int]]) -> int:
+        """執行單一工作並記錄統計"""
+        stats = self.job_stats[name]
+        start_time = time.monotonic()
+        try:
+            async with AsyncSessionLocal() as db_session:
+                rows = await job(db_session)
+        except Exception as e:
+            stats["errors"] += 1
+            stats["last_error"] = str(e)
+            print(f"維護工作失敗（{name}）: {e}")
+            return 0
+
+        duration = time.monotonic() - start_time
+        stats["runs"] += 1
+        stats["total_rows"] += rows
+        stats["last_rows"] = rows
+        stats["last_duration_ms"] = int(duration * 1000)
+        stats["last_rows_per_second"] = rows / duration if duration > 0 else 0.0
+        stats["last_run_at"] = datetime.utcnow().isoformat()
+        stats["last_error"] = None
+        if rows:
+            print(f"維護工作 {name} 更新 {rows} 筆，耗時 {stats['last_duration_ms']}ms")
+        return rows
+
+    async def _expire_inactive_conversations(self, db_session: AsyncSession) -> int:
+        service = ConversationService(db_session, self.state_cache)
+        return await service.expire_inactive_conversations(
+            inactivity_minutes=self.settings.session_timeout_minutes,
+            batch_size=self.settings.maintenance_batch_size,
+            lock_timeout_ms=self.settings.maintenance_lock_timeout_ms
+        )
+
+    async def _archive_old_conversations(self, db_session: AsyncSession) -> int:
+        service = ConversationService(db_session, self.state_cache)
+        return await service.cleanup_old_conversations(
+            days_old=self.settings.conversation_archive_after_days,
+            batch_size=self.settings.maintenance_batch_size,
+            lock_timeout_ms=self.settings.maintenance_lock_timeout_ms
+        )
+
+    async def _acquire_lock(self, name: str) -> bool:
+        """取得本週期的執行權（鎖在週期結束前自動過期）"""
+        if self.redis_client is None:
+            return True
+        try:
+            return bool(await self.redis_client.set(
+                f"{self.LOCK_PREFIX}{name}",
+                self.worker_id,
+                nx=True,
+                ex=max(self.interval_seconds - 1, 1)
+            ))
+        except Exception as e:
+            print(f"取得維護工作鎖失敗，直接執行: {e}")
+            return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取維護工作統計"""
+        return {
+            "enabled": self.settings.maintenance_enabled,
+            "running": self._task is not None and not self._task.done(),
+            "interval_seconds": self.interval_seconds,
+            "jobs": self.job_stats,
+            "message_partitions": self.partition_manager.get_stats(),
+            "timestamp": datetime.utcnow().isoformat()
+        }
@@ -0,0 +1,411 @@
+"""
+訊息寫入緩衝（write-behind）
+"""
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+
+from app.core.database import AsyncSessionLocal
+from app.models import Conversation, Message
+
+
+class MessageWriteBehindLog:
+    """訊息寫入緩衝
+
+    訊息先寫入Redis stream（開啟AOF時即為持久化的緩衝），同時放入每個對話的待寫入hash，
+    讀取最近訊息時與資料庫結果合併，因此剛寫入的訊息立即可讀（read-your-writes）。
+    背景flusher以consumer group讀取stream，每flush_interval_ms或累積batch_size筆時
+    以單一多列INSERT ... ON CONFLICT DO NOTHING寫入messages，成功後才ACK並移除待寫入紀錄。
+    worker當機時未ACK的訊息由其他worker以XAUTOCLAIM接手重送，以訊息id去重，重送不會重複寫入；
+    接手時重新寫入待寫入hash並延長TTL，長時間未寫入的訊息仍可讀取。
+    呼叫端在對話計數的交易提交前append；Redis無法使用時append回傳None，
+    由呼叫端將訊息加入同一個交易，提交失敗時以discard撤回已寫入緩衝的訊息。
+    """
+
+    STREAM_KEY = "message_log"
+    GROUP = "message_flusher"
+    PENDING_PREFIX = "message_log:pending:"
+
+    def __init__(
+        self,
+        redis_client: Optional[aioredis.Redis] = None,
+        batch_size: int = 500,
+        flush_interval_ms: int = 200,
+        claim_idle_seconds: int = 60,
+        pending_ttl_seconds: int = 86400,
+        redis_retry_seconds: int = 30
+    ):
+        self.redis_client = redis_client
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_ms / 1000
+        self.claim_idle_seconds = claim_idle_seconds
+        self.pending_ttl_seconds = pending_ttl_seconds
+        self.redis_retry_seconds = redis_retry_seconds
+        self.consumer = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._redis_disabled_until = 0.0
+        self._group_ready = False
+        self._last_claim_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+        # 統計資訊
+        self.appended_count = 0
+        self.fallback_count = 0
+        self.flushed_count = 0
+        self.batch_count = 0
+        self.claimed_count = 0
+        self.dropped_count = 0
+        self.discarded_count = 0
+        self.error_count = 0
+        self.backlog: Optional[int] = None
+        self.last_batch_size = 0
+        self.last_flush_ms = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.redis_client is not None
+
+    async def append(self, messages: List[Message]) -> Optional[List[str]]:
+        """將訊息寫入緩衝，回傳stream的entry id；失敗時回傳None（呼叫端應改為同步寫入）"""
+        if not messages or not self._redis_available():
+            return None
+
+        for message in messages:
+            if message.id is None:
+                message.id = uuid.uuid4()
+            message.created_at = self._as_utc(message.created_at or datetime.utcnow())
+
+        try:
+            pipe = self.redis_client.pipeline(transaction=True)
+            for message in messages:
+                data = self._serialize(message)
+                pipe.hset(self._pending_key(message.conversation_id), str(message.id), data)
+                pipe.xadd(self.STREAM_KEY, {"message": data})
+            for conversation_id in {str(message.conversation_id) for message in messages}:
+                pipe.expire(self._pending_key(conversation_id), self.pending_ttl_seconds)
+            results = await pipe.execute()
+        except Exception as e:
+            self._disable(e)
+            self.fallback_count += 1
+            return None
+
+        self.appended_count += len(messages)
+        # 每則訊息依序為HSET、XADD兩個指令
+        return [results[index * 2 + 1] for index in range(len(messages))]
+
+    async def discard(self, messages: List[Message], entry_ids: List[str]):
+        """撤回已寫入緩衝的訊息（對話交易提交失敗時呼叫）
+
+        flusher已讀取但尚未寫入的訊息無法撤回，仍會寫入messages（訊息保留、計數未增加）。
+        """
+        try:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.xdel(self.STREAM_KEY, *entry_ids)
+            for message in messages:
+                pipe.hdel(self._pending_key(message.conversation_id), str(message.id))
+            await pipe.execute()
+            self.discarded_count += len(messages)
+        except Exception as e:
+            self._disable(e)
+
+    async def pending_messages(self, conversation_id: Any) -> List[Message]:
+        """獲取對話尚未寫入資料庫的訊息（需在查詢資料庫之前呼叫，才不會漏掉剛寫入的訊息）"""
+        if not self._redis_available():
+            return []
+        try:
+            data = await self.redis_client.hvals(self._pending_key(conversation_id))
+        except Exception as e:
+            self._disable(e)
+            return []
+
+        messages = []
+        for item in data:
+            try:
+                messages.append(self._deserialize(item))
+            except (ValueError, TypeError, KeyError) as e:
+                print(f"待寫入訊息格式錯誤: {e}")
+        return messages
+
+    @staticmethod
+    def merge(
+        messages: List[Message],
+        pending: List[Message],
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, uuid.UUID]] = None,
+        before: Optional[Tuple[datetime, uuid.UUID]] = None,
+        newest_first: bool = True
+    ) -> List[Message]:
+        """合併資料庫與待寫入的訊息（以id去重、依(created_at, id)排序並套用相同的篩選）"""
+        if not pending:
+            return messages
+
+        seen = {message.id for message in messages}
+        merged = list(messages)
+        for message in pending:
+            if message.id in seen:
+                continue
+            if after is not None and (message.created_at, message.id) <= (
+                MessageWriteBehindLog._as_utc(after[0]), after[1]
+            ):
+                continue
+            if before is not None and (message.created_at, message.id) >= (
+                MessageWriteBehindLog._as_utc(before[0]), before[1]
+            ):
+                continue
+            merged.append(message)
+
+        merged.sort(key=lambda message: (message.created_at, message.id), reverse=newest_first)
+        return merged[:limit] if limit else merged
+
+    def start(self):
+        """啟動背景flusher（應用程式啟動時呼叫）"""
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop(), name="message-log-flusher")
+
+    async def stop(self):
+        """停止flusher並寫入剩餘的訊息"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        try:
+            while await self.flush_once() >= self.batch_size:
+                pass
+        except Exception as e:
+            print(f"關閉時寫入緩衝訊息失敗: {e}")
+
+    async def _loop(self):
+        while True:
+            try:
+                flushed = await self.flush_once()
+            except Exception as e:
+                self.error_count += 1
+                print(f"寫入緩衝訊息失敗: {e}")
+                flushed = 0
+            # 累積滿一批時立即處理下一批，否則等待下一個週期
+            if flushed < self.batch_size:
+                await asyncio.sleep(self.flush_interval_seconds)
+
+    async def flush_once(self) -> int:
+        """讀取一批訊息寫入資料庫，回傳寫入的筆數"""
+        if not self._redis_available() or not await self._ensure_group():
+            return 0
+
+        try:
+            entries = await self._claim_stale_entries()
+            if len(entries) < self.batch_size:
+                response = await self.redis_client.xreadgroup(
+                    self.GROUP,
+                    self.consumer,
+                    {self.STREAM_KEY: ">"},
+                    count=self.batch_size - len(entries)
+                )
+                for _, stream_entries in response or []:
+                    entries.extend(stream_entries)
+        except Exception as e:
+            self._disable(e)
+            return 0
+
+        if not entries:
+            return 0
+
+        entry_ids = []
+        messages = []
+        for entry_id, fields in entries:
+            entry_ids.append(entry_id)
+            try:
+                messages.append(json.loads(fields["message"]))
+            except (ValueError, TypeError, KeyError) as e:
+                self.dropped_count += 1
+                print(f"丟棄格式錯誤的緩衝訊息 {entry_id}: {e}")
+
+        start_time = time.monotonic()
+        # 寫入失敗時不ACK，之後由XAUTOCLAIM重送
+        written = await self._write(messages)
+
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.xack(self.STREAM_KEY, self.GROUP, *entry_ids)
+            pipe.xdel(self.STREAM_KEY, *entry_ids)
+            for message in messages:
+                pipe.hdel(self._pending_key(message["conversation_id"]), message["id"])
+            pipe.xlen(self.STREAM_KEY)
+            results = await pipe.execute()
+            self.backlog = results[-1]
+        except Exception as e:
+            self._disable(e)
+
+        self.batch_count += 1
+        self.flushed_count += written
+        self.last_batch_size = len(entry_ids)
+        self.last_flush_ms = int((time.monotonic() - start_time) * 1000)
+        return len(entry_ids)
+
+    async def _write(self, messages: List[Dict[str, Any]]) -> int:
+        """以多列INSERT寫入訊息（已存在的訊息略過；重送的訊息created_at相同），回傳實際寫入的筆數"""
+        rows = [self._to_row(message) for message in messages]
+        if not rows:
+            return 0
+
+        async with AsyncSessionLocal() as db_session:
+            try:
+                written = await self._insert_rows(db_session, rows)
+            except IntegrityError:
+                # 對話已被刪除（外鍵不存在）的訊息無法寫入，丟棄後重試其餘訊息
+                await db_session.rollback()
+                result = await db_session.execute(
+                    select(Conversation.id).where(
+                        Conversation.id.in_({row["conversation_id"] for row in rows})
+                    )
+                )
+                existing = set(result.scalars().all())
+                kept = [row for row in rows if row["conversation_id"] in existing]
+                dropped_ids = [str(row["id"]) for row in rows if row["conversation_id"] not in existing]
+                self.dropped_count += len(dropped_ids)
+                print(f"丟棄 {len(dropped_ids)} 則對話已不存在的緩衝訊息: {', '.join(dropped_ids)}")
+                written = await self._insert_rows(db_session, kept) if kept else 0
+            return written
+
+    @staticmethod
+    async def _insert_rows(db_session, rows: List[Dict[str, Any]]) -> int:
+        result = await db_session.execute(
+            pg_insert(Message).values(rows).on_conflict_do_nothing(index_elements=["id", "created_at"])
+        )
+        await db_session.commit()
+        return result.rowcount
+
+    async def _claim_stale_entries(self) -> List[Tuple[str, Dict[str, str]]]:
+        """接手閒置過久的未ACK訊息（當機的worker或先前寫入失敗的批次）"""
+        now = time.monotonic()
+        if now - self._last_claim_at < self.claim_idle_seconds:
+            return []
+        self._last_claim_at = now
+
+        response = await self.redis_client.xautoclaim(
+            self.STREAM_KEY,
+            self.GROUP,
+            self.consumer,
+            min_idle_time=self.claim_idle_seconds * 1000,
+            start_id="0-0",
+            count=self.batch_size
+        )
+        # 已被XDEL的訊息回傳為None
+        entries = [entry for entry in response[1] if entry and entry[1]]
+        if entries:
+            self.claimed_count += len(entries)
+            print(f"接手 {len(entries)} 則未寫入的緩衝訊息")
+            await self._restore_pending(entries)
+        return entries
+
+    async def _restore_pending(self, entries: List[Tuple[str, Dict[str, str]]]):
+        """將接手的訊息重新寫入待寫入hash並延長TTL（停擺超過TTL時hash可能已過期）"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        conversation_ids = set()
+        for _, fields in entries:
+            try:
+                message = json.loads(fields["message"])
+                pipe.hset(self._pending_key(message["conversation_id"]), message["id"], fields["message"])
+                conversation_ids.add(message["conversation_id"])
+            except (ValueError, TypeError, KeyError):
+                # 格式錯誤的訊息由flush_once丟棄
+                continue
+        for conversation_id in conversation_ids:
+            pipe.expire(self._pending_key(conversation_id), self.pending_ttl_seconds)
+        await pipe.execute()
+
+    async def _ensure_group(self) -> bool:
+        """建立consumer group（已存在時略過）"""
+        if self._group_ready:
+            return True
+        try:
+            await self.redis_client.xgroup_create(self.STREAM_KEY, self.GROUP, id="0", mkstream=True)
+        except aioredis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                self._disable(e)
+                return False
+        except Exception as e:
+            self._disable(e)
+            return False
+        self._group_ready = True
+        return True
+
+    def _serialize(self, message: Message) -> str:
+        return json.dumps({
+            "id": str(message.id),
+            "conversation_id": str(message.conversation_id),
+            "message_type": message.message_type,
+            "content": message.content,
+            "tokens_used": message.tokens_used,
+            "token_count": message.token_count,
+            "processing_time_ms": message.processing_time_ms,
+            "created_at": message.created_at.isoformat()
+        }, ensure_ascii=False)
+
+    def _deserialize(self, data: str) -> Message:
+        return Message(**self._to_row(json.loads(data)))
+
+    @classmethod
+    def _to_row(cls, message: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": uuid.UUID(message["id"]),
+            "conversation_id": uuid.UUID(message["conversation_id"]),
+            "message_type": message["message_type"],
+            "content": message["content"],
+            "tokens_used": message.get("tokens_used"),
+            "token_count": message.get("token_count"),
+            "processing_time_ms": message.get("processing_time_ms"),
+            "created_at": cls._as_utc(datetime.fromisoformat(message["created_at"]))
+        }
+
+    @staticmethod
+    def _as_utc(value: datetime) -> datetime:
+        """未帶時區的時間視為UTC（與資料庫回傳的時間可以比較）"""
+        return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+    def _pending_key(self, conversation_id: Any) -> str:
+        return f"{self.PENDING_PREFIX}{conversation_id}"
+
+    def _redis_available(self) -> bool:
+        return self.redis_client is not None and time.monotonic() >= self._redis_disabled_until
+
+    def _disable(self, error: Exception):
+        """Redis失敗時暫停使用一段時間（期間改為同步寫入）"""
+        self.error_count += 1
+        self._redis_disabled_until = time.monotonic() + self.redis_retry_seconds
+        print(f"訊息寫入緩衝Redis失敗，暫時改為同步寫入: {error}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取寫入緩衝統計（backlog為最近一次寫入後stream剩餘的筆數）"""
+        return {
+            "enabled": self.enabled,
+            "available": self._redis_available(),
+            "running": self._task is not None and not self._task.done(),
+            "backlog": self.backlog,
+            "appended": self.appended_count,
+            "flushed": self.flushed_count,
+            "batches": self.batch_count,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": self.last_flush_ms,
+            "claimed": self.claimed_count,
+            "dropped": self.dropped_count,
+            "discarded": self.discarded_count,
+            "sync_fallbacks": self.fallback_count,
+            "errors": self.error_count,
+            "timestamp": datetime.utcnow().isoformat()
+        }
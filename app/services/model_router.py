@@ -0,0 +1,193 @@
+"""
+模型路由
+"""
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.core.config import Settings
+
+
+class ModelRouter:
+    """模型路由器
+
+    依呼叫類型選擇模型：開場白（greeting）與摘要（summary）使用較便宜的模型，
+    對話輔導（coaching）使用設定的模型，並尊重對話指定的ai_model。
+    以最近的呼叫紀錄追蹤各模型的延遲與錯誤率，主要模型的p95延遲或錯誤率超過門檻時
+    改用備援模型，冷卻時間過後再以全新的統計回到主要模型。同時累計各模型的token用量與成本。
+    串流呼叫記錄首個token的時間，並與非串流的完整延遲分開統計，長回應不會被誤判為延遲過高。
+    """
+
+    CALL_TYPES = ("greeting", "summary", "coaching")
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.enabled = settings.routing_enabled
+        self.routes = {
+            "greeting": settings.greeting_model or settings.openai_model,
+            "summary": settings.summary_model or settings.openai_model,
+            "coaching": settings.coaching_model or settings.openai_model
+        }
+        self.fallback_model = settings.fallback_model
+
+        # 模型 -> 最近的非串流呼叫（延遲毫秒, 是否成功）
+        self._samples: Dict[str, Deque[Tuple[int, bool]]] = {}
+        # 模型 -> 最近的串流呼叫（首個token的毫秒數, 是否成功）
+        self._stream_samples: Dict[str, Deque[Tuple[int, bool]]] = {}
+        # 模型 -> 累計用量
+        self._usage: Dict[str, Dict[str, Any]] = {}
+        # 模型 -> 改用備援模型的時間
+        self._failed_over_at: Dict[str, float] = {}
+        self.failover_count = 0
+
+    def resolve_alias(self, ai_model: Optional[str]) -> Optional[str]:
+        """將對話的ai_model轉換為模型名稱（預設的ai_model不指定模型，依呼叫類型路由）"""
+        if not ai_model or ai_model == self.settings.default_ai_model:
+            return None
+        return self.settings.ai_model_aliases.get(ai_model, ai_model)
+
+    def conversation_model(self, ai_model: Optional[str]) -> str:
+        """對話（ai_model）的對話輔導回應使用的主要模型"""
+        if not self.enabled:
+            return self.resolve_alias(ai_model) or self.settings.openai_model
+        return self.resolve_alias(ai_model) or self.routes["coaching"]
+
+    def select(self, call_type: str, ai_model: Optional[str] = None) -> str:
+        """選擇本次呼叫使用的模型"""
+        if not self.enabled:
+            return self.resolve_alias(ai_model) or self.settings.openai_model
+
+        primary = self.resolve_alias(ai_model) or self.routes.get(call_type, self.settings.openai_model)
+        fallback = self.fallback_model
+        if not fallback or fallback == primary:
+            return primary
+
+        failed_over_at = self._failed_over_at.get(primary)
+        if failed_over_at is not None:
+            if time.monotonic() - failed_over_at < self.settings.routing_failover_cooldown_seconds:
+                return fallback
+            # 冷卻結束，清除舊統計後回到主要模型
+            del self._failed_over_at[primary]
+            self._samples.pop(primary, None)
+            self._stream_samples.pop(primary, None)
+            print(f"模型 {primary} 冷卻結束，恢復使用")
+            return primary
+
+        if self._is_unhealthy(primary) and not self._is_unhealthy(fallback):
+            self._failed_over_at[primary] = time.monotonic()
+            self.failover_count += 1
+            print(f"模型 {primary} 延遲或錯誤率過高，改用 {fallback}")
+            return fallback
+        return primary
+
+    def retry_model(self, model: str) -> Optional[str]:
+        """呼叫因上游故障失敗時可重試一次的備援模型（未設定或與原模型相同時回傳None）"""
+        if not self.enabled or not self.fallback_model or self.fallback_model == model:
+            return None
+        return self.fallback_model
+
+    def record(
+        self,
+        model: str,
+        latency_ms: int,
+        success: bool = True,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        streamed: bool = False
+    ):
+        """記錄一次呼叫的結果（串流呼叫的latency_ms為首個token的時間）"""
+        windows = self._stream_samples if streamed else self._samples
+        samples = windows.get(model)
+        if samples is None:
+            samples = windows[model] = deque(maxlen=self.settings.routing_health_window_size)
+        samples.append((latency_ms, success))
+
+        usage = self._usage.setdefault(model, {
+            "calls": 0,
+            "errors": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost_usd": 0.0
+        })
+        usage["calls"] += 1
+        if not success:
+            usage["errors"] += 1
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+        usage["cost_usd"] += self.estimate_cost(model, prompt_tokens, completion_tokens)
+
+    def estimate_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """依模型價格（每1K token）估算成本"""
+        pricing = self.settings.ai_model_pricing.get(model)
+        if not pricing:
+            return 0.0
+        return (prompt_tokens * pricing.get("input", 0) + completion_tokens * pricing.get("output", 0)) / 1000
+
+    def _is_unhealthy(self, model: str) -> bool:
+        """非串流或串流呼叫最近的p95延遲或錯誤率是否超過門檻"""
+        for windows in (self._samples, self._stream_samples):
+            samples = windows.get(model)
+            if not samples or len(samples) < self.settings.routing_health_min_samples:
+                continue
+            p95_latency_ms, error_rate = self._health(samples)
+            if (
+                p95_latency_ms > self.settings.routing_failover_p95_latency_ms
+                or error_rate > self.settings.routing_failover_error_rate
+            ):
+                return True
+        return False
+
+    def _health(self, samples: Deque[Tuple[int, bool]]) -> Tuple[int, float]:
+        """計算（成功呼叫的p95延遲, 錯誤率）"""
+        errors = sum(1 for _, success in samples if not success)
+        return self._percentile(samples, 0.95), errors / len(samples)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取各模型的延遲、錯誤率與成本統計"""
+        models = {}
+        for model in set(self._samples) | set(self._stream_samples) | set(self._usage):
+            samples = self._samples.get(model) or deque()
+            stream_samples = self._stream_samples.get(model) or deque()
+            p95_latency_ms, error_rate = self._health(samples) if samples else (0, 0.0)
+            p95_first_token_ms, stream_error_rate = self._health(stream_samples) if stream_samples else (0, 0.0)
+            usage = self._usage.get(model, {})
+            models[model] = {
+                **usage,
+                "window_calls": len(samples),
+                "p50_latency_ms": self._percentile(samples, 0.5),
+                "p95_latency_ms": p95_latency_ms,
+                "error_rate": error_rate,
+                "stream_window_calls": len(stream_samples),
+                "p95_time_to_first_token_ms": p95_first_token_ms,
+                "stream_error_rate": stream_error_rate,
+                "failed_over": model in self._failed_over_at
+            }
+        return {
+            "enabled": self.enabled,
+            "routes": self.routes,
+            "fallback_model": self.fallback_model,
+            "failovers": self.failover_count,
+            "total_cost_usd": sum(usage["cost_usd"] for usage in self._usage.values()),
+            "models": models,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+    @staticmethod
+    def _percentile(samples: Deque[Tuple[int, bool]], percentile: float) -> int:
+        """成功呼叫延遲的百分位數"""
+        latencies = sorted(latency for latency, success in samples if success)
+        if not latencies:
+            return 0
+        return latencies[min(int(len(latencies) * percentile), len(latencies) - 1)]
+
+
+_model_router: Optional[ModelRouter] = None
+
+
+def get_model_router(settings: Settings) -> ModelRouter:
+    """獲取行程共用的模型路由器"""
+    global _model_router
+    if _model_router is None:
+        _model_router = ModelRouter(settings)
+    return _model_router
@@ -0,0 +1,166 @@
+"""
+訊息分區管理
+"""
+import re
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class MessagePartitionManager:
+    """messages按月分區的維護
+
+    預先建立未來months_ahead個月的分區，避免新訊息落入預設分區；
+    已落入預設分區的訊息在建立該月份分區時移入，並記錄警告。
+    retention_months大於0時，上界已超過保留期限的分區（包含遷移時掛上的歷史分區）依retention_action
+    卸離（detach，保留為獨立資料表供封存）或刪除（drop）。
+    messages尚未分區（未執行008遷移）時不做任何事。
+    """
+
+    PARENT_TABLE = "messages"
+    UPPER_BOUND_PATTERN = re.compile(r"TO \('([^']+)'\)")
+    RETENTION_ACTIONS = ("detach", "drop")
+
+    def __init__(
+        self,
+        months_ahead: int = 3,
+        retention_months: int = 0,
+        retention_action: str = "detach",
+        lock_timeout_ms: int = 2000
+    ):
+        if retention_action not in self.RETENTION_ACTIONS:
+            raise ValueError(f"不支援的訊息保留處理方式: {retention_action}")
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.retention_action = retention_action
+        self.lock_timeout_ms = lock_timeout_ms
+
+        # 統計資訊
+        self.created_count = 0
+        self.moved_from_default_count = 0
+        self.detached_count = 0
+        self.dropped_count = 0
+        self.partitions: List[str] = []
+
+    async def run(self, db_session: AsyncSession) -> int:
+        """建立未來的分區並套用保留期限，回傳建立與移除的分區數"""
+        if not await self.is_partitioned(db_session):
+            await db_session.commit()
+            return 0
+        changed = await self.ensure_future_partitions(db_session)
+        changed += await self.apply_retention(db_session)
+        self.partitions = [name for name, _ in await self.list_partitions(db_session)]
+        await db_session.commit()
+        return changed
+
+    async def is_partitioned(self, db_session: AsyncSession) -> bool:
+        """messages是否為分區表"""
+        result = await db_session.execute(
+            text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table_name)"),
+            {"table_name": self.PARENT_TABLE}
+        )
+        return result.scalar() is not None
+
+    async def ensure_future_partitions(self, db_session: AsyncSession) -> int:
+        """建立本月到未來months_ahead個月的分區（已存在或已被涵蓋的略過）"""
+        current_month = self._month_start(datetime.utcnow().date())
+        created = 0
+        for offset in range(self.months_ahead + 1):
+            month_start = self._add_months(current_month, offset)
+            await self._set_lock_timeout(db_session)
+            result = await db_session.execute(
+                text("SELECT create_messages_partition(:month_start)"),
+                {"month_start": month_start}
+            )
+            moved = result.scalar()
+            # 每個分區一個交易，縮短持有父表鎖的時間
+            await db_session.commit()
+            if moved is None:
+                continue
+            created += 1
+            if moved:
+                # 預設分區有資料表示分區沒有及時建立（維護工作停擺或訊息時間異常）
+                self.moved_from_default_count += moved
+                print(f"警告: 預設分區中有 {moved} 則 {month_start:%Y-%m} 的訊息，已移入新建立的分區")
+
+        if created:
+            self.created_count += created
+            print(f"已建立 {created} 個訊息分區")
+        return created
+
+    async def apply_retention(self, db_session: AsyncSession) -> int:
+        """卸離或刪除所有訊息都超過保留期限的分區（以分區上界判斷）"""
+        if self.retention_months <= 0:
+            return 0
+
+        cutoff_month = self._add_months(self._month_start(datetime.utcnow().date()), -self.retention_months)
+        cutoff = datetime(cutoff_month.year, cutoff_month.month, 1, tzinfo=timezone.utc)
+        expired = [
+            name for name, upper_bound in await self.list_partitions(db_session)
+            if upper_bound <= cutoff
+        ]
+        for name in expired:
+            await self._set_lock_timeout(db_session)
+            if self.retention_action == "drop":
+                await db_session.execute(text(f'DROP TABLE "{name}"'))
+                self.dropped_count += 1
+            else:
+                await db_session.execute(text(f'ALTER TABLE {self.PARENT_TABLE} DETACH PARTITION "{name}"'))
+                self.detached_count += 1
+            await db_session.commit()
+            print(f"訊息分區 {name} 已超過保留期限（{self.retention_action}）")
+        return len(expired)
+
+    async def list_partitions(self, db_session: AsyncSession) -> List[Tuple[str, datetime]]:
+        """列出有範圍的分區與其上界（不含預設分區），依上界排序"""
+        result = await db_session.execute(
+            text("""
+                SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+                FROM pg_inherits
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = to_regclass(:table_name)
+            """),
+            {"table_name": self.PARENT_TABLE}
+        )
+        partitions = []
+        for name, bound in result.all():
+            upper_bound = self.parse_upper_bound(bound)
+            if upper_bound is not None:
+                partitions.append((name, upper_bound))
+        return sorted(partitions, key=lambda partition: partition[1])
+
+    @classmethod
+    def parse_upper_bound(cls, bound: str) -> Optional[datetime]:
+        """由分區邊界（FOR VALUES FROM (...) TO ('...')）取得上界，預設分區回傳None"""
+        match = cls.UPPER_BOUND_PATTERN.search(bound or "")
+        if not match:
+            return None
+        return datetime.fromisoformat(match.group(1)).astimezone(timezone.utc)
+
+    async def _set_lock_timeout(self, db_session: AsyncSession):
+        """DDL需要父表的鎖，等待超過lock_timeout_ms即放棄，下個週期再試"""
+        await db_session.execute(text(f"SET LOCAL lock_timeout = {int(self.lock_timeout_ms)}"))
+
+    @staticmethod
+    def _month_start(value: date) -> date:
+        return value.replace(day=1)
+
+    @staticmethod
+    def _add_months(value: date, months: int) -> date:
+        month_index = value.year * 12 + value.month - 1 + months
+        return date(month_index // 12, month_index % 12 + 1, 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取分區維護統計"""
+        return {
+            "months_ahead": self.months_ahead,
+            "retention_months": self.retention_months,
+            "retention_action": self.retention_action,
+            "partitions": self.partitions,
+            "created": self.created_count,
+            "moved_from_default": self.moved_from_default_count,
+            "detached": self.detached_count,
+            "dropped": self.dropped_count
+        }
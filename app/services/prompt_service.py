@@ -2,7 +2,8 @@
 Prompt管理服務
 """
 from typing import Optional, Dict, Any, List, Tuple
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 
 from app.models import PromptCategory, Conversation, Message, User
@@ -18,7 +19,7 @@ from app.core.exceptions import (
 class PromptService:
     """Prompt管理服務"""
     
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: AsyncSession):
         self.db_session = db_session
         self.prompt_manager = PromptManager(db_session)
     
@@ -55,24 +56,24 @@ class PromptService:
         except Exception as e:
             raise PromptServiceError(f"獲取Prompt模板失敗: {e}")
     
-    def get_category_from_db(self, category_key: str) -> Optional[PromptCategory]:
+    async def get_category_from_db(self, category_key: str) -> Optional[PromptCategory]:
         """從資料庫獲取問題分類"""
         try:
-            return self.prompt_manager.get_category_from_db(category_key)
+            return await self.prompt_manager.get_category_from_db(category_key)
         except Exception as e:
             raise DatabaseError(f"從資料庫獲取分類失敗: {e}")
     
-    def get_all_categories_from_db(self) -> List[PromptCategory]:
+    async def get_all_categories_from_db(self) -> List[PromptCategory]:
         """從資料庫獲取所有啟用的問題分類"""
         try:
-            return self.prompt_manager.get_all_categories_from_db()
+            return await self.prompt_manager.get_all_categories_from_db()
         except Exception as e:
             raise DatabaseError(f"從資料庫獲取所有分類失敗: {e}")
     
-    def sync_categories_to_db(self) -> bool:
+    async def sync_categories_to_db(self) -> bool:
         """將分類定義同步到資料庫"""
         try:
-            return self.prompt_manager.sync_categories_to_db()
+            return await self.prompt_manager.sync_categories_to_db()
         except Exception as e:
             raise DatabaseError(f"同步分類到資料庫失敗: {e}")
     
@@ -125,7 +126,7 @@ class PromptService:
         except Exception as e:
             raise PromptServiceError(f"獲取分類摘要失敗: {e}")
     
-    def create_conversation_with_category(
+    async def create_conversation_with_category(
         self, 
         user_id: str, 
         category_key: str,
@@ -134,7 +135,7 @@ class PromptService:
         """創建帶有分類的對話"""
         try:
             # 驗證分類是否存在
-            category = self.get_category_from_db(category_key)
+            category = await self.get_category_from_db(category_key)
             if not category:
                 raise CategoryNotFoundError(f"找不到分類 '{category_key}'")
             
@@ -148,104 +149,75 @@ class PromptService:
             )
             
             self.db_session.add(conversation)
-            self.db_session.commit()
+            await self.db_session.commit()
             
             return conversation
             
         except CategoryNotFoundError:
             raise
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"創建對話失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise PromptServiceError(f"創建對話失敗: {e}")
     
-    def get_conversation_category(self, conversation_id: str) -> Optional[PromptCategory]:
+    async def get_conversation_category(self, conversation_id: str) -> Optional[PromptCategory]:
         """獲取對話的分類資訊"""
         try:
-            conversation = self.db_session.query(Conversation).filter(
-                Conversation.id == conversation_id
-            ).first()
+            conversation = await self._get_conversation(conversation_id)
             
             if not conversation or not conversation.category_key:
                 return None
             
-            return self.get_category_from_db(conversation.category_key)
+            return await self.get_category_from_db(conversation.category_key)
             
         except Exception as e:
             raise DatabaseError(f"獲取對話分類失敗: {e}")
     
-    def update_conversation_category(
+    async def update_conversation_category(
         self, 
         conversation_id: str, 
         category_key: str
     ) -> bool:
         """更新對話的分類"""
         try:
-            conversation = self.db_session.query(Conversation).filter(
-                Conversation.id == conversation_id
-            ).first()
+            conversation = await self._get_conversation(conversation_id)
             
             if not conversation:
                 return False
             
             # 驗證新分類是否存在
-            category = self.get_category_from_db(category_key)
+            category = await self.get_category_from_db(category_key)
             if not category:
                 raise CategoryNotFoundError(f"找不到分類 '{category_key}'")
             
             conversation.category_key = category_key
             conversation.state = "conversation"
-            self.db_session.commit()
+            await self.db_session.commit()
             
             return True
             
         except CategoryNotFoundError:
             raise
         except SQLAlchemyError as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise DatabaseError(f"更新對話分類失敗: {e}")
         except Exception as e:
-            self.db_session.rollback()
+            await self.db_session.rollback()
             raise PromptServiceError(f"更新對話分類失敗: {e}")
     
-    def get_category_statistics(self) -> Dict[str, Any]:
-        """獲取分類使用統計"""
+    async def get_category_statistics(self) -> Dict[str, Any]:
+        """獲取分類使用統計（在資料庫端以GROUP BY彙總）"""
         try:
-            # 獲取各分類的對話數量
-            category_stats = self.db_session.query(
-                Conversation.category_key,
-                Conversation.ai_model,
-                Conversation.status
-            ).all()
-            
-            stats = {
-                "total_conversations": len(category_stats),
-                "by_category": {},
-                "by_model": {},
-                "by_status": {}
+            stats = await Conversation.aggregate_statistics_async(self.db_session)
+            return {
+                "total_conversations": stats["total_conversations"],
+                "by_category": stats["by_category"],
+                "by_model": stats["by_model"],
+                "by_status": stats["by_status"]
             }
             
-            for category_key, ai_model, status in category_stats:
-                # 按分類統計
-                if category_key:
-                    if category_key not in stats["by_category"]:
-                        stats["by_category"][category_key] = 0
-                    stats["by_category"][category_key] += 1
-                
-                # 按模型統計
-                if ai_model not in stats["by_model"]:
-                    stats["by_model"][ai_model] = 0
-                stats["by_model"][ai_model] += 1
-                
-                # 按狀態統計
-                if status not in stats["by_status"]:
-                    stats["by_status"][status] = 0
-                stats["by_status"][status] += 1
-            
-            return stats
-            
         except Exception as e:
             raise DatabaseError(f"獲取分類統計失敗: {e}")
     
@@ -293,12 +265,10 @@ class PromptService:
         except Exception as e:
             raise PromptServiceError(f"驗證對話流程失敗: {e}")
     
-    def get_conversation_context(self, conversation_id: str) -> Dict[str, Any]:
+    async def get_conversation_context(self, conversation_id: str) -> Dict[str, Any]:
         """獲取對話上下文資訊"""
         try:
-            conversation = self.db_session.query(Conversation).filter(
-                Conversation.id == conversation_id
-            ).first()
+            conversation = await self._get_conversation(conversation_id)
             
             if not conversation:
                 return {}
@@ -318,7 +288,7 @@ class PromptService:
             
             # 添加分類資訊
             if conversation.category_key:
-                category = self.get_category_from_db(conversation.category_key)
+                category = await self.get_category_from_db(conversation.category_key)
                 if category:
                     context["category"] = {
                         "name": category.name,
@@ -330,3 +300,10 @@ class PromptService:
             
         except Exception as e:
             raise DatabaseError(f"獲取對話上下文失敗: {e}")
+    
+    async def _get_conversation(self, conversation_id: str) -> Optional[Conversation]:
+        """根據ID獲取對話"""
+        result = await self.db_session.execute(
+            select(Conversation).where(Conversation.id == conversation_id)
+        )
+        return result.scalars().first()
@@ -0,0 +1,159 @@
+"""
+AI回應快取
+"""
+import copy
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+from app.core.config import Settings
+from app.core.database import async_redis_client
+
+
+class ResponseCache:
+    """AI回應快取
+
+    以（模型、正規化後的訊息、temperature）為鍵快取完整回應：
+    行程內LRU（L1，有大小上限與TTL）在前，Redis（L2，跨worker共享）在後。
+    只有呼叫端明確選用的呼叫才會使用快取。
+    """
+
+    KEY_PREFIX = "ai_response:"
+
+    def __init__(
+        self,
+        redis_client: Optional[aioredis.Redis] = None,
+        ttl_seconds: int = 86400,
+        local_max_size: int = 256,
+        redis_retry_seconds: int = 30
+    ):
+        self.redis_client = redis_client
+        self.ttl_seconds = ttl_seconds
+        self.local_max_size = local_max_size
+        self.redis_retry_seconds = redis_retry_seconds
+
+        self._local: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._redis_disabled_until = 0.0
+
+        # 統計資訊
+        self.local_hit_count = 0
+        self.redis_hit_count = 0
+        self.miss_count = 0
+        self.write_count = 0
+        self.eviction_count = 0
+        self.redis_error_count = 0
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+        """產生快取鍵（訊息內容去除前後空白並合併連續空白）"""
+        normalized = [
+            {"role": message.get("role"), "content": " ".join((message.get("content") or "").split())}
+            for message in messages
+        ]
+        payload = json.dumps(
+            {"model": model, "messages": normalized, "temperature": round(temperature, 3)},
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """讀取快取的回應與用量資訊"""
+        now = time.monotonic()
+
+        # L1
+        entry = self._local.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if now < expires_at:
+                self._local.move_to_end(key)
+                self.local_hit_count += 1
+                return value["response"], copy.deepcopy(value["usage_info"])
+            del self._local[key]
+
+        # L2
+        if self._redis_available(now):
+            try:
+                raw = await self.redis_client.get(f"{self.KEY_PREFIX}{key}")
+                if raw:
+                    value = json.loads(raw)
+                    self._set_local(key, value, now)
+                    self.redis_hit_count += 1
+                    return value["response"], copy.deepcopy(value["usage_info"])
+            except Exception as e:
+                self._disable_redis(e, now)
+
+        self.miss_count += 1
+        return None
+
+    async def set(self, key: str, response: str, usage_info: Dict[str, Any]):
+        """寫入快取"""
+        now = time.monotonic()
+        value = {"response": response, "usage_info": usage_info}
+        self._set_local(key, value, now)
+        self.write_count += 1
+
+        if self._redis_available(now):
+            try:
+                await self.redis_client.set(
+                    f"{self.KEY_PREFIX}{key}",
+                    json.dumps(value, ensure_ascii=False, default=str),
+                    ex=self.ttl_seconds
+                )
+            except Exception as e:
+                self._disable_redis(e, now)
+
+    def _set_local(self, key: str, value: Dict[str, Any], now: float):
+        """寫入L1並淘汰最久未使用的項目"""
+        self._local[key] = (now + self.ttl_seconds, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_max_size:
+            self._local.popitem(last=False)
+            self.eviction_count += 1
+
+    def _redis_available(self, now: float) -> bool:
+        """Redis是否可用（失敗後暫停一段時間再重試）"""
+        return self.redis_client is not None and now >= self._redis_disabled_until
+
+    def _disable_redis(self, error: Exception, now: float):
+        """Redis操作失敗時暫停使用L2"""
+        self.redis_error_count += 1
+        self._redis_disabled_until = now + self.redis_retry_seconds
+        print(f"AI回應快取Redis失敗，暫時只使用行程內快取: {error}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取快取統計"""
+        hits = self.local_hit_count + self.redis_hit_count
+        lookups = hits + self.miss_count
+        return {
+            "l2_backend": "redis" if self._redis_available(time.monotonic()) else "disabled",
+            "local_hits": self.local_hit_count,
+            "redis_hits": self.redis_hit_count,
+            "misses": self.miss_count,
+            "hit_rate": hits / lookups if lookups else 0,
+            "writes": self.write_count,
+            "evictions": self.eviction_count,
+            "redis_errors": self.redis_error_count,
+            "local_size": len(self._local),
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache(settings: Settings) -> ResponseCache:
+    """獲取行程共用的AI回應快取"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            redis_client=async_redis_client,
+            ttl_seconds=settings.response_cache_ttl_seconds,
+            local_max_size=settings.response_cache_local_max_size
+        )
+    return _response_cache
@@ -0,0 +1,104 @@
+"""
+串流回應分段
+"""
+from typing import List, Optional
+
+
+class ResponseChunker:
+    """串流回應分段器
+
+    將模型逐字產生的內容在段落或句子結尾切段（支援中文標點）：
+    第一段只需較短的長度即可送出，讓用戶盡快看到回應；之後的段落較長，減少訊息數量。
+    """
+
+    # 句子結尾（中英文）
+    SENTENCE_ENDINGS = "。！？；…!?;"
+    # 可跟在句尾的收尾符號
+    CLOSING_MARKS = "」』）》〉】”’\"')"
+    # 找不到句尾時的次要切點
+    SOFT_BREAKS = "，、：,: "
+
+    def __init__(
+        self,
+        first_chunk_min_chars: int = 20,
+        chunk_min_chars: int = 200,
+        chunk_max_chars: int = 1000
+    ):
+        self.first_chunk_min_chars = first_chunk_min_chars
+        self.chunk_min_chars = chunk_min_chars
+        self.chunk_max_chars = chunk_max_chars
+
+        self._buffer = ""
+        self._boundary_pending = False
+        self._boundary_chars = set(self.SENTENCE_ENDINGS + self.CLOSING_MARKS + ".\n")
+        self.chunk_count = 0
+
+    def feed(self, text: str) -> List[str]:
+        """加入新產生的內容，回傳已完成的段落"""
+        self._buffer += text
+
+        # 新內容沒有可能的切點時不必重新掃描
+        if (
+            not self._boundary_pending
+            and len(self._buffer) < self.chunk_max_chars
+            and not self._boundary_chars.intersection(text)
+        ):
+            return []
+
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            chunk = self._take(cut)
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def flush(self) -> Optional[str]:
+        """串流結束時取出剩餘內容"""
+        return self._take(len(self._buffer)) or None
+
+    def _take(self, cut: int) -> str:
+        """取出緩衝區前cut個字元作為一段"""
+        chunk = self._buffer[:cut].strip()
+        self._buffer = self._buffer[cut:]
+        if chunk:
+            self.chunk_count += 1
+        return chunk
+
+    def _find_cut(self) -> Optional[int]:
+        """尋找切段位置（切點之前的內容成為一段）"""
+        buffer = self._buffer
+        self._boundary_pending = False
+        min_chars = self.first_chunk_min_chars if self.chunk_count == 0 else self.chunk_min_chars
+
+        sentence_cut = None
+        for index, char in enumerate(buffer):
+            position = index + 1
+            if char == "\n" and buffer[position:position + 1] == "\n":
+                # 段落結尾優先
+                if len(buffer[:index].strip()) >= min_chars:
+                    return position + 1
+            elif char in self.SENTENCE_ENDINGS or (char == "." and buffer[position:position + 1].isspace()):
+                while position < len(buffer) and buffer[position] in self.CLOSING_MARKS:
+                    position += 1
+                if position == len(buffer):
+                    # 後面可能還有收尾符號，等下一批內容
+                    self._boundary_pending = True
+                    break
+                if sentence_cut is None and len(buffer[:position].strip()) >= min_chars:
+                    sentence_cut = position
+            elif char == "." and position == len(buffer):
+                # 英文句點要看下一個字元是否為空白，等下一批內容
+                self._boundary_pending = True
+
+        if sentence_cut is not None:
+            return sentence_cut
+
+        if len(buffer) >= self.chunk_max_chars:
+            # 過長時在最後一個次要切點切段，都沒有則硬切
+            soft_cut = max(buffer.rfind(mark, 0, self.chunk_max_chars) for mark in self.SOFT_BREAKS)
+            return soft_cut + 1 if soft_cut > 0 else self.chunk_max_chars
+
+        return None
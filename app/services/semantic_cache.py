@@ -0,0 +1,232 @@
+"""
+首輪訊息相似度快取
+"""
+import hashlib
+import json
+import random
+import re
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from app.core.config import Settings
+
+
+class MinHasher:
+    """以字元n-gram計算MinHash簽章（純Python，CPU即可執行）"""
+
+    _MERSENNE_PRIME = (1 << 61) - 1
+    _MAX_HASH = (1 << 32) - 1
+    # 比對前移除的空白與標點
+    _IGNORED_CHARS = re.compile(r"[\s，。！？、；：「」『』（）()【】《》〈〉,.!?;:'\"…~\-]+")
+
+    def __init__(self, num_perm: int = 64, ngram_size: int = 2, seed: int = 1):
+        self.num_perm = num_perm
+        self.ngram_size = ngram_size
+        generator = random.Random(seed)
+        self._permutations = [
+            (generator.randint(1, self._MERSENNE_PRIME - 1), generator.randint(0, self._MERSENNE_PRIME - 1))
+            for _ in range(num_perm)
+        ]
+
+    def normalize(self, text: str) -> str:
+        """正規化文本：轉小寫並移除空白與標點"""
+        return self._IGNORED_CHARS.sub("", text.lower())
+
+    def shingles(self, text: str) -> Set[str]:
+        """切成字元n-gram"""
+        normalized = self.normalize(text)
+        if len(normalized) <= self.ngram_size:
+            return {normalized} if normalized else set()
+        return {normalized[i:i + self.ngram_size] for i in range(len(normalized) - self.ngram_size + 1)}
+
+    def signature(self, shingles: Set[str]) -> Tuple[int, ...]:
+        """計算MinHash簽章"""
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+            for shingle in shingles
+        ]
+        if not hashes:
+            return tuple([self._MAX_HASH] * self.num_perm)
+        return tuple(
+            min(((a * value + b) % self._MERSENNE_PRIME) & self._MAX_HASH for value in hashes)
+            for a, b in self._permutations
+        )
+
+
+class FirstTurnCache:
+    """首輪訊息相似度快取
+
+    只提供人工審核過的回答：各分類保存一組常見的首輪提問與核准的回答（由JSON檔載入），
+    模型即時產生的回答一律不保存，避免把某位用戶的個人化內容回給其他用戶。
+    新的首輪訊息以MinHash + LSH找出候選，再以n-gram的Jaccard相似度確認，
+    門檻預設0.95，帶有日期、對象等細節的提問因多出的n-gram而不會命中。
+    提供各分類的命中率統計與停用開關。
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        similarity_threshold: float = 0.95,
+        num_perm: int = 64,
+        bands: int = 16
+    ):
+        self.enabled = enabled
+        self.similarity_threshold = similarity_threshold
+
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+
+        # 分類 -> {正規化提問: 項目}
+        self._entries: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # 分類 -> {(band, band簽章): {正規化提問}}
+        self._index: Dict[str, Dict[Tuple[int, Tuple[int, ...]], Set[str]]] = {}
+
+        # 各分類統計
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def lookup(self, category_key: str, user_message: str) -> Optional[Tuple[str, float]]:
+        """查詢相似的核准提問，命中時回傳（核准的回答, 相似度）"""
+        if not self.enabled:
+            return None
+
+        stats = self._category_stats(category_key)
+        stats["lookups"] += 1
+
+        entries = self._entries.get(category_key)
+        shingles = self.hasher.shingles(user_message)
+        if not entries or not shingles:
+            stats["misses"] += 1
+            return None
+
+        signature = self.hasher.signature(shingles)
+        best_key, best_similarity = None, 0.0
+        for key in self._candidates(category_key, signature):
+            entry = entries[key]
+            similarity = len(shingles & entry["shingles"]) / len(shingles | entry["shingles"])
+            if similarity > best_similarity:
+                best_key, best_similarity = key, similarity
+
+        if best_key is None or best_similarity < self.similarity_threshold:
+            stats["misses"] += 1
+            return None
+
+        entries[best_key]["hits"] += 1
+        stats["hits"] += 1
+        return entries[best_key]["response"], best_similarity
+
+    def add_answer(self, category_key: str, message: str, response: str) -> bool:
+        """加入一組核准的提問與回答（只用於人工審核過的內容）"""
+        shingles = self.hasher.shingles(message)
+        if not shingles or not response or not response.strip():
+            return False
+
+        key = self.hasher.normalize(message)
+        entries = self._entries.setdefault(category_key, {})
+        if key in entries:
+            self._remove(category_key, key)
+
+        signature = self.hasher.signature(shingles)
+        entries[key] = {
+            "shingles": shingles,
+            "signature": signature,
+            "response": response.strip(),
+            "hits": 0
+        }
+        index = self._index.setdefault(category_key, {})
+        for band in self._bands(signature):
+            index.setdefault(band, set()).add(key)
+        return True
+
+    def load_answers(self, answers: Dict[str, List[Dict[str, str]]]) -> int:
+        """載入核准的回答（{分類: [{"message": 提問, "response": 回答}]}），回傳載入的筆數"""
+        loaded = 0
+        for category_key, items in answers.items():
+            for item in items:
+                if self.add_answer(category_key, item.get("message", ""), item.get("response", "")):
+                    loaded += 1
+        return loaded
+
+    def load_file(self, path: str) -> int:
+        """由JSON檔載入核准的回答，失敗時不提供任何快取回答"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                loaded = self.load_answers(json.load(f))
+            print(f"已載入 {loaded} 筆首輪核准回答")
+            return loaded
+        except Exception as e:
+            print(f"載入首輪核准回答失敗: {e}")
+            return 0
+
+    def clear(self, category_key: Optional[str] = None):
+        """清除核准的回答（分類的Prompt更新、回答需要重新審核時使用）"""
+        for bucket in list(self._entries):
+            if category_key is None or bucket == category_key:
+                self._entries.pop(bucket, None)
+                self._index.pop(bucket, None)
+
+    def _bands(self, signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+        """將簽章切成LSH band"""
+        rows = self.rows_per_band
+        return [(band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    def _candidates(self, category_key: str, signature: Tuple[int, ...]) -> Set[str]:
+        """找出至少一個band相同的候選項目"""
+        index = self._index.get(category_key, {})
+        candidates: Set[str] = set()
+        for band in self._bands(signature):
+            candidates |= index.get(band, set())
+        return candidates
+
+    def _remove(self, category_key: str, key: str):
+        entry = self._entries.get(category_key, {}).pop(key, None)
+        if entry is None:
+            return
+        index = self._index.get(category_key, {})
+        for band in self._bands(entry["signature"]):
+            keys = index.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[band]
+
+    def _category_stats(self, category_key: str) -> Dict[str, int]:
+        return self._stats.setdefault(category_key, {"lookups": 0, "hits": 0, "misses": 0})
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取各分類的命中率統計"""
+        by_category = {
+            category_key: {
+                **stats,
+                "hit_rate": stats["hits"] / stats["lookups"] if stats["lookups"] else 0
+            }
+            for category_key, stats in self._stats.items()
+        }
+        lookups = sum(stats["lookups"] for stats in self._stats.values())
+        hits = sum(stats["hits"] for stats in self._stats.values())
+        return {
+            "enabled": self.enabled,
+            "similarity_threshold": self.similarity_threshold,
+            "entries": sum(len(entries) for entries in self._entries.values()),
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": hits / lookups if lookups else 0,
+            "by_category": by_category,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+
+_first_turn_cache: Optional[FirstTurnCache] = None
+
+
+def get_first_turn_cache(settings: Settings) -> FirstTurnCache:
+    """獲取行程共用的首輪訊息相似度快取（只含semantic_cache_answers_path的核准回答）"""
+    global _first_turn_cache
+    if _first_turn_cache is None:
+        _first_turn_cache = FirstTurnCache(
+            enabled=settings.semantic_cache_enabled,
+            similarity_threshold=settings.semantic_cache_similarity_threshold
+        )
+        if settings.semantic_cache_enabled and settings.semantic_cache_answers_path:
+            _first_turn_cache.load_file(settings.semantic_cache_answers_path)
+    return _first_turn_cache
@@ -0,0 +1,158 @@
+"""
+Token計數
+"""
+import base64
+import hashlib
+import math
+import os
+import re
+from typing import List, Dict, Any, Optional, Iterable
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - 未安裝時使用估算
+    tiktoken = None
+
+
+# 隨程式碼附帶的BPE詞表（離線可用，不需在執行時下載）
+VOCAB_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "resources", "tiktoken")
+
+# cl100k_base（gpt-3.5-turbo / gpt-4 系列）
+CL100K_BASE = {
+    "name": "cl100k_base",
+    "file": "cl100k_base.tiktoken",
+    "sha256": "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7",
+    "pat_str": r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+""",
+    "special_tokens": {
+        "<|endoftext|>": 100257,
+        "<|fim_prefix|>": 100258,
+        "<|fim_middle|>": 100259,
+        "<|fim_suffix|>": 100260,
+        "<|endofprompt|>": 100276,
+    },
+}
+
+# 模型名稱前綴 -> 編碼（未列出的模型使用cl100k_base）
+MODEL_ENCODINGS = (
+    ("gpt-4o", "o200k_base"),
+    ("gpt-4.1", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("o3", "o200k_base"),
+    ("o4", "o200k_base"),
+)
+
+# 中日韓文字（估算時每字約1個token）
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+class TokenCounter:
+    """Token計數器
+
+    使用附帶的cl100k_base詞表以tiktoken計算token數；
+    詞表或tiktoken無法使用時退回以正規表示式估算。
+    只附帶cl100k_base：gpt-4o系列等使用o200k_base的模型同樣以cl100k_base計算，
+    結果只是近似值（中日韓文字差異最大），呼叫端應以is_exact判斷是否需要預留餘裕。
+    """
+
+    # Chat Completions每則訊息的格式開銷與回應前綴
+    TOKENS_PER_MESSAGE = 3
+    TOKENS_PER_REPLY = 3
+
+    def __init__(self, vocab_dir: str = VOCAB_DIR):
+        self.vocab_dir = vocab_dir
+        self._encoding = self._load_encoding()
+
+    @property
+    def backend(self) -> str:
+        """目前使用的計數方式"""
+        return "tiktoken" if self._encoding is not None else "heuristic"
+
+    @staticmethod
+    def encoding_for_model(model: str) -> str:
+        """模型使用的編碼名稱"""
+        for prefix, encoding_name in MODEL_ENCODINGS:
+            if model.startswith(prefix):
+                return encoding_name
+        return CL100K_BASE["name"]
+
+    def is_exact(self, model: str) -> bool:
+        """計算結果是否與模型實際的token數一致（以tiktoken計算且模型使用附帶的編碼）"""
+        return self._encoding is not None and self.encoding_for_model(model) == CL100K_BASE["name"]
+
+    def count(self, text: Optional[str]) -> int:
+        """計算文本的token數"""
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode_ordinary(text))
+        return self._estimate(text)
+
+    def count_many(self, texts: Iterable[Optional[str]]) -> List[int]:
+        """批次計算多段文本的token數"""
+        texts = [text or "" for text in texts]
+        if self._encoding is not None:
+            return [len(tokens) for tokens in self._encoding.encode_ordinary_batch(texts)]
+        return [self._estimate(text) if text else 0 for text in texts]
+
+    def count_history(self, messages: List[Any]) -> List[int]:
+        """計算歷史訊息的token數（優先使用已存的token_count，其餘批次計算）"""
+        missing = [message.content for message in messages if getattr(message, "token_count", None) is None]
+        counted = iter(self.count_many(missing))
+        return [
+            message.token_count if getattr(message, "token_count", None) is not None else next(counted)
+            for message in messages
+        ]
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """計算整個Chat訊息列表的輸入token數（包含格式開銷）"""
+        if not messages:
+            return 0
+        contents = self.count_many(message.get("content") for message in messages)
+        return sum(contents) + self.TOKENS_PER_MESSAGE * len(messages) + self.TOKENS_PER_REPLY
+
+    def _load_encoding(self):
+        """載入附帶的BPE詞表"""
+        if tiktoken is None:
+            print("未安裝tiktoken，改用估算token數")
+            return None
+
+        path = os.path.join(self.vocab_dir, CL100K_BASE["file"])
+        try:
+            with open(path, "rb") as f:
+                contents = f.read()
+            digest = hashlib.sha256(contents).hexdigest()
+            if digest != CL100K_BASE["sha256"]:
+                raise ValueError(f"詞表雜湊不符: {digest}")
+
+            # 詞表格式：每行「base64編碼的token 排名」
+            mergeable_ranks = {
+                base64.b64decode(token): int(rank)
+                for token, rank in (line.split() for line in contents.splitlines() if line)
+            }
+            return tiktoken.Encoding(
+                name=CL100K_BASE["name"],
+                pat_str=CL100K_BASE["pat_str"],
+                mergeable_ranks=mergeable_ranks,
+                special_tokens=CL100K_BASE["special_tokens"]
+            )
+        except Exception as e:
+            print(f"載入token詞表失敗，改用估算token數: {e}")
+            return None
+
+    @staticmethod
+    def _estimate(text: str) -> int:
+        """估算token數：中日韓文字每字約1個token，其他字元約4個字元1個token"""
+        cjk_chars = len(_CJK_PATTERN.findall(text))
+        other_chars = len(text) - cjk_chars
+        return max(cjk_chars + math.ceil(other_chars / 4), 1)
+
+
+_token_counter: Optional[TokenCounter] = None
+
+
+def get_token_counter() -> TokenCounter:
+    """獲取行程共用的token計數器（詞表只載入一次）"""
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = TokenCounter()
+    return _token_counter
@@ -0,0 +1,61 @@
+"""
+工作單元
+"""
+from typing import Optional
+
+from app.core.config import Settings
+from app.core.database import AsyncSessionLocal
+from app.services.ai_service import AIService
+from app.services.ai_manager import AIManager
+from app.services.conversation_state_cache import ConversationStateCache
+from app.services.conversation_summarizer import ConversationSummarizer
+from app.services.message_log import MessageWriteBehindLog
+
+
+class UnitOfWork:
+    """工作單元
+
+    每個事件從連線池取出獨立的資料庫會話，並以此會話建立
+    AIManager、ConversationService、PromptService；結束時回滾未提交的變更並歸還連線。
+
+    使用方式：
+        async with UnitOfWork(settings, ai_service) as uow:
+            await uow.ai_manager.process_user_message(...)
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        ai_service: Optional[AIService] = None,
+        state_cache: Optional[ConversationStateCache] = None,
+        summarizer: Optional[ConversationSummarizer] = None,
+        message_log: Optional[MessageWriteBehindLog] = None
+    ):
+        self.settings = settings
+        self.ai_service = ai_service
+        self.state_cache = state_cache
+        self.summarizer = summarizer
+        self.message_log = message_log
+        self.db_session = None
+        self.ai_manager: Optional[AIManager] = None
+
+    async def __aenter__(self) -> "UnitOfWork":
+        self.db_session = AsyncSessionLocal()
+        self.ai_manager = AIManager(
+            self.db_session,
+            self.settings,
+            ai_service=self.ai_service,
+            state_cache=self.state_cache,
+            summarizer=self.summarizer,
+            message_log=self.message_log
+        )
+        self.conversation_service = self.ai_manager.conversation_service
+        self.prompt_service = self.ai_manager.prompt_service
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is not None:
+                await self.db_session.rollback()
+        finally:
+            await self.db_session.close()
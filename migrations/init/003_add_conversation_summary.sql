@@ -0,0 +1,9 @@
+-- 思考機器人資料庫擴展腳本
+-- 新增會話滾動摘要欄位
+
+-- 已摘要的對話內容（較舊的訊息摺疊為摘要，之後只送摘要＋最近訊息）
+ALTER TABLE conversations ADD COLUMN summary TEXT;
+-- 摘要涵蓋到的最後一則訊息時間
+ALTER TABLE conversations ADD COLUMN summarized_until TIMESTAMP WITH TIME ZONE;
+-- 摘要涵蓋的訊息數
+ALTER TABLE conversations ADD COLUMN summary_message_count INTEGER NOT NULL DEFAULT 0;
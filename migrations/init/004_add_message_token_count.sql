@@ -0,0 +1,5 @@
+-- 思考機器人資料庫擴展腳本
+-- 新增訊息token數欄位
+
+-- 訊息內容本身的token數（寫入時計算，組裝上下文時不必重新斷詞）
+ALTER TABLE messages ADD COLUMN token_count INTEGER;
@@ -0,0 +1,16 @@
+-- 思考機器人資料庫擴展腳本
+-- 訊息歷史與進行中對話查詢的複合索引
+
+-- 最近訊息與歷史分頁（游標為 created_at, id）只需沿索引掃描一頁，不必排序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_conversation_created_desc
+    ON messages(conversation_id, created_at DESC, id DESC);
+
+-- 查詢用戶進行中的對話（依最後活動時間）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_user_status_activity
+    ON conversations(user_id, status, last_activity_at DESC);
+
+-- 以下索引是上面複合索引的前綴，移除以減少寫入成本
+DROP INDEX CONCURRENTLY IF EXISTS idx_messages_conversation_created;
+DROP INDEX CONCURRENTLY IF EXISTS idx_messages_conversation_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_conversations_user_status;
+DROP INDEX CONCURRENTLY IF EXISTS idx_conversations_user_id;
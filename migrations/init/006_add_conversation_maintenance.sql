@@ -0,0 +1,14 @@
+-- 思考機器人資料庫擴展腳本
+-- 對話維護工作（過期、封存）
+
+-- 允許封存狀態（先以NOT VALID加入約束，再另外驗證，避免長時間鎖表）
+ALTER TABLE conversations DROP CONSTRAINT IF EXISTS conversations_status_check;
+ALTER TABLE conversations ADD CONSTRAINT conversations_status_check
+    CHECK (status IN ('active', 'expired', 'reset', 'archived')) NOT VALID;
+ALTER TABLE conversations VALIDATE CONSTRAINT conversations_status_check;
+
+-- 維護工作依最後活動時間分批掃描指定狀態的對話
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_active_last_activity
+    ON conversations(last_activity_at) WHERE status = 'active';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_expired_last_activity
+    ON conversations(last_activity_at) WHERE status = 'expired';
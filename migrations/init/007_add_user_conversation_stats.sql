@@ -0,0 +1,165 @@
+-- 思考機器人資料庫擴展腳本
+-- 每位用戶的對話統計彙總表（由觸發器增量維護，統計查詢只需讀取一列）
+
+CREATE TABLE IF NOT EXISTS user_conversation_stats (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    total_conversations INTEGER NOT NULL DEFAULT 0,
+    active_conversations INTEGER NOT NULL DEFAULT 0,
+    expired_conversations INTEGER NOT NULL DEFAULT 0,
+    reset_conversations INTEGER NOT NULL DEFAULT 0,
+    archived_conversations INTEGER NOT NULL DEFAULT 0,
+    total_messages BIGINT NOT NULL DEFAULT 0,
+    total_tokens BIGINT NOT NULL DEFAULT 0,
+    -- 分類/模型 -> 對話數
+    by_category JSONB NOT NULL DEFAULT '{}'::jsonb,
+    by_model JSONB NOT NULL DEFAULT '{}'::jsonb,
+    last_activity_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 調整JSONB計數（歸零時移除該鍵）
+CREATE OR REPLACE FUNCTION increment_jsonb_count(counts JSONB, count_key TEXT, delta INTEGER)
+RETURNS JSONB AS $$
+    SELECT CASE
+        WHEN count_key IS NULL OR delta = 0 THEN counts
+        WHEN COALESCE((counts ->> count_key)::INTEGER, 0) + delta <= 0 THEN counts - count_key
+        ELSE jsonb_set(counts, ARRAY[count_key], to_jsonb(COALESCE((counts ->> count_key)::INTEGER, 0) + delta))
+    END
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- 將一筆對話的增減套用到用戶統計
+CREATE OR REPLACE FUNCTION adjust_user_conversation_stats(
+    p_user_id UUID,
+    p_status TEXT,
+    p_category_key TEXT,
+    p_ai_model TEXT,
+    p_conversations INTEGER,
+    p_messages INTEGER,
+    p_tokens INTEGER,
+    p_last_activity_at TIMESTAMP WITH TIME ZONE
+)
+RETURNS VOID AS $$
+BEGIN
+    -- 新增對話時才建立統計列（刪除用戶時不會重新建立）
+    IF p_conversations > 0 THEN
+        INSERT INTO user_conversation_stats (user_id) VALUES (p_user_id)
+        ON CONFLICT (user_id) DO NOTHING;
+    END IF;
+
+    UPDATE user_conversation_stats SET
+        total_conversations = total_conversations + p_conversations,
+        active_conversations = active_conversations + CASE WHEN p_status = 'active' THEN p_conversations ELSE 0 END,
+        expired_conversations = expired_conversations + CASE WHEN p_status = 'expired' THEN p_conversations ELSE 0 END,
+        reset_conversations = reset_conversations + CASE WHEN p_status = 'reset' THEN p_conversations ELSE 0 END,
+        archived_conversations = archived_conversations + CASE WHEN p_status = 'archived' THEN p_conversations ELSE 0 END,
+        total_messages = total_messages + p_messages,
+        total_tokens = total_tokens + p_tokens,
+        by_category = increment_jsonb_count(by_category, p_category_key, p_conversations),
+        by_model = increment_jsonb_count(by_model, p_ai_model, p_conversations),
+        last_activity_at = GREATEST(last_activity_at, p_last_activity_at),
+        updated_at = NOW()
+    WHERE user_id = p_user_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION maintain_user_conversation_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- 一般的對話輪次只改變計數，以單一UPDATE套用差額
+    IF TG_OP = 'UPDATE'
+        AND OLD.user_id = NEW.user_id
+        AND OLD.status = NEW.status
+        AND OLD.category_key IS NOT DISTINCT FROM NEW.category_key
+        AND OLD.ai_model = NEW.ai_model
+    THEN
+        IF NEW.message_count <> OLD.message_count
+            OR NEW.total_tokens <> OLD.total_tokens
+            OR NEW.last_activity_at > OLD.last_activity_at
+        THEN
+            PERFORM adjust_user_conversation_stats(
+                NEW.user_id, NEW.status, NEW.category_key, NEW.ai_model, 0,
+                NEW.message_count - OLD.message_count, NEW.total_tokens - OLD.total_tokens,
+                NEW.last_activity_at
+            );
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM adjust_user_conversation_stats(
+            OLD.user_id, OLD.status, OLD.category_key, OLD.ai_model, -1,
+            -OLD.message_count, -OLD.total_tokens, NULL
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM adjust_user_conversation_stats(
+            NEW.user_id, NEW.status, NEW.category_key, NEW.ai_model, 1,
+            NEW.message_count, NEW.total_tokens, NEW.last_activity_at
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 回填既有資料並建立觸發器（鎖定寫入，避免回填與觸發器之間漏算）
+BEGIN;
+LOCK TABLE conversations IN SHARE MODE;
+
+INSERT INTO user_conversation_stats (
+    user_id, total_conversations, active_conversations, expired_conversations,
+    reset_conversations, archived_conversations, total_messages, total_tokens,
+    by_category, by_model, last_activity_at
+)
+SELECT
+    totals.user_id,
+    totals.total_conversations,
+    totals.active_conversations,
+    totals.expired_conversations,
+    totals.reset_conversations,
+    totals.archived_conversations,
+    totals.total_messages,
+    totals.total_tokens,
+    COALESCE(categories.by_category, '{}'::jsonb),
+    COALESCE(models.by_model, '{}'::jsonb),
+    totals.last_activity_at
+FROM (
+    SELECT
+        user_id,
+        COUNT(*) AS total_conversations,
+        COUNT(*) FILTER (WHERE status = 'active') AS active_conversations,
+        COUNT(*) FILTER (WHERE status = 'expired') AS expired_conversations,
+        COUNT(*) FILTER (WHERE status = 'reset') AS reset_conversations,
+        COUNT(*) FILTER (WHERE status = 'archived') AS archived_conversations,
+        COALESCE(SUM(message_count), 0) AS total_messages,
+        COALESCE(SUM(total_tokens), 0) AS total_tokens,
+        MAX(last_activity_at) AS last_activity_at
+    FROM conversations
+    GROUP BY user_id
+) AS totals
+LEFT JOIN (
+    SELECT user_id, jsonb_object_agg(category_key, conversations) AS by_category
+    FROM (
+        SELECT user_id, category_key, COUNT(*) AS conversations
+        FROM conversations
+        WHERE category_key IS NOT NULL
+        GROUP BY user_id, category_key
+    ) AS category_counts
+    GROUP BY user_id
+) AS categories ON categories.user_id = totals.user_id
+LEFT JOIN (
+    SELECT user_id, jsonb_object_agg(ai_model, conversations) AS by_model
+    FROM (
+        SELECT user_id, ai_model, COUNT(*) AS conversations
+        FROM conversations
+        GROUP BY user_id, ai_model
+    ) AS model_counts
+    GROUP BY user_id
+) AS models ON models.user_id = totals.user_id
+ON CONFLICT (user_id) DO NOTHING;
+
+DROP TRIGGER IF EXISTS maintain_user_conversation_stats ON conversations;
+CREATE TRIGGER maintain_user_conversation_stats
+    AFTER INSERT OR UPDATE OR DELETE ON conversations
+    FOR EACH ROW EXECUTE FUNCTION maintain_user_conversation_stats();
+
+COMMIT;
@@ -0,0 +1,148 @@
+-- 思考機器人資料庫擴展腳本
+-- messages改為依created_at按月分區（原生range partitioning）
+--
+-- 分區表的主鍵必須包含分區鍵，主鍵改為(id, created_at)；訊息id仍由uuid保證唯一。
+-- 保留期限外的訊息以卸離（DETACH）或刪除整個分區處理，不需要大量DELETE與VACUUM。
+-- 之後的分區由應用程式的維護工作預先建立（見MessagePartitionManager）。
+--
+-- 既有的messages不複製資料，而是整個掛為歷史分區messages_legacy（created_at早於邊界月份的訊息）：
+-- 需要的索引與分區範圍CHECK都在不阻擋讀寫的步驟中先建立、驗證，
+-- 真正需要ACCESS EXCLUSIVE鎖的只有改名、建立空的父表與不需掃描的ATTACH，約數毫秒。
+-- 各步驟之間以工作階段設定傳遞邊界，請以psql -f在同一個連線中執行整個檔案。
+
+-- 建立指定月份的分區，回傳從預設分區移入的訊息數；分區已存在或月份已被其他分區涵蓋時回傳NULL
+CREATE OR REPLACE FUNCTION create_messages_partition(month_start DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    partition_start DATE := date_trunc('month', month_start)::DATE;
+    partition_end DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::DATE;
+    partition_name TEXT := format('messages_p%s', to_char(partition_start, 'YYYYMM'));
+    -- 分區邊界以UTC計算，與工作階段的時區設定無關
+    lower_bound TEXT := partition_start::TEXT || ' 00:00:00+00';
+    upper_bound TEXT := partition_end::TEXT || ' 00:00:00+00';
+    moved INTEGER := 0;
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    BEGIN
+        -- 先建立獨立的資料表，移入預設分區中屬於該月份的訊息後再掛上
+        -- （預設分區有該月份的訊息時，直接CREATE ... PARTITION OF會失敗）
+        EXECUTE format(
+            'CREATE TABLE %I (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name
+        );
+        IF to_regclass('messages_default') IS NOT NULL THEN
+            EXECUTE format(
+                'WITH moved AS (
+                    DELETE FROM messages_default WHERE created_at >= %L AND created_at < %L RETURNING *
+                )
+                INSERT INTO %I SELECT * FROM moved',
+                lower_bound, upper_bound, partition_name
+            );
+            GET DIAGNOSTICS moved = ROW_COUNT;
+            IF moved > 0 THEN
+                RAISE WARNING '預設分區中有 % 則 % 的訊息，已移入新分區', moved, partition_name;
+            END IF;
+        END IF;
+        EXECUTE format(
+            'ALTER TABLE messages ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            partition_name, lower_bound, upper_bound
+        );
+    EXCEPTION WHEN invalid_object_definition THEN
+        -- 月份已被其他分區涵蓋（例如遷移時掛上的歷史分區），整個區塊復原
+        RETURN NULL;
+    END;
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 1. 補上缺少的created_at（欄位預設為CURRENT_TIMESTAMP，通常沒有）
+UPDATE messages SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+
+-- 2. 不鎖表建立新主鍵對應的唯一索引（ATTACH時直接沿用，其餘索引與父表定義相同，也會沿用）
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS messages_legacy_id_created_at_key ON messages(id, created_at);
+
+-- 3. 歷史分區的上界為下下個月的月初（留出遷移期間跨月的餘裕），新增的訊息同樣受此CHECK限制
+SET lock_timeout = '5s';
+DO $$
+BEGIN
+    PERFORM set_config(
+        'messages_partition.legacy_boundary',
+        (date_trunc('month', NOW() AT TIME ZONE 'UTC') + INTERVAL '2 months')::DATE::TEXT || ' 00:00:00+00',
+        false
+    );
+    EXECUTE format(
+        'ALTER TABLE messages ADD CONSTRAINT messages_legacy_partition_check
+            CHECK (created_at IS NOT NULL AND created_at < %L) NOT VALID',
+        current_setting('messages_partition.legacy_boundary')
+    );
+END $$;
+
+-- 4. 驗證CHECK（只取得SHARE UPDATE EXCLUSIVE鎖，不阻擋讀寫）
+ALTER TABLE messages VALIDATE CONSTRAINT messages_legacy_partition_check;
+
+-- 5. 短暫鎖表切換：改名、建立分區父表並掛上歷史分區（有已驗證的CHECK，SET NOT NULL與ATTACH都不需掃描）
+BEGIN;
+LOCK TABLE messages IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE messages RENAME TO messages_legacy;
+ALTER INDEX idx_messages_conversation_created_desc RENAME TO idx_messages_legacy_conversation_created_desc;
+ALTER INDEX idx_messages_created_at RENAME TO idx_messages_legacy_created_at;
+ALTER INDEX idx_messages_type RENAME TO idx_messages_legacy_type;
+ALTER INDEX idx_messages_tokens RENAME TO idx_messages_legacy_tokens;
+ALTER TABLE messages_legacy ALTER COLUMN created_at SET NOT NULL;
+-- 主鍵改為(id, created_at)，直接使用步驟2建立的唯一索引（ATTACH只沿用有對應約束的索引）
+ALTER TABLE messages_legacy DROP CONSTRAINT messages_pkey;
+ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY USING INDEX messages_legacy_id_created_at_key;
+
+CREATE TABLE messages (
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    conversation_id UUID CONSTRAINT messages_conversation_id_fkey REFERENCES conversations(id) ON DELETE CASCADE,
+    message_type VARCHAR(20) NOT NULL CONSTRAINT messages_message_type_check CHECK (message_type IN ('user', 'assistant')),
+    content TEXT NOT NULL,
+    tokens_used INTEGER,
+    processing_time_ms INTEGER,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    token_count INTEGER,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- 在父表建立索引，自動套用到每個分區
+CREATE INDEX idx_messages_conversation_created_desc ON messages(conversation_id, created_at DESC, id DESC);
+CREATE INDEX idx_messages_created_at ON messages(created_at);
+CREATE INDEX idx_messages_type ON messages(message_type);
+CREATE INDEX idx_messages_tokens ON messages(tokens_used) WHERE tokens_used IS NOT NULL;
+
+DO $$
+BEGIN
+    EXECUTE format(
+        'ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+        current_setting('messages_partition.legacy_boundary')
+    );
+END $$;
+
+-- 沒有對應分區的訊息（例如時間異常）放入預設分區，建立該月份分區時再移出
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+COMMIT;
+
+RESET lock_timeout;
+
+-- 6. 建立歷史分區之後到未來3個月的分區
+DO $$
+DECLARE
+    month_start TIMESTAMP;
+BEGIN
+    FOR month_start IN
+        SELECT generate_series(
+            current_setting('messages_partition.legacy_boundary')::TIMESTAMPTZ AT TIME ZONE 'UTC',
+            date_trunc('month', NOW() AT TIME ZONE 'UTC') + INTERVAL '3 months',
+            INTERVAL '1 month'
+        )
+    LOOP
+        PERFORM create_messages_partition(month_start::DATE);
+    END LOOP;
+END $$;
+
+ANALYZE messages;
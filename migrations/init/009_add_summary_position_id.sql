@@ -0,0 +1,10 @@
+-- 思考機器人資料庫擴展腳本
+-- 摘要涵蓋位置改為完整的(created_at, id)，同一時間的多則訊息不會被略過或重複摘要
+
+-- 摘要涵蓋到的最後一則訊息id（與summarized_until一起比較）
+ALTER TABLE conversations ADD COLUMN summarized_until_id UUID;
+
+-- 既有的摘要原本涵蓋summarized_until當下的所有訊息，以最大的UUID回填維持相同的範圍
+UPDATE conversations
+SET summarized_until_id = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+WHERE summarized_until IS NOT NULL AND summarized_until_id IS NULL;
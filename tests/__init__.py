@@ -0,0 +1 @@
+# 思考機器人測試
@@ -0,0 +1,189 @@
+"""
+斷路器與自適應並發限制測試
+"""
+import asyncio
+
+import pytest
+
+from app.core.circuit_breaker import AdaptiveConcurrencyLimiter, CircuitBreaker
+from app.core.exceptions import CircuitOpenError, ConcurrencyLimitError
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def make_breaker(**kwargs):
+    options = {
+        "failure_rate_threshold": 0.5,
+        "minimum_calls": 4,
+        "window_seconds": 60,
+        "open_seconds": 60,
+        "half_open_max_calls": 2,
+        "is_failure": lambda error: isinstance(error, UpstreamError)
+    }
+    options.update(kwargs)
+    return CircuitBreaker("測試", **options)
+
+
+def test_breaker_opens_after_failure_rate_threshold():
+    breaker = make_breaker()
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_success()
+    breaker.before_call()
+    breaker.record_failure(UpstreamError())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.before_call()
+    breaker.record_failure(UpstreamError())
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.rejected_count == 1
+
+
+def test_breaker_ignores_non_upstream_errors():
+    breaker = make_breaker()
+    for _ in range(10):
+        breaker.before_call()
+        breaker.record_failure(ValueError("bad input"))
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failure_count == 0
+
+
+def test_breaker_half_open_probes_close_or_reopen():
+    breaker = make_breaker(minimum_calls=1, open_seconds=0)
+    breaker.before_call()
+    breaker.record_failure(UpstreamError())
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # 冷卻結束後只放行half_open_max_calls個探測
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # 任一探測失敗即重新斷開
+    breaker.record_failure(UpstreamError())
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # 探測全部成功才恢復
+    breaker.before_call()
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.get_stats()["window_calls"] == 0
+
+
+@pytest.mark.asyncio
+async def test_breaker_guard_records_outcome():
+    breaker = make_breaker(minimum_calls=1)
+    async with breaker.guard():
+        pass
+    assert breaker.success_count == 1
+
+    with pytest.raises(UpstreamError):
+        async with breaker.guard():
+            raise UpstreamError()
+    assert breaker.failure_count == 1
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def make_limiter(**kwargs):
+    options = {
+        "initial_limit": 4,
+        "min_limit": 1,
+        "max_limit": 8,
+        "latency_tolerance": 2.0,
+        "baseline_min_samples": 3,
+        "backoff_ratio": 0.5,
+        "queue_timeout_seconds": 0.05,
+        "is_overload": lambda error: isinstance(error, UpstreamError)
+    }
+    options.update(kwargs)
+    return AdaptiveConcurrencyLimiter("測試", **options)
+
+
+@pytest.mark.asyncio
+async def test_limiter_increases_additively_on_success():
+    limiter = make_limiter()
+    for _ in range(4):
+        async with limiter.acquire():
+            pass
+    # 每次加1/limit，一輪（約limit次成功）加1
+    assert 4.9 < limiter.limit < 5
+    assert limiter.increase_count == 4
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_decreases_multiplicatively_once_per_batch():
+    limiter = make_limiter(initial_limit=8)
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def overloaded_call():
+        async with limiter.acquire():
+            started.set()
+            await release.wait()
+            raise UpstreamError()
+
+    tasks = [asyncio.create_task(overloaded_call()) for _ in range(3)]
+    await started.wait()
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    assert all(isinstance(result, UpstreamError) for result in results)
+    # 同一批在減少前就開始的請求只減少一次
+    assert limiter.limit == 4
+    assert limiter.decrease_count == 1
+    assert limiter.in_flight == 0
+
+
+def test_limiter_latency_is_compared_per_call_type_baseline():
+    limiter = make_limiter()
+
+    # 樣本不足時不以延遲判斷
+    assert not limiter._is_slow("coaching", 1.0)
+    for _ in range(3):
+        assert not limiter._is_slow("coaching", 1.0)
+        # 摘要原本就較長，不影響對話輔導的判斷
+        assert not limiter._is_slow("summary", 20.0)
+
+    assert not limiter._is_slow("coaching", 1.9)
+    assert limiter._is_slow("coaching", 2.5)
+    assert not limiter._is_slow("summary", 25.0)
+    assert limiter.get_stats()["latency_baseline_ms"]["summary"] >= 20000
+
+
+@pytest.mark.asyncio
+async def test_limiter_queues_and_rejects_over_limit():
+    limiter = make_limiter(initial_limit=1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with limiter.acquire():
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    assert limiter.in_flight == 1
+
+    with pytest.raises(ConcurrencyLimitError):
+        async with limiter.acquire():
+            pass
+    assert limiter.rejected_count == 1
+
+    waiter = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    assert limiter.get_stats()["queued"] == 1
+    release.set()
+    await asyncio.gather(holder, waiter)
+    assert limiter.in_flight == 0
+    assert limiter.queued_count == 2
@@ -0,0 +1,92 @@
+"""
+對話狀態快取測試
+"""
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Conversation
+from app.services.conversation_service import ConversationService
+from app.services.conversation_state_cache import ConversationStateCache
+
+
+class HashStore:
+    """只實作hgetall/delete的Redis替身"""
+
+    def __init__(self, data=None):
+        self.data = data or {}
+
+    async def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def make_conversation() -> Conversation:
+    now = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+    return Conversation(
+        id=uuid.uuid4(),
+        user_id=uuid.uuid4(),
+        selected_category_id=None,
+        status="active",
+        state="category_selected",
+        category_key="work",
+        ai_model="gpt-3.5-turbo",
+        message_count=4,
+        total_tokens=120,
+        summary="摘要",
+        summarized_until=now,
+        summary_message_count=2,
+        last_activity_at=now,
+        created_at=now,
+        updated_at=now
+    )
+
+
+@pytest.mark.asyncio
+async def test_cached_conversation_serializes_without_database():
+    cache = ConversationStateCache()
+    original = make_conversation()
+    state = cache._deserialize(cache._serialize(original))
+
+    session = AsyncSession()
+    try:
+        service = ConversationService(session, cache)
+        conversation = await service._attach_cached_conversation(state)
+
+        assert inspect(conversation).persistent
+        assert not inspect(conversation).unloaded.intersection(cache.FIELDS)
+        assert conversation.to_dict() == original.to_dict()
+    finally:
+        await session.close()
+
+
+@pytest.mark.asyncio
+async def test_incomplete_state_is_a_miss():
+    cache = ConversationStateCache()
+    conversation = make_conversation()
+    data = cache._serialize(conversation)
+    del data["created_at"]
+    cache.redis_client = HashStore({cache._key(str(conversation.user_id)): data})
+
+    assert await cache.get(str(conversation.user_id)) is None
+    assert cache.miss_count == 1
+    # 格式不符的快取被刪除，下次直接由資料庫讀取後重寫
+    assert cache.redis_client.data == {}
+
+
+@pytest.mark.asyncio
+async def test_complete_state_is_a_hit():
+    cache = ConversationStateCache()
+    conversation = make_conversation()
+    cache.redis_client = HashStore({cache._key(str(conversation.user_id)): cache._serialize(conversation)})
+
+    state = await cache.get(str(conversation.user_id))
+    assert state["id"] == conversation.id
+    assert state["created_at"] == conversation.created_at
+    assert cache.hit_count == 1
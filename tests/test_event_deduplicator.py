@@ -0,0 +1,65 @@
+"""
+Webhook事件去重測試
+"""
+import pytest
+
+from app.services.event_deduplicator import EventDeduplicator
+
+
+def make_event(event_id: str, redelivery: bool = False):
+    return {
+        "type": "message",
+        "webhookEventId": event_id,
+        "deliveryContext": {"isRedelivery": redelivery},
+        "source": {"type": "user", "userId": "U1"}
+    }
+
+
+@pytest.mark.asyncio
+async def test_duplicate_is_filtered_while_processing():
+    deduplicator = EventDeduplicator()
+    event = make_event("e1")
+
+    assert await deduplicator.filter_events([event]) == [event]
+    assert await deduplicator.filter_events([make_event("e1", redelivery=True)]) == []
+    assert deduplicator.duplicate_count == 1
+    assert deduplicator.redelivery_count == 1
+
+
+@pytest.mark.asyncio
+async def test_completed_event_stays_deduplicated():
+    deduplicator = EventDeduplicator(processing_ttl_seconds=0)
+    event = make_event("e1")
+
+    assert await deduplicator.filter_events([event]) == [event]
+    await deduplicator.complete(event)
+    assert await deduplicator.filter_events([event]) == []
+
+
+@pytest.mark.asyncio
+async def test_released_event_can_be_processed_again():
+    deduplicator = EventDeduplicator()
+    event = make_event("e1")
+
+    assert await deduplicator.filter_events([event]) == [event]
+    await deduplicator.release(event)
+    assert await deduplicator.filter_events([make_event("e1", redelivery=True)]) != []
+
+
+@pytest.mark.asyncio
+async def test_expired_processing_mark_allows_retry():
+    deduplicator = EventDeduplicator(processing_ttl_seconds=0)
+    event = make_event("e1")
+
+    assert await deduplicator.filter_events([event]) == [event]
+    # 處理中途行程終止：標記過期後重送的事件可以再處理
+    assert await deduplicator.filter_events([event]) == [event]
+
+
+@pytest.mark.asyncio
+async def test_events_without_id_are_not_deduplicated():
+    deduplicator = EventDeduplicator()
+    event = {"type": "follow", "source": {"type": "user", "userId": "U1"}}
+
+    assert await deduplicator.filter_events([event, event]) == [event, event]
+    assert deduplicator.checked_count == 0
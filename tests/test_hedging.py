@@ -0,0 +1,86 @@
+"""
+對沖請求測試
+"""
+import asyncio
+
+import pytest
+
+from app.core.hedging import RequestHedger
+
+
+def make_hedger(**kwargs):
+    options = {
+        "enabled": True,
+        "budget_ratio": 0.25,
+        "min_samples": 5,
+        "min_delay_seconds": 0.01,
+        "window_size": 1000
+    }
+    options.update(kwargs)
+    hedger = RequestHedger("測試", **options)
+    # 足夠多的快速樣本，測試中的慢請求不會拉高對沖延遲
+    for _ in range(500):
+        hedger._record("model", 0.001)
+    return hedger
+
+
+def slow_primary(calls, primary_seconds: float = 0.05):
+    async def factory(hedge: bool):
+        calls.append(hedge)
+        if hedge:
+            return "hedge"
+        try:
+            await asyncio.sleep(primary_seconds)
+        except asyncio.CancelledError:
+            calls.append("cancelled")
+            raise
+        return "primary"
+    return factory
+
+
+@pytest.mark.asyncio
+async def test_hedges_are_limited_by_budget():
+    hedger = make_hedger()
+    results = []
+    for _ in range(8):
+        results.append(await hedger.run("model", slow_primary([])))
+
+    # 每個請求累積0.25的額度，8個請求最多對沖2次
+    assert results.count("hedge") == 2
+    assert hedger.hedge_count == 2
+    assert hedger.budget_exhausted_count == 6
+    assert hedger.hedge_win_count == 2
+
+
+@pytest.mark.asyncio
+async def test_hedge_win_cancels_primary():
+    hedger = make_hedger(budget_ratio=1.0)
+    calls = []
+
+    assert await hedger.run("model", slow_primary(calls)) == "hedge"
+    await asyncio.sleep(0)
+    assert calls == [False, True, "cancelled"]
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_without_enough_samples_or_when_disabled():
+    hedger = make_hedger(budget_ratio=1.0)
+    calls = []
+    assert await hedger.run("other-model", slow_primary(calls, 0.02)) == "primary"
+    assert calls == [False]
+
+    disabled = make_hedger(enabled=False, budget_ratio=1.0)
+    assert await disabled.run("model", slow_primary([], 0.02)) == "primary"
+    assert disabled.request_count == 0
+
+
+@pytest.mark.asyncio
+async def test_primary_error_raised_when_both_fail():
+    hedger = make_hedger(budget_ratio=1.0)
+
+    async def factory(hedge: bool):
+        await asyncio.sleep(0.02 if not hedge else 0)
+        raise RuntimeError("hedge failed" if hedge else "primary failed")
+
+    with pytest.raises(RuntimeError, match="primary failed"):
+        await hedger.run("model", factory)
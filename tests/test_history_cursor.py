@@ -0,0 +1,34 @@
+"""
+分頁游標測試
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.core.exceptions import ValidationException
+from app.models import Conversation, Message
+from app.services.conversation_service import ConversationService
+
+
+def test_cursor_round_trip():
+    message = Message(
+        id=uuid.uuid4(),
+        created_at=datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone(timedelta(hours=8)))
+    )
+    cursor = ConversationService.encode_history_cursor(message)
+
+    assert ConversationService.decode_history_cursor(cursor) == (message.created_at, message.id)
+
+
+def test_cursor_accepts_conversation():
+    conversation = Conversation(id=uuid.uuid4(), created_at=datetime(2024, 5, 1, tzinfo=timezone.utc))
+    cursor = ConversationService.encode_history_cursor(conversation)
+
+    assert ConversationService.decode_history_cursor(cursor) == (conversation.created_at, conversation.id)
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "aGVsbG8=", "MjAyNC0wNS0wMXxub3QtYS11dWlk"])
+def test_invalid_cursor_raises_validation_error(cursor):
+    with pytest.raises(ValidationException):
+        ConversationService.decode_history_cursor(cursor)
@@ -0,0 +1,70 @@
+"""
+LINE API客戶端重試測試
+"""
+import time
+
+import httpx
+import pytest
+
+from app.adapters.line_client import AsyncLineClient
+from app.core.exceptions import LineApiError
+
+
+def make_client(responses, **kwargs):
+    """依序回傳responses中的狀態碼（與標頭）"""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        status_code, headers = responses[min(len(calls), len(responses)) - 1]
+        return httpx.Response(status_code, headers=headers, json={})
+
+    client = AsyncLineClient("token", backoff_base_seconds=0, **kwargs)
+    client._client = httpx.AsyncClient(
+        base_url=AsyncLineClient.API_BASE_URL, transport=httpx.MockTransport(handler)
+    )
+    return client, calls
+
+
+@pytest.mark.asyncio
+async def test_reply_is_not_retried_on_server_error():
+    client, calls = make_client([(500, {}), (200, {})])
+
+    with pytest.raises(LineApiError):
+        await client.reply_message("reply-token", [{"type": "text", "text": "hi"}])
+    assert calls == ["/v2/bot/message/reply"]
+    assert client.retry_count == 0
+
+
+@pytest.mark.asyncio
+async def test_reply_is_retried_on_rate_limit():
+    client, calls = make_client([(429, {"Retry-After": "0"}), (200, {})])
+
+    await client.reply_message("reply-token", [{"type": "text", "text": "hi"}])
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_push_is_retried_on_server_error():
+    client, calls = make_client([(503, {}), (502, {}), (200, {})])
+
+    await client.push_message("U1", [{"type": "text", "text": "hi"}])
+    assert len(calls) == 3
+    assert client.retry_count == 2
+
+
+@pytest.mark.asyncio
+async def test_retry_after_beyond_deadline_fails_fast():
+    client, calls = make_client([(429, {"Retry-After": "3600"}), (200, {})], retry_deadline_seconds=5)
+
+    start = time.monotonic()
+    with pytest.raises(LineApiError):
+        await client.push_message("U1", [{"type": "text", "text": "hi"}])
+    assert time.monotonic() - start < 1
+    assert len(calls) == 1
+
+    # reply的期限為reply token剩餘的有效時間
+    client, calls = make_client([(429, {"Retry-After": "2"}), (200, {})])
+    with pytest.raises(LineApiError):
+        await client.reply_message("reply-token", [{"type": "text", "text": "hi"}], deadline_seconds=1)
+    assert len(calls) == 1
@@ -0,0 +1,131 @@
+"""
+訊息寫入緩衝測試
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.models import Message
+from app.services.message_log import MessageWriteBehindLog
+
+BASE_TIME = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def make_message(content: str, seconds: int) -> Message:
+    return Message(
+        id=uuid.uuid4(),
+        conversation_id=uuid.UUID(int=1),
+        message_type="user",
+        content=content,
+        created_at=BASE_TIME + timedelta(seconds=seconds)
+    )
+
+
+def test_merge_without_pending_returns_database_rows():
+    messages = [make_message("a", 1)]
+    assert MessageWriteBehindLog.merge(messages, []) is messages
+
+
+def test_merge_deduplicates_and_orders_newest_first():
+    stored = [make_message("b", 2), make_message("a", 1)]
+    pending = [stored[0], make_message("c", 3)]
+
+    merged = MessageWriteBehindLog.merge(stored, pending, limit=2)
+
+    assert [message.content for message in merged] == ["c", "b"]
+
+
+def test_merge_applies_after_and_before_filters():
+    stored = [make_message("b", 2)]
+    pending = [make_message("a", 1), make_message("c", 3), make_message("d", 4)]
+    cursor = pending[2]
+
+    merged = MessageWriteBehindLog.merge(
+        stored, pending,
+        after=(pending[0].created_at, pending[0].id),
+        before=(cursor.created_at, cursor.id),
+        newest_first=False
+    )
+
+    assert [message.content for message in merged] == ["b", "c"]
+
+
+def test_merge_treats_naive_filters_as_utc():
+    pending = [make_message("a", 1), make_message("b", 2)]
+
+    merged = MessageWriteBehindLog.merge([], pending, after=(datetime(2024, 5, 1, 12, 0, 1), pending[0].id))
+
+    assert [message.content for message in merged] == ["b"]
+
+
+def test_merge_after_keeps_messages_with_same_timestamp():
+    boundary, same_time = make_message("a", 1), make_message("b", 1)
+    boundary.id, same_time.id = uuid.UUID(int=1), uuid.UUID(int=2)
+
+    merged = MessageWriteBehindLog.merge(
+        [], [same_time, boundary], after=(boundary.created_at, boundary.id)
+    )
+
+    assert [message.content for message in merged] == ["b"]
+
+
+@pytest.mark.asyncio
+async def test_append_without_redis_falls_back():
+    log = MessageWriteBehindLog()
+
+    assert not log.enabled
+    assert await log.append([make_message("a", 1)]) is None
+    assert await log.pending_messages(uuid.UUID(int=1)) == []
+
+
+class StubPipeline:
+    def __init__(self, commands):
+        self.commands = commands
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args))
+
+    async def execute(self):
+        return [0] * len(self.commands)
+
+
+class StubRedis:
+    def __init__(self, claimed):
+        self.claimed = claimed
+        self.commands = []
+
+    def pipeline(self, transaction=True):
+        return StubPipeline(self.commands)
+
+    async def xautoclaim(self, *args, **kwargs):
+        return ["0-0", self.claimed, []]
+
+    async def xreadgroup(self, *args, **kwargs):
+        return []
+
+
+@pytest.mark.asyncio
+async def test_claimed_entries_are_restored_to_pending_hash():
+    log = MessageWriteBehindLog(pending_ttl_seconds=600)
+    message = make_message("a", 1)
+    data = log._serialize(message)
+    log.redis_client = StubRedis([("1-0", {"message": data})])
+    log._group_ready = True
+    written = []
+
+    async def write(messages):
+        written.extend(messages)
+        return len(messages)
+
+    log._write = write
+    assert await log.flush_once() == 1
+
+    pending_key = log._pending_key(message.conversation_id)
+    # 接手時重新寫入待寫入hash並延長TTL，寫入資料庫後才移除
+    commands = log.redis_client.commands
+    assert commands.index(("hset", (pending_key, str(message.id), data))) < commands.index(
+        ("hdel", (pending_key, str(message.id)))
+    )
+    assert ("expire", (pending_key, 600)) in commands
+    assert [item["id"] for item in written] == [str(message.id)]
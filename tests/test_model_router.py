@@ -0,0 +1,92 @@
+"""
+模型路由測試
+"""
+import pytest
+
+from app.core.config import Settings
+from app.services.model_router import ModelRouter
+
+
+def make_router(**kwargs):
+    options = {
+        "openai_model": "gpt-4",
+        "greeting_model": "gpt-3.5-turbo",
+        "summary_model": "gpt-3.5-turbo",
+        "coaching_model": None,
+        "fallback_model": "gpt-3.5-turbo",
+        "default_ai_model": "chatgpt",
+        "ai_model_aliases": {"fast": "gpt-3.5-turbo"},
+        "routing_health_min_samples": 4,
+        "routing_failover_error_rate": 0.3,
+        "routing_failover_p95_latency_ms": 1000,
+        "routing_failover_cooldown_seconds": 60
+    }
+    options.update(kwargs)
+    return ModelRouter(Settings(**options))
+
+
+def test_select_by_call_type_and_alias():
+    router = make_router()
+    assert router.select("greeting") == "gpt-3.5-turbo"
+    assert router.select("coaching") == "gpt-4"
+    assert router.select("coaching", "chatgpt") == "gpt-4"
+    assert router.select("coaching", "fast") == "gpt-3.5-turbo"
+    assert router.conversation_model("chatgpt") == "gpt-4"
+    assert router.conversation_model("fast") == "gpt-3.5-turbo"
+
+
+def test_fails_over_on_error_rate_and_returns_after_cooldown():
+    router = make_router()
+    for success in (True, False, False, True):
+        router.record("gpt-4", 100, success=success)
+    assert router.select("coaching") == "gpt-3.5-turbo"
+    assert router.failover_count == 1
+
+    # 冷卻結束後以全新的統計回到主要模型
+    router._failed_over_at["gpt-4"] -= 61
+    assert router.select("coaching") == "gpt-4"
+    assert "gpt-4" not in router._samples
+
+
+def test_fails_over_on_p95_latency():
+    router = make_router()
+    for latency_ms in (100, 200, 300, 5000):
+        router.record("gpt-4", latency_ms)
+    assert router.select("coaching") == "gpt-3.5-turbo"
+
+
+def test_retry_model():
+    router = make_router()
+    assert router.retry_model("gpt-4") == "gpt-3.5-turbo"
+    assert router.retry_model("gpt-3.5-turbo") is None
+    assert make_router(fallback_model=None).retry_model("gpt-4") is None
+
+
+def test_estimate_cost_uses_model_pricing():
+    router = make_router()
+    assert router.estimate_cost("gpt-4", 1000, 500) == pytest.approx(0.03 + 0.03)
+    assert router.estimate_cost("unknown", 1000, 500) == 0.0
+
+    router.record("gpt-4", 100, prompt_tokens=1000, completion_tokens=500)
+    router.record("gpt-3.5-turbo", 100, prompt_tokens=2000, completion_tokens=1000)
+    stats = router.get_stats()
+    assert stats["models"]["gpt-4"]["cost_usd"] == pytest.approx(0.06)
+    assert stats["total_cost_usd"] == pytest.approx(0.06 + 0.003 + 0.002)
+
+
+def test_stream_first_token_latency_is_tracked_separately():
+    router = make_router()
+    # 長串流回應不與非串流的完整延遲混在同一個統計
+    for latency_ms in (100, 200, 300, 400):
+        router.record("gpt-4", 800)
+        router.record("gpt-4", latency_ms, streamed=True)
+    assert router.select("coaching") == "gpt-4"
+    stats = router.get_stats()["models"]["gpt-4"]
+    assert stats["window_calls"] == 4
+    assert stats["stream_window_calls"] == 4
+    assert stats["p95_time_to_first_token_ms"] == 400
+
+    # 首個token過慢時同樣改用備援模型
+    for _ in range(4):
+        router.record("gpt-4", 5000, streamed=True)
+    assert router.select("coaching") == "gpt-3.5-turbo"
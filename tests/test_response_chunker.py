@@ -0,0 +1,51 @@
+"""
+串流回應分段測試
+"""
+from app.services.response_chunker import ResponseChunker
+
+
+def feed_all(chunker: ResponseChunker, text: str, step: int = 1):
+    chunks = []
+    for index in range(0, len(text), step):
+        chunks.extend(chunker.feed(text[index:index + step]))
+    last_chunk = chunker.flush()
+    if last_chunk:
+        chunks.append(last_chunk)
+    return chunks
+
+
+def test_first_chunk_is_short_and_later_chunks_are_longer():
+    chunker = ResponseChunker(first_chunk_min_chars=5, chunk_min_chars=20, chunk_max_chars=100)
+    text = "你好，我是助理。我們先確認目標。再來列出步驟。最後檢查結果是否符合預期。"
+
+    chunks = feed_all(chunker, text)
+
+    assert chunks[0] == "你好，我是助理。"
+    assert all(len(chunk) >= 20 for chunk in chunks[1:-1])
+    assert "".join(chunks) == text
+    assert chunker.chunk_count == len(chunks)
+
+
+def test_closing_marks_stay_with_sentence():
+    chunker = ResponseChunker(first_chunk_min_chars=3, chunk_min_chars=3, chunk_max_chars=100)
+
+    # 句尾之後的收尾符號可能在下一批內容才出現
+    assert chunker.feed("他說「好的。") == []
+    assert chunker.feed("」接著離開了。") == ["他說「好的。」"]
+    assert chunker.flush() == "接著離開了。"
+
+
+def test_paragraph_break_and_english_sentences():
+    chunker = ResponseChunker(first_chunk_min_chars=5, chunk_min_chars=5, chunk_max_chars=100)
+
+    chunks = feed_all(chunker, "First step\n\nSecond step. Third one", step=4)
+
+    assert chunks == ["First step", "Second step.", "Third one"]
+
+
+def test_long_text_without_sentence_end_is_cut_at_max_chars():
+    chunker = ResponseChunker(first_chunk_min_chars=5, chunk_min_chars=5, chunk_max_chars=10)
+
+    assert chunker.feed("一二三四，五六七八九十十一") == ["一二三四，"]
+    assert chunker.feed("二三四五六七八九十") == ["五六七八九十十一二三"]
+    assert chunker.flush() == "四五六七八九十"
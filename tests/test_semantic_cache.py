@@ -0,0 +1,64 @@
+"""
+首輪訊息相似度快取測試
+"""
+import json
+
+from app.services.semantic_cache import FirstTurnCache, MinHasher
+
+RESPONSE = "我們先把目標拆成三個步驟，從最容易開始。"
+OPENER = "我想學習如何規劃我的時間"
+
+
+def test_normalize_ignores_case_spaces_and_punctuation():
+    hasher = MinHasher()
+    assert hasher.normalize("  Hello，世界！ ") == "hello世界"
+    assert hasher.signature(hasher.shingles("我想學習")) == hasher.signature(hasher.shingles("我想 學習。"))
+
+
+def test_hit_only_for_near_identical_approved_question():
+    cache = FirstTurnCache()
+    assert cache.add_answer("planning", OPENER, RESPONSE)
+
+    # 只有標點與空白不同視為相同提問
+    response, similarity = cache.lookup("planning", "我想學習，如何規劃我的時間？")
+    assert response == RESPONSE
+    assert similarity == 1.0
+
+    # 多出一個字：12個bigram中相同11個，低於0.95
+    assert cache.lookup("planning", OPENER + "呢") is None
+
+
+def test_personalised_questions_do_not_match():
+    cache = FirstTurnCache()
+    cache.add_answer("planning", "幫我準備下週五第四季董事會的簡報", RESPONSE)
+
+    assert cache.lookup("planning", "幫我準備下週三第三季董事會的簡報") is None
+    assert cache.lookup("planning", "幫我準備下週五第四季部門會議的簡報") is None
+    stats = cache.get_stats()["by_category"]["planning"]
+    assert stats["hits"] == 0
+    assert stats["misses"] == 2
+
+
+def test_answers_are_separated_by_category_and_cleared():
+    cache = FirstTurnCache()
+    cache.add_answer("planning", OPENER, RESPONSE)
+
+    assert cache.lookup("career", OPENER) is None
+    cache.clear("planning")
+    assert cache.lookup("planning", OPENER) is None
+
+
+def test_load_file_and_disabled_cache(tmp_path):
+    path = tmp_path / "answers.json"
+    path.write_text(json.dumps({
+        "planning": [{"message": OPENER, "response": RESPONSE}, {"message": "", "response": RESPONSE}]
+    }, ensure_ascii=False), encoding="utf-8")
+
+    cache = FirstTurnCache()
+    assert cache.load_file(str(path)) == 1
+    assert cache.lookup("planning", OPENER) == (RESPONSE, 1.0)
+    assert FirstTurnCache().load_file(str(tmp_path / "missing.json")) == 0
+
+    disabled = FirstTurnCache(enabled=False)
+    disabled.load_file(str(path))
+    assert disabled.lookup("planning", OPENER) is None
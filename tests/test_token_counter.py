@@ -0,0 +1,37 @@
+"""
+Token計數與上下文預算測試
+"""
+from app.core.config import Settings
+from app.services.context_builder import ContextBuilder
+from app.services.token_counter import TokenCounter
+
+
+def test_encoding_for_model():
+    assert TokenCounter.encoding_for_model("gpt-4") == "cl100k_base"
+    assert TokenCounter.encoding_for_model("gpt-3.5-turbo") == "cl100k_base"
+    assert TokenCounter.encoding_for_model("gpt-4o-mini") == "o200k_base"
+    assert TokenCounter.encoding_for_model("gpt-4o") == "o200k_base"
+
+
+def test_budget_keeps_margin_when_count_is_approximate():
+    counter = TokenCounter()
+    settings = Settings(
+        context_token_budget=3000,
+        context_token_budgets={"gpt-4": 6000, "gpt-4o": 8000},
+        context_token_margin=0.25
+    )
+    builder = ContextBuilder(settings, counter)
+
+    if counter.backend == "tiktoken":
+        assert counter.is_exact("gpt-4")
+        assert builder.get_token_budget("gpt-4") == 6000
+    assert not counter.is_exact("gpt-4o")
+    assert builder.get_token_budget("gpt-4o") == 6000
+
+
+def test_heuristic_count_is_never_exact():
+    counter = TokenCounter(vocab_dir="/nonexistent")
+
+    assert counter.backend == "heuristic"
+    assert not counter.is_exact("gpt-4")
+    assert counter.count("你好") == 2